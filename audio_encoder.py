@@ -0,0 +1,134 @@
+"""
+Compressed episode output through one long-lived ffmpeg process.
+
+The PCM that is written to the episode WAV is also piped to ffmpeg's stdin,
+so the compressed file (Opus, AAC or MP3) is finished together with the WAV
+instead of in a separate encode pass. A feeder thread owns the pipe: write()
+only queues the block, and the bounded queue keeps the caller at most
+QUEUE_BLOCKS ahead of the encoder.
+
+Settings (environment):
+  TTS_OUTPUT_FORMAT    opus, aac or mp3 (default off: only the WAV is written)
+  TTS_OUTPUT_BITRATE   ffmpeg bitrate such as 48k (default depends on the codec)
+"""
+import os
+import queue
+import shutil
+import subprocess
+import threading
+
+# format -> (ffmpeg encoder, file extension, default bitrate for mono speech)
+CODECS = {
+    "opus": ("libopus", ".opus", "40k"),
+    "aac": ("aac", ".m4a", "48k"),
+    "mp3": ("libmp3lame", ".mp3", "64k"),
+}
+# ffmpeg raw input format per sample width
+_PCM_FORMATS = {1: "u8", 2: "s16le", 3: "s24le", 4: "s32le"}
+# Blocks queued for the feeder thread before write() blocks
+QUEUE_BLOCKS = 16
+
+
+def encoder_settings_from_env(stem: str) -> dict | None:
+    """Settings for StreamingEncoder for output `stem` + extension; None if unset, off or without ffmpeg.
+
+    The WAV is written either way, so the episode keeps its .wav name when
+    there is no compressed copy.
+    """
+    name = os.environ.get("TTS_OUTPUT_FORMAT", "").strip().lower()
+    if name in ("", "off", "none", "false", "no", "wav"):
+        return None
+    if name not in CODECS:
+        print(f"⚠ Ignoring invalid TTS_OUTPUT_FORMAT={name!r}, writing only the WAV")
+        return None
+    if not shutil.which("ffmpeg"):
+        print(f"⚠ ffmpeg not found — writing only the WAV, no {name} output")
+        return None
+    encoder, extension, bitrate = CODECS[name]
+    return {"path": stem + extension, "codec": encoder,
+            "bitrate": os.environ.get("TTS_OUTPUT_BITRATE", "").strip() or bitrate}
+
+
+def encoder_output_args(path: str, codec: str, bitrate: str) -> list[str]:
+    """ffmpeg output options writing `path` with `codec` at `bitrate`."""
+    args = ["-vn", "-c:a", codec, "-b:a", bitrate]
+    if codec == "libopus":
+        args += ["-application", "voip"]
+    if path.endswith(".m4a"):
+        # Index up front so players can start before the download completes
+        args += ["-movflags", "+faststart"]
+    return args + [path]
+
+
+class StreamingEncoder:
+    """ffmpeg reading raw PCM in `params` format from stdin, encoding to `path`.
+
+    Use as a context manager: leaving the block normally waits for ffmpeg
+    to finish the file; leaving it with an exception kills ffmpeg and
+    removes the partial output.
+    """
+
+    def __init__(self, params, path: str, codec: str, bitrate: str):
+        self.path = path
+        cmd = ["ffmpeg", "-y", "-hide_banner", "-loglevel", "error",
+               "-f", _PCM_FORMATS[params.sampwidth], "-ar", str(params.framerate), "-ac", str(params.nchannels),
+               "-i", "pipe:0", *encoder_output_args(path, codec, bitrate)]
+        self._process = subprocess.Popen(cmd, stdin=subprocess.PIPE, stderr=subprocess.PIPE)
+        self._queue = queue.Queue(maxsize=QUEUE_BLOCKS)
+        self._error = None
+        self._stderr = b""
+        self._feeder = threading.Thread(target=self._feed, name="ffmpeg-feeder", daemon=True)
+        self._feeder.start()
+        self.bytes_in = 0
+
+    def _feed(self):
+        stdin = self._process.stdin
+        try:
+            while (block := self._queue.get()) is not None:
+                stdin.write(block)
+        except OSError as e:
+            # ffmpeg exited early; keep draining so write() never blocks forever
+            self._error = e
+            while self._queue.get() is not None:
+                pass
+        finally:
+            try:
+                stdin.close()
+            except OSError:
+                pass
+
+    def write(self, pcm) -> None:
+        """Queue PCM bytes for the encoder; blocks while the queue is full."""
+        if len(pcm):
+            # The caller may reuse its buffer
+            self._queue.put(bytes(pcm))
+            self.bytes_in += len(pcm)
+
+    def close(self) -> None:
+        """Finish the stream and wait for ffmpeg; raises RuntimeError if encoding failed."""
+        self._queue.put(None)
+        self._feeder.join()
+        self._stderr = self._process.stderr.read()
+        if self._process.wait() != 0 or self._error is not None:
+            message = self._stderr.decode(errors="replace").strip() or str(self._error)
+            raise RuntimeError(f"ffmpeg could not encode {self.path}: {message}")
+
+    def abort(self) -> None:
+        """Stop ffmpeg and remove the partial output."""
+        self._process.kill()
+        self._queue.put(None)
+        self._feeder.join()
+        self._process.wait()
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
@@ -0,0 +1,216 @@
+"""
+TTS backend chain with a circuit breaker per backend.
+
+A chunk goes to the first backend in the chain whose breaker is closed.
+Rate limits (429), stream disconnects and request errors count against a
+backend; after TTS_BREAKER_FAILURES of them in a row its breaker opens for
+TTS_BREAKER_COOLDOWN seconds. Chunks still retrying on that backend give
+up and move on to the next one, so an exhausted pro quota turns into flash
+requests and, last, into local pyttsx3 speech (resampled to 24 kHz) instead
+of an aborted episode. When the cooldown has passed, one chunk is sent to
+the backend as a trial; success closes the breaker again.
+
+Settings (environment):
+  TTS_BACKENDS            comma-separated chain: model names, "pro", "flash" or "local"
+                          (default: the script's model, then flash, then local)
+  TTS_BREAKER_FAILURES    failures in a row that open a breaker (default 3)
+  TTS_BREAKER_COOLDOWN    seconds a breaker stays open (default 600)
+"""
+import asyncio
+import os
+import tempfile
+import threading
+import time
+
+from resample_chunks import TARGET_RATE, resample_file
+from wav_io import read_wav_layout
+
+PRO_MODEL = "models/gemini-2.5-pro-preview-tts"
+FLASH_MODEL = "models/gemini-2.5-flash-preview-tts"
+LOCAL = "local"
+_ALIASES = {"pro": PRO_MODEL, "flash": FLASH_MODEL}
+DEFAULT_FAILURES = 3
+DEFAULT_COOLDOWN = 600.0
+
+
+class BackendUnavailable(Exception):
+    """The backend's circuit breaker is open; the chunk should move to the next backend."""
+
+
+class CircuitBreaker:
+    """closed -> open after `failures` failures in a row -> half-open trial after `cooldown` seconds."""
+
+    def __init__(self, name: str, failures: int = DEFAULT_FAILURES, cooldown: float = DEFAULT_COOLDOWN):
+        self.name = name
+        self.failures = max(1, failures)
+        self.cooldown = cooldown
+        self._lock = threading.Lock()
+        self.state = "closed"
+        self.consecutive = 0
+        self.opened_at = 0.0
+        self.trips = 0
+
+    def allow(self) -> bool:
+        """May a new chunk use this backend? After the cooldown, the first caller gets the trial."""
+        with self._lock:
+            now = time.monotonic()
+            if self.state == "closed":
+                return True
+            if now - self.opened_at < self.cooldown:
+                return False
+            # Cooldown over (or a trial that never reported back): one trial chunk
+            self.state = "half-open"
+            self.opened_at = now
+            return True
+
+    def is_open(self) -> bool:
+        """True while retries on this backend should stop."""
+        with self._lock:
+            return self.state == "open"
+
+    def record_success(self):
+        with self._lock:
+            self.state = "closed"
+            self.consecutive = 0
+
+    def record_failure(self, reason: str = "") -> bool:
+        """Count one failure; returns True if this opened the breaker."""
+        with self._lock:
+            self.consecutive += 1
+            if self.state == "open" or (self.state == "closed" and self.consecutive < self.failures):
+                return False
+        self.trip(reason)
+        return True
+
+    def trip(self, reason: str = ""):
+        """Open the breaker now, after failures in a row."""
+        self._open()
+        print(f"  ⚡ Backend {self.name}: circuit open for {self.cooldown:.0f}s after "
+              f"{self.consecutive} failure(s){f' ({reason})' if reason else ''}")
+
+    def disable(self, reason: str):
+        """Open the breaker for the rest of the run, e.g. for a backend that is not installed."""
+        self._open(cooldown=float("inf"))
+        print(f"  ⚡ Backend {self.name}: disabled for this run ({reason})")
+
+    def _open(self, cooldown: float | None = None):
+        with self._lock:
+            if cooldown is not None:
+                self.cooldown = cooldown
+            self.state = "open"
+            self.opened_at = time.monotonic()
+            self.trips += 1
+
+    def retry_in(self) -> float:
+        """Seconds until the breaker allows a trial (0 if it already does)."""
+        with self._lock:
+            if self.state == "closed":
+                return 0.0
+            return max(0.0, self.opened_at + self.cooldown - time.monotonic())
+
+
+class Backend:
+    """One entry of the chain: a Gemini model, or local pyttsx3 speech when `model` is "local"."""
+
+    def __init__(self, model: str, failures: int = DEFAULT_FAILURES, cooldown: float = DEFAULT_COOLDOWN):
+        self.model = model
+        self.breaker = CircuitBreaker(model, failures, cooldown)
+        self.chunks = 0
+
+    @property
+    def local(self) -> bool:
+        return self.model == LOCAL
+
+
+class BackendChain:
+    """Ordered backends; available() yields the ones a new chunk may use."""
+
+    def __init__(self, backends: list[Backend]):
+        self.backends = backends
+        self._local = None
+
+    @classmethod
+    def from_env(cls, default: list[str]):
+        raw = os.environ.get("TTS_BACKENDS", "").strip()
+        names = [n.strip() for n in raw.split(",") if n.strip()] if raw else default
+        failures = DEFAULT_FAILURES
+        cooldown = DEFAULT_COOLDOWN
+        try:
+            failures = int(os.environ.get("TTS_BREAKER_FAILURES", "").strip() or failures)
+            cooldown = float(os.environ.get("TTS_BREAKER_COOLDOWN", "").strip() or cooldown)
+        except ValueError as e:
+            print(f"⚠ Ignoring invalid circuit breaker setting: {e}")
+        models = []
+        for name in names:
+            model = _ALIASES.get(name, name)
+            if model not in models:
+                models.append(model)
+        return cls([Backend(model, failures, cooldown) for model in models])
+
+    def available(self):
+        """Yield the backends a new chunk may try, in chain order.
+
+        Lazy, so a later backend's trial slot is only taken when the chunk
+        actually gets that far.
+        """
+        for backend in self.backends:
+            if backend.breaker.allow():
+                yield backend
+
+    def describe(self) -> str:
+        return " → ".join(backend.model for backend in self.backends)
+
+    def summary(self) -> str:
+        return ", ".join(f"{backend.model}: {backend.chunks} chunks"
+                         + (f", tripped {backend.breaker.trips}x" if backend.breaker.trips else "")
+                         for backend in self.backends)
+
+    async def synthesize_local(self, text: str) -> list[tuple[bytes, str]]:
+        """Speak `text` with pyttsx3 in a worker thread; 16-bit mono PCM at TARGET_RATE."""
+        if self._local is None:
+            self._local = LocalSpeech()
+        return await asyncio.to_thread(self._local.synthesize, text)
+
+
+def local_engine():
+    """pyttsx3 engine with a German voice if one is installed (ImportError without pyttsx3)."""
+    import pyttsx3
+    engine = pyttsx3.init()
+    german_voice = None
+    for v in engine.getProperty("voices"):
+        name = v.name.lower() + " " + (getattr(v, "id", "")).lower()
+        if "german" in name or "de_" in name or "de-" in name or "deu" in name:
+            german_voice = v.id
+            break
+    if german_voice:
+        engine.setProperty("voice", german_voice)
+        print("Using German voice:", german_voice)
+    else:
+        print("German voice not found, using default voice")
+    engine.setProperty("rate", 150)  # slightly slower for clarity
+    return engine
+
+
+class LocalSpeech:
+    """pyttsx3 speech as raw PCM; one engine, used by one thread at a time."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._engine = None
+
+    def synthesize(self, text: str) -> list[tuple[bytes, str]]:
+        with self._lock, tempfile.TemporaryDirectory(prefix=".local-tts-") as tmp:
+            if self._engine is None:
+                self._engine = local_engine()
+            raw_path = os.path.join(tmp, "chunk.wav")
+            self._engine.save_to_file(text, raw_path)
+            self._engine.runAndWait()
+            if not os.path.exists(raw_path):
+                raise RuntimeError("pyttsx3 wrote no file")
+            # pyttsx3 voices write 22050 Hz; deliver what Gemini delivers
+            out_path = os.path.join(tmp, "chunk24k.wav")
+            resample_file(raw_path, out_path, TARGET_RATE, sampwidth=2, channels=1)
+            _, offset, length = read_wav_layout(out_path)
+            with open(out_path, "rb") as f:
+                f.seek(offset)
+                return [(f.read(length), f"audio/L16;rate={TARGET_RATE}")]
@@ -0,0 +1,336 @@
+#!/usr/bin/env python3
+"""
+Render several episodes in one process under one request budget.
+
+Every script becomes an episode in a directory of its own,
+<out>/<script name>/, with the same files a single run leaves in the
+project root (script.txt, Podcast_Audio_{i}.wav, podcast_manifest.json,
+Podcast_Audio_full.wav, podcast_metrics.json), so resume, concat and the
+other tools work there unchanged.
+
+All episodes share one genai client and its connection pool, the rate
+limiter of each model (rate_limiter.py), the backend chain with its
+circuit breakers, the chunk audio cache and the chunk-size history.
+TTS_CONCURRENCY is the number of requests in flight for the whole batch,
+not per episode: a free request slot goes to the episodes that are waiting
+for one in turn, so a long episode cannot starve a short one and, once the
+short ones are done, the long one gets every slot. Each episode has its own
+episode writer and its own manifest; a failing episode is reported and the
+others carry on.
+
+Usage:
+  python batch.py ger_skript.txt engl.skript.txt [--pro] [--out batch]
+"""
+import argparse
+import asyncio
+import glob
+import json
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from backends import FLASH_MODEL, LOCAL, PRO_MODEL, BackendChain
+
+DEFAULT_OUT = "batch"
+REPORT_NAME = "batch_report.json"
+
+
+class FairSlots:
+    """At most `limit` chunk requests in flight; free slots go round-robin over the waiting episodes."""
+
+    def __init__(self, limit: int):
+        self.limit = max(1, limit)
+        self.in_flight = 0
+        # episode -> waiting futures; dict order is the round-robin order
+        self._waiting = {}
+        self.granted = {}
+
+    def for_episode(self, name: str) -> "EpisodeSlot":
+        self.granted.setdefault(name, 0)
+        return EpisodeSlot(self, name)
+
+    async def acquire(self, name: str):
+        if self.in_flight < self.limit and not self._waiting:
+            self.in_flight += 1
+            self.granted[name] += 1
+            return
+        future = asyncio.get_running_loop().create_future()
+        self._waiting.setdefault(name, deque()).append(future)
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.cancelled():
+                waiters = self._waiting.get(name)
+                if waiters is not None and future in waiters:
+                    waiters.remove(future)
+                    if not waiters:
+                        del self._waiting[name]
+            else:
+                self.release()  # granted, but cancelled before it could run
+            raise
+
+    def release(self):
+        self.in_flight -= 1
+        while self.in_flight < self.limit and self._waiting:
+            name = next(iter(self._waiting))
+            waiters = self._waiting.pop(name)
+            future = waiters.popleft()
+            if waiters:
+                self._waiting[name] = waiters  # back to the end of the line
+            if future.cancelled():
+                continue
+            future.set_result(None)
+            self.in_flight += 1
+            self.granted[name] += 1
+
+
+class EpisodeSlot:
+    """`async with` view of FairSlots for one episode, used by synthesize_chunks()."""
+
+    def __init__(self, slots: FairSlots, name: str):
+        self.slots = slots
+        self.name = name
+
+    async def __aenter__(self):
+        await self.slots.acquire(self.name)
+
+    async def __aexit__(self, *exc):
+        self.slots.release()
+
+
+def episode_directories(scripts, out: Path) -> list[Path]:
+    """<out>/<script stem>, numbered when two scripts share a stem."""
+    directories = []
+    for script in scripts:
+        stem = Path(script).stem
+        directory, n = out / stem, 1
+        while directory in directories:
+            n += 1
+            directory = out / f"{stem}-{n}"
+        directories.append(directory)
+    return directories
+
+
+class Episode:
+    """One script of the batch: its chunks, manifest, metrics and episode writer."""
+
+    def __init__(self, script: str, directory: Path, model: str, max_chars: int, workers: int, library=None):
+        from audio_encoder import encoder_settings_from_env
+        from episode_pipeline import EpisodeWriter
+        from hedging import HedgePolicy
+        from job_manifest import JobManifest
+        from loudness import loudness_target_from_env, true_peak_from_env
+        from run_metrics import RunMetrics
+        from seams import seam_settings_from_env
+        from segment_library import SegmentSplicer, plan_script, record_segments
+
+        self.script = script
+        self.directory = directory
+        self.name = directory.name
+        self.error = None
+        self.finished_after = None
+        text = Path(script).read_text(encoding="utf-8")
+        directory.mkdir(parents=True, exist_ok=True)
+        # Files only, as in the generators: a profile directory is kept
+        for old_file in glob.glob(str(directory / "Podcast_Audio_*")):
+            if os.path.isfile(old_file):
+                os.remove(old_file)
+        # The tools expect the script next to the job
+        (directory / "script.txt").write_text(text, encoding="utf-8")
+        self.metrics = RunMetrics.from_env(model, script)
+        if self.metrics.stem is not None:
+            self.metrics.stem = str(directory / os.path.basename(self.metrics.stem))
+        with self.metrics.stage("chunking"):
+            self.plan = plan_script(text, max_chars=max_chars, library=library)
+        self.chunks = self.plan.chunks
+        self.chars = sum(len(c) for c in self.chunks)
+        self.manifest = JobManifest.create(self.plan.texts, model, "script.txt", directory / "podcast_manifest.json")
+        record_segments(self.manifest, self.plan)
+        if self.plan.segments:
+            self.metrics.record_segments(len(self.plan.segments), self.plan.segment_chars)
+        # Per episode: the budget is a share of this episode's chunks
+        self.hedge = HedgePolicy.from_env()
+        self.output_wav = str(directory / "Podcast_Audio_full.wav")
+        self.encode = encoder_settings_from_env(str(directory / "Podcast_Audio_full"))
+        self.writer = EpisodeWriter(self.output_wav, loudness_target=loudness_target_from_env(),
+                                    true_peak_db=true_peak_from_env(), seams=seam_settings_from_env(),
+                                    encode=self.encode, workers=workers)
+        self.splicer = SegmentSplicer(self.plan, self.write_chunk, self.writer.add)
+        print(f"✓ {self.name}: {len(text)} characters, {len(self.chunks)} chunks"
+              + (f", {len(self.plan.segments)} library segments" if self.plan.segments else "") + f" -> {directory}/")
+
+    def write_chunk(self, idx, parts, attempts):
+        """Called in chunk order from a worker thread: write the chunk files, record them, queue them for the episode."""
+        from job_manifest import describe_audio_file
+        from wav_io import write_audio_segment
+
+        files = []
+        for n, (data, mime_type) in enumerate(parts):
+            stem = f"Podcast_Audio_{idx}" if n == 0 else f"Podcast_Audio_{idx}_{n}"
+            path = write_audio_segment(str(self.directory / stem), data, mime_type)
+            record = describe_audio_file(path)
+            # Relative to the episode directory, where the tools run
+            record["path"] = os.path.basename(path)
+            files.append((path, record))
+        if files:
+            self.manifest.mark_done(idx, [record for _, record in files], attempts)
+            for path, _ in files:
+                self.writer.add(path)
+        else:
+            self.manifest.mark_failed(idx, "no audio in response", attempts)
+
+    async def render(self, client, model, config, slots: FairSlots, concurrency: int, cache, history, chain,
+                     started: float):
+        from tts_synthesis import synthesize_chunks
+
+        try:
+            with self.metrics.stage("synthesis"):
+                await synthesize_chunks(client, model, self.chunks, config, self.splicer.chunk_ready, concurrency,
+                                        cache, history, hedge=self.hedge, chain=chain, metrics=self.metrics,
+                                        slots=slots.for_episode(self.name))
+                # Trailing library segments go to the writer too, which may block on its queue
+                await asyncio.to_thread(self.splicer.finish)
+            with self.metrics.stage("finish"):
+                # The writer thread finishes the file; the other episodes keep synthesizing meanwhile
+                params, total_size, used = await asyncio.to_thread(self.writer.close)
+        except Exception as e:
+            self.error = f"{type(e).__name__}: {e}"
+            self.writer.abort()
+        self.finished_after = time.monotonic() - started
+        if self.error is None and not used:
+            self.error = "no valid WAV chunks to concatenate"
+        if self.error is not None:
+            self.metrics.write()
+            print(f"✗ {self.name}: {self.error}")
+            return
+        self.metrics.record_episode(total_size, params, len(used))
+        self.metrics.write()
+        print(f"✓ {self.name}: {self.output_wav} after {self.finished_after:.0f}s ({self.metrics.summary()})")
+
+
+async def render_batch(client, model, config, episodes: list[Episode], slots: FairSlots, concurrency: int,
+                       cache, history, chain, started: float):
+    # Every episode may have a handover blocked on its full writer queue and a writer.close()
+    # waiting for its thread; size the pool so those cannot take the threads the others need.
+    loop = asyncio.get_running_loop()
+    loop.set_default_executor(ThreadPoolExecutor(max_workers=2 * len(episodes) + 4))
+    await asyncio.gather(*(episode.render(client, model, config, slots, concurrency, cache, history, chain, started)
+                           for episode in episodes))
+
+
+def batch_report(episodes: list[Episode], slots: FairSlots, model: str, wall: float) -> dict:
+    from rate_limiter import get_rate_limiter
+
+    reports = [episode.metrics.report() for episode in episodes]
+    requests = sum(entry["requests"] for report in reports for entry in report["models"].values())
+    chars = sum(report["chars_in"] for report in reports)
+    limiter = get_rate_limiter(model)
+    return {
+        "model": model,
+        "wall_seconds": wall,
+        "concurrency": slots.limit,
+        "requests": requests,
+        "requests_per_min": requests / wall * 60 if wall else None,
+        "chars_per_min": chars / wall * 60 if wall else None,
+        "budget": {"requests_per_min": limiter.requests.max_rate * 60, "chars_per_min": limiter.chars.max_rate * 60},
+        "episodes": [{
+            "script": episode.script,
+            "directory": str(episode.directory),
+            "chunks": len(episode.chunks),
+            "chars": episode.chars,
+            "slots_granted": slots.granted.get(episode.name, 0),
+            "finished_after": episode.finished_after,
+            "audio_seconds": report["episode"].get("audio_seconds"),
+            "error": episode.error,
+        } for episode, report in zip(episodes, reports)],
+    }
+
+
+def run_batch(scripts, out=DEFAULT_OUT, model=FLASH_MODEL) -> int:
+    from google import genai
+
+    from chunk_cache import ChunkAudioCache
+    from chunk_sizing import ChunkSizeHistory
+    from segment_library import SegmentLibrary
+    from tts_synthesis import concurrency_from_env, http_options_from_env, speech_config
+
+    print("\n" + "="*60)
+    print(f"BATCH OF {len(scripts)} EPISODES")
+    print("="*60)
+    client = genai.Client(api_key=os.environ.get("GEMINI_API_KEY"), http_options=http_options_from_env())
+    print(f"✓ Gemini API client initialized, model {model}")
+    history = ChunkSizeHistory.from_env()
+    max_chars = history.choose(model)
+    concurrency = concurrency_from_env()
+    # The writers share the CPUs instead of one pool of cpu_count threads each
+    workers = max(1, (os.cpu_count() or 1) // len(scripts))
+    library = SegmentLibrary.from_env()
+    if library is not None:
+        print(f"✓ Segment library: {library.describe()}")
+    episodes = [Episode(script, directory, model, max_chars, workers, library)
+                for script, directory in zip(scripts, episode_directories(scripts, Path(out)))]
+    cache = ChunkAudioCache.from_env()
+    if cache is not None:
+        print(f"✓ Chunk audio cache: {cache.directory} ({len(cache)} entries)")
+    chain = BackendChain.from_env([model, FLASH_MODEL, LOCAL])
+    print(f"✓ Backend chain: {chain.describe()}")
+    slots = FairSlots(concurrency)
+    print("\n" + "-"*60)
+    print(f"GENERATING {sum(len(e.chunks) for e in episodes)} CHUNKS ({concurrency} requests in flight for the batch)")
+    print("-"*60)
+    started = time.monotonic()
+    try:
+        asyncio.run(render_batch(client, model, speech_config(), episodes, slots, concurrency, cache, history, chain,
+                                 started))
+    finally:
+        history.save()
+        if cache is not None:
+            cache.save_stats()
+    report = batch_report(episodes, slots, model, time.monotonic() - started)
+    report_path = str(Path(out) / REPORT_NAME)
+    Path(report_path).write_text(json.dumps(report, indent=1), encoding="utf-8")
+    print("\n" + "-"*60)
+    print(f"✓ Backends: {chain.summary()}")
+    print(f"✓ {report['requests']} requests in {report['wall_seconds']:.0f}s: "
+          f"{report['requests_per_min']:.1f} requests/min, {report['chars_per_min']:.0f} chars/min "
+          f"(budget {report['budget']['requests_per_min']:g} requests/min, "
+          f"{report['budget']['chars_per_min']:g} chars/min; 0 = unlimited)")
+    for entry in report["episodes"]:
+        print(f"  {'✗' if entry['error'] else '✓'} {entry['directory']}: {entry['chunks']} chunks, "
+              f"{entry['slots_granted']} request slots, done after {entry['finished_after']:.0f}s"
+              + (f" — {entry['error']}" if entry["error"] else ""))
+    print(f"✓ Batch report written: {report_path}")
+    return 1 if any(e.error for e in episodes) else 0
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Render several episodes under one request budget")
+    parser.add_argument("scripts", nargs="+", help="script files, one episode each")
+    parser.add_argument("--pro", action="store_true", help=f"use {PRO_MODEL} instead of {FLASH_MODEL}")
+    parser.add_argument("--out", default=DEFAULT_OUT, help="directory for the episode directories")
+    args = parser.parse_args(argv)
+    missing = [script for script in args.scripts if not os.path.isfile(script)]
+    if missing:
+        print(f"✗ Script not found: {', '.join(missing)}")
+        return 1
+
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    if not os.environ.get("GEMINI_API_KEY"):
+        print("✗ GEMINI_API_KEY not found in environment. Please add it to a .env file or export it as an environment variable.")
+        return 1
+    try:
+        return run_batch(args.scripts, args.out, PRO_MODEL if args.pro else FLASH_MODEL)
+    except Exception as e:
+        print(f"✗ ERROR: {e}")
+        import traceback
+        traceback.print_exc()
+        return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+"""
+End-to-end throughput benchmark against the local mock API.
+
+Runs the generator's full generate() path (chunking, concurrent synthesis,
+episode writer) in a fresh working directory per run, against an in-process
+mock_gemini_server.py, for every combination of script, concurrency and
+chunk size. Scripts are the bundled ones and synthetic book-length scripts
+("synthetic:<chars>", turns of the bundled scripts repeated to that length).
+
+Each run happens in a child process, so peak RSS is per run. Results go to a
+JSON file, one record per run: wall time, chunks/s, characters/s, p50/p95
+chunk latency (including retries), stage timings and real-time factor from
+the generator's run report (run_metrics.py), requests per chunk, injected
+failures served, peak RSS and bytes written. The top level of the file
+repeats the console's summary over all runs: peak RSS, p50/p95 latency of
+every synthesized chunk and bytes written.
+
+Usage:
+  python benchmark.py                                   # bundled scripts + 200k chars, default sweep
+  python benchmark.py --scripts ger_skript.txt synthetic:1000000 --concurrency 3 6 12 --chunk-chars 1500
+  python benchmark.py --rate-429 0.05 --disconnect-rate 0.02 --output bench.json
+
+The chunk audio cache is off; the rate limiter is off unless
+--requests-per-min / --chars-per-min are given, so the numbers measure the
+pipeline rather than the quota.
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from mock_gemini_server import DEFAULTS, MockGeminiServer, MockState
+from script_chunker import format_turn, parse_script
+
+REPO = Path(__file__).resolve().parent
+BUNDLED_SCRIPTS = ["script.txt", "ger_skript.txt", "engl.skript.txt"]
+DEFAULT_SYNTHETIC = ["synthetic:200000"]
+GENERATORS = {"flash": "IVSC_Podcast_German_flash", "pro": "IVSC_Podcast_German"}
+METRICS_STEM = "run_metrics"
+
+
+def synthetic_script(chars: int) -> str:
+    """Book-length script: the bundled scripts' turns, cycled until `chars` characters."""
+    preamble, turns = parse_script((REPO / "ger_skript.txt").read_text(encoding="utf-8"))
+    turns += parse_script((REPO / "engl.skript.txt").read_text(encoding="utf-8"))[1]
+    parts = [preamble]
+    size = len(preamble)
+    i = 0
+    while size < chars:
+        parts.append(format_turn(turns[i % len(turns)]))
+        size += len(parts[-1]) + 2
+        i += 1
+    return "\n\n".join(parts)
+
+
+def load_script(name: str) -> str:
+    if name.startswith("synthetic:"):
+        return synthetic_script(int(name.split(":", 1)[1]))
+    return Path(name if os.path.isabs(name) else REPO / name).read_text(encoding="utf-8")
+
+
+def run_one(generator: str, result_path: str):
+    """Child process: run generate() in the current directory and write its run report and peak RSS."""
+    sys.path.insert(0, str(REPO))
+    module = __import__(generator)
+    error = None
+    try:
+        module.generate()
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"
+    usage = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    peak_rss = usage if sys.platform == "darwin" else usage * 1024
+    episode = Path("Podcast_Audio_full.wav")
+    chunk_files = [p for p in Path(".").glob("Podcast_Audio_*") if not p.name.startswith("Podcast_Audio_full")]
+    Path(result_path).write_text(json.dumps({
+        "error": error,
+        "report": json.loads(Path(METRICS_STEM + ".json").read_text(encoding="utf-8")),
+        "peak_rss_bytes": peak_rss,
+        "episode_bytes": episode.stat().st_size if episode.exists() else 0,
+        "chunk_bytes": sum(p.stat().st_size for p in chunk_files),
+    }), encoding="utf-8")
+
+
+def _stats_delta(before: dict, after: dict) -> dict:
+    return {key: after[key] - before.get(key, 0) for key in after}
+
+
+def _quantile(values: list[float], q: float) -> float | None:
+    """Linearly interpolated quantile, as numpy.quantile() computes it."""
+    if not values:
+        return None
+    values = sorted(values)
+    pos = q * (len(values) - 1)
+    low = int(pos)
+    high = min(low + 1, len(values) - 1)
+    return values[low] + (values[high] - values[low]) * (pos - low)
+
+
+def summarize(results: list[dict]) -> dict:
+    """Figures over all runs for the top level of the report."""
+    # Runs whose generator crashed have no figures
+    runs = [r for r in results if "wall_seconds" in r]
+    latencies = [latency for r in runs for latency in r.pop("_latencies", [])]
+    return {
+        "peak_rss_bytes": max((r["peak_rss_bytes"] for r in runs), default=None),
+        "latency_p50": _quantile(latencies, 0.5),
+        "latency_p95": _quantile(latencies, 0.95),
+        "bytes_written": sum(r["bytes_written"] for r in runs),
+    }
+
+
+def run_benchmark(args) -> list[dict]:
+    server = MockGeminiServer(MockState({key: getattr(args, key) for key in DEFAULTS}, seed=args.seed))
+    base_url = server.start()
+    print(f"✓ Mock API on {base_url}")
+    workroot = Path(tempfile.mkdtemp(prefix="tts-bench-", dir=args.workdir))
+    results = []
+    try:
+        for name in args.scripts:
+            text = load_script(name)
+            for concurrency in args.concurrency:
+                for chunk_chars in args.chunk_chars:
+                    for repeat in range(args.repeat):
+                        label = f"{name} c={concurrency} chars={chunk_chars}" + (f" #{repeat + 1}" if args.repeat > 1 else "")
+                        workdir = workroot / f"run{len(results)}"
+                        workdir.mkdir()
+                        (workdir / "script.txt").write_text(text, encoding="utf-8")
+                        env = {
+                            **os.environ,
+                            "GEMINI_BASE_URL": base_url,
+                            "GEMINI_API_KEY": "mock",
+                            "TTS_CONCURRENCY": str(concurrency),
+                            "TTS_CHUNK_CHARS": str(chunk_chars),
+                            # Synthetic scripts repeat turns; every chunk should reach the API
+                            "TTS_CACHE_MAX_MB": "0",
+                            "TTS_CHUNK_HISTORY": str(workdir / "history.json"),
+                            "TTS_METRICS": METRICS_STEM,
+                            "TTS_REQUESTS_PER_MIN": str(args.requests_per_min),
+                            "TTS_CHARS_PER_MIN": str(args.chars_per_min),
+                            # Gemini backends only: a local pyttsx3 fallback would measure pyttsx3
+                            "TTS_BACKENDS": os.environ.get("TTS_BACKENDS", args.generator),
+                        }
+                        result_path = workdir / "result.json"
+                        before = dict(server.state.stats)
+                        print(f"▶ {label}", flush=True)
+                        with open(workdir / "generate.log", "wb") as log:
+                            subprocess.run([sys.executable, str(Path(__file__).resolve()), "--run-one",
+                                            GENERATORS[args.generator], str(result_path)],
+                                           cwd=workdir, env=env, stdout=log, stderr=subprocess.STDOUT)
+                        served = _stats_delta(before, server.state.stats)
+                        record = {"script": name, "script_chars": len(text), "concurrency": concurrency,
+                                  "chunk_chars": chunk_chars, "repeat": repeat}
+                        if not result_path.exists():
+                            record["error"] = f"generator crashed, see {workdir / 'generate.log'}"
+                            results.append(record)
+                            print(f"  ✗ {record['error']}")
+                            continue
+                        run = json.loads(result_path.read_text(encoding="utf-8"))
+                        report = run.pop("report")
+                        wall = report["wall_seconds"]
+                        record.update(run)
+                        record.update({
+                            "wall_seconds": wall,
+                            "stages": report["stages"],
+                            "chunks": report["chunks_delivered"],
+                            "chunks_per_second": report["chunks_delivered"] / wall if wall else None,
+                            "chars_per_second": report["chars_in"] / wall if wall else None,
+                            "latency_p50": report["latency"].get("p50"),
+                            "latency_p95": report["latency"].get("p95"),
+                            "ttfb_p50": report["ttfb"].get("p50"),
+                            "requests_per_chunk": served["requests"] / report["chunks_delivered"]
+                            if report["chunks_delivered"] else None,
+                            "realtime_factor": report["realtime_factor"],
+                            "episode_audio_seconds": report["episode"].get("audio_seconds"),
+                            "bytes_written": run["episode_bytes"] + run["chunk_bytes"],
+                            "mock": served,
+                            # Pooled by summarize(), not written per run
+                            "_latencies": [c["latency"] for c in report["chunks"]
+                                           if c["source"] not in (None, "cache")],
+                        })
+                        results.append(record)
+                        print(f"  {wall:7.1f}s wall, {record['chunks']} chunks, "
+                              f"p50 {record['latency_p50'] or 0:.2f}s / p95 {record['latency_p95'] or 0:.2f}s, "
+                              f"{record['requests_per_chunk'] or 0:.2f} requests/chunk, "
+                              f"peak RSS {run['peak_rss_bytes'] / 2**20:.0f} MB, "
+                              f"{record['bytes_written'] / 2**20:.0f} MB written"
+                              + (f"  ✗ {run['error']}" if run["error"] else ""))
+                        if not args.keep and not run["error"]:
+                            shutil.rmtree(workdir, ignore_errors=True)
+    finally:
+        server.stop()
+        # Crashed runs keep their working directory and log
+        if not args.keep and not any(r.get("error") for r in results):
+            shutil.rmtree(workroot, ignore_errors=True)
+    return results
+
+
+def main(argv=None):
+    if argv is None and sys.argv[1:2] == ["--run-one"]:
+        run_one(sys.argv[2], sys.argv[3])
+        return
+    parser = argparse.ArgumentParser(description="End-to-end throughput benchmark against the mock API")
+    parser.add_argument("--scripts", nargs="+", default=BUNDLED_SCRIPTS + DEFAULT_SYNTHETIC,
+                        help="script files and/or synthetic:<chars>")
+    parser.add_argument("--concurrency", nargs="+", type=int, default=[1, 3, 6])
+    parser.add_argument("--chunk-chars", nargs="+", type=int, default=[750, 1500, 3000])
+    parser.add_argument("--repeat", type=int, default=1, help="runs per combination")
+    parser.add_argument("--generator", choices=sorted(GENERATORS), default="flash")
+    parser.add_argument("--requests-per-min", type=float, default=0, help="rate limiter ceiling (0 = off)")
+    parser.add_argument("--chars-per-min", type=float, default=0, help="rate limiter ceiling (0 = off)")
+    parser.add_argument("--workdir", help="directory for the per-run working directories (default: temp)")
+    parser.add_argument("--keep", action="store_true", help="keep the working directories and logs")
+    parser.add_argument("--output", default="benchmark_results.json")
+    mock = parser.add_argument_group("mock API")
+    mock.add_argument("--seed", type=int, default=0)
+    for key, default in DEFAULTS.items():
+        mock.add_argument(f"--{key.replace('_', '-')}", dest=key, type=float,
+                          default={"latency": 0.5, "per_kchar": 1.0}.get(key, default))
+    args = parser.parse_args(argv)
+
+    started = time.time()
+    results = run_benchmark(args)
+    summary = summarize(results)
+    report = {
+        "started": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(started)),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "generator": args.generator,
+        "mock": {key: getattr(args, key) for key in DEFAULTS},
+        **summary,
+        "runs": results,
+    }
+    Path(args.output).write_text(json.dumps(report, indent=2), encoding="utf-8")
+    print(f"✓ {len(results)} runs written to {args.output}: peak RSS {(summary['peak_rss_bytes'] or 0) / 2**20:.0f} MB, "
+          f"p50 {summary['latency_p50'] or 0:.2f}s / p95 {summary['latency_p95'] or 0:.2f}s, "
+          f"{summary['bytes_written'] / 2**20:.0f} MB written")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,69 +1,74 @@
 #!/usr/bin/env python3
-"""Check WAV file headers to diagnose parameter mismatches"""
-import struct
+"""Check WAV file headers to diagnose parameter mismatches
+
+Usage:
+  python check_wav_headers.py              # all chunk files of the job
+  python check_wav_headers.py a.wav b.wav
+"""
+import sys
+from collections import Counter
 from pathlib import Path
 
-def read_wav_header(filepath):
-    """Read and parse WAV header information"""
-    try:
-        with open(filepath, 'rb') as f:
-            # Read RIFF header
-            riff = f.read(4)
-            if riff != b'RIFF':
-                return None, f"Not a RIFF file (got {riff})"
-            
-            file_size = struct.unpack('<I', f.read(4))[0]
-            wave = f.read(4)
-            if wave != b'WAVE':
-                return None, f"Not a WAVE file (got {wave})"
-            
-            # Find fmt chunk
-            while True:
-                chunk_id = f.read(4)
-                if not chunk_id:
-                    return None, "No fmt chunk found"
-                chunk_size = struct.unpack('<I', f.read(4))[0]
-                
-                if chunk_id == b'fmt ':
-                    fmt_data = f.read(chunk_size)
-                    audio_format = struct.unpack('<H', fmt_data[0:2])[0]
-                    num_channels = struct.unpack('<H', fmt_data[2:4])[0]
-                    sample_rate = struct.unpack('<I', fmt_data[4:8])[0]
-                    byte_rate = struct.unpack('<I', fmt_data[8:12])[0]
-                    block_align = struct.unpack('<H', fmt_data[12:14])[0]
-                    bits_per_sample = struct.unpack('<H', fmt_data[14:16])[0]
-                    
-                    return {
-                        'audio_format': audio_format,
-                        'num_channels': num_channels,
-                        'sample_rate': sample_rate,
-                        'byte_rate': byte_rate,
-                        'block_align': block_align,
-                        'bits_per_sample': bits_per_sample,
-                        'file_size': file_size
-                    }, None
-                else:
-                    # Skip this chunk
-                    f.seek(chunk_size, 1)
-    except Exception as e:
-        return None, str(e)
+from job_manifest import JobManifest
+from wav_io import parse_wav_header
+
+
+def chunk_files():
+    manifest = JobManifest.load()
+    if manifest:
+        return [Path(f) for f in manifest.chunk_files()]
+    return sorted(f for f in Path('.').glob('Podcast_Audio_*.wav') if f.name != 'Podcast_Audio_full.wav')
+
+
+def main(argv=None):
+    files = [Path(a) for a in (sys.argv[1:] if argv is None else argv)] or chunk_files()
+    if not files:
+        print("No WAV files found.")
+        return 1
 
-# Check chunks 7, 8, 9
-for i in [7, 8, 9]:
-    filepath = Path(f'Podcast_Audio_{i}.wav')
-    if filepath.exists():
-        info, error = read_wav_header(filepath)
+    headers = {}
+    for filepath in files:
         print(f"\n{'='*60}")
-        print(f"Podcast_Audio_{i}.wav:")
-        if error:
-            print(f"  ✗ Error: {error}")
-        else:
-            print(f"  Audio Format: {info['audio_format']} (1=PCM)")
-            print(f"  Channels: {info['num_channels']}")
-            print(f"  Sample Rate: {info['sample_rate']} Hz")
-            print(f"  Bits per Sample: {info['bits_per_sample']}")
-            print(f"  Block Align: {info['block_align']}")
-            print(f"  Byte Rate: {info['byte_rate']}")
-            print(f"  File Size: {info['file_size']} bytes")
-    else:
-        print(f"\nPodcast_Audio_{i}.wav: NOT FOUND")
+        print(f"{filepath}:")
+        if not filepath.exists():
+            print("  NOT FOUND")
+            continue
+        try:
+            header = parse_wav_header(filepath)
+        except (OSError, ValueError) as e:
+            print(f"  ✗ Error: {e}")
+            continue
+        headers[filepath] = header
+        params = header.params
+        frame = params.nchannels * params.sampwidth
+        print(f"  Audio Format: {params.audio_format} (1=PCM)")
+        print(f"  Channels: {params.nchannels}")
+        print(f"  Sample Rate: {params.framerate} Hz")
+        print(f"  Bits per Sample: {params.sampwidth * 8}")
+        print(f"  Block Align: {header.block_align}")
+        print(f"  Byte Rate: {header.byte_rate}")
+        print(f"  Data: {header.data_length} bytes at offset {header.data_offset} "
+              f"({header.data_length / frame / params.framerate:.2f} s)")
+        print(f"  Chunks: {', '.join(f'{cid.strip()}({size})' for cid, _, size in header.chunks)}")
+        print(f"  File Size: {header.file_size} bytes (RIFF size field: {header.riff_size + 8})")
+        if header.block_align != frame:
+            print(f"  ⚠ Block align {header.block_align} does not match {frame} bytes per frame")
+        if header.riff_size + 8 != header.file_size:
+            print("  ⚠ RIFF size does not match the file size (truncated or streamed header)")
+
+    if headers:
+        counts = Counter(h.params for h in headers.values())
+        common = max(counts, key=counts.get)
+        odd = [f for f, h in headers.items() if h.params != common]
+        print(f"\n{'='*60}")
+        print(f"Common format: {common.nchannels}ch/{common.sampwidth * 8}bit/{common.framerate}Hz "
+              f"({counts[common]} of {len(headers)} files)")
+        for f in odd:
+            p = headers[f].params
+            print(f"  ⚠ {f}: {p.nchannels}ch/{p.sampwidth * 8}bit/{p.framerate}Hz "
+                  f"(converted automatically on concat, or run resample_chunks.py)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,189 @@
+"""
+Persistent, content-addressed cache for synthesized chunk audio.
+
+Entries are keyed by a SHA-256 over everything that changes the audio of a
+chunk: the chunk text, the model, the speech/voice configuration
+(SpeakerVoiceConfig list), the temperature and the requested output MIME
+type. A re-render after a small script edit therefore only sends the
+changed chunks to the API.
+
+Each entry is two files in the cache directory: `<key>.bin` (the audio parts
+back to back) and `<key>.json` (MIME type and length of every part). The
+directory is kept under a byte budget by evicting the least recently used
+entries; a hit refreshes the entry's mtime.
+
+Settings (environment):
+  TTS_CACHE_DIR      cache directory (default .tts_cache)
+  TTS_CACHE_MAX_MB   disk budget in MB, 0 disables the cache (default 500)
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from pathlib import Path
+
+DEFAULT_CACHE_DIR = ".tts_cache"
+DEFAULT_MAX_MB = 500
+STATS_FILE = "stats.json"
+
+
+def _config_fingerprint(config) -> dict:
+    """Reduce a GenerateContentConfig to the fields that shape the audio."""
+    speech = getattr(config, "speech_config", None)
+    if speech is not None and hasattr(speech, "model_dump"):
+        speech = speech.model_dump(mode="json", exclude_none=True)
+    return {
+        "speech_config": speech,
+        "temperature": getattr(config, "temperature", None),
+        "response_mime_type": getattr(config, "response_mime_type", None),
+    }
+
+
+def cache_key(text: str, model: str, config) -> str:
+    """Content address of a chunk: hash of text, model and voice settings."""
+    payload = {"text": text, "model": model, **_config_fingerprint(config)}
+    blob = json.dumps(payload, sort_keys=True, ensure_ascii=False).encode("utf-8")
+    return hashlib.sha256(blob).hexdigest()
+
+
+class ChunkAudioCache:
+    """Size-bounded LRU cache of chunk audio on disk."""
+
+    def __init__(self, directory=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_MB * 1024 * 1024):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self.stats = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0, "bytes_served": 0}
+        self._lock = threading.Lock()
+        self.directory.mkdir(parents=True, exist_ok=True)
+        # key -> (size, last_used); rebuilt from disk once per process
+        self._index = {}
+        for meta in self.directory.glob("*.json"):
+            if meta.name == STATS_FILE:
+                continue
+            blob = meta.with_suffix(".bin")
+            try:
+                st = blob.stat()
+            except FileNotFoundError:
+                meta.unlink(missing_ok=True)
+                continue
+            self._index[meta.stem] = (st.st_size + meta.stat().st_size, st.st_mtime)
+
+    @classmethod
+    def from_env(cls):
+        """Build the cache from TTS_CACHE_DIR / TTS_CACHE_MAX_MB (None if disabled)."""
+        raw = os.environ.get("TTS_CACHE_MAX_MB", "")
+        try:
+            max_mb = float(raw) if raw.strip() else DEFAULT_MAX_MB
+        except ValueError:
+            print(f"⚠ Ignoring invalid TTS_CACHE_MAX_MB={raw!r}, using {DEFAULT_MAX_MB}")
+            max_mb = DEFAULT_MAX_MB
+        if max_mb <= 0:
+            return None
+        return cls(os.environ.get("TTS_CACHE_DIR", DEFAULT_CACHE_DIR), int(max_mb * 1024 * 1024))
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    @property
+    def size_bytes(self) -> int:
+        return sum(size for size, _ in self._index.values())
+
+    def get(self, key: str) -> list[tuple[bytes, str]] | None:
+        """Return the cached audio parts for `key`, or None on a miss."""
+        return self.get_any([key])
+
+    def get_any(self, keys) -> list[tuple[bytes, str]] | None:
+        """Return the parts of the first of `keys` that is cached; None counts as one miss."""
+        with self._lock:
+            for key in keys:
+                parts = self._lookup(key)
+                if parts is not None:
+                    return parts
+            self.stats["misses"] += 1
+            return None
+
+    def _lookup(self, key: str) -> list[tuple[bytes, str]] | None:
+        if key not in self._index:
+            return None
+        blob_path = self.directory / f"{key}.bin"
+        try:
+            meta = json.loads((self.directory / f"{key}.json").read_text(encoding="utf-8"))
+            blob = blob_path.read_bytes()
+        except (OSError, ValueError):
+            self._drop(key)
+            return None
+        parts, offset = [], 0
+        for part in meta["parts"]:
+            parts.append((blob[offset:offset + part["length"]], part["mime_type"]))
+            offset += part["length"]
+        if offset != len(blob):
+            # Truncated or foreign blob — treat as a miss and forget it
+            self._drop(key)
+            return None
+        now = time.time()
+        os.utime(blob_path, (now, now))
+        self._index[key] = (self._index[key][0], now)
+        self.stats["hits"] += 1
+        self.stats["bytes_served"] += len(blob)
+        return parts
+
+    def put(self, key: str, parts: list[tuple[bytes, str]]):
+        """Store the audio parts of a chunk and evict old entries if over budget."""
+        if not parts:
+            return
+        blob = b"".join(data for data, _ in parts)
+        meta = json.dumps({
+            "parts": [{"mime_type": mime, "length": len(data)} for data, mime in parts],
+            "created": time.time(),
+        }).encode("utf-8")
+        if len(blob) + len(meta) > self.max_bytes:
+            return
+        with self._lock:
+            # Blob first, metadata last: an entry only exists once both are complete
+            for suffix, content in ((".bin", blob), (".json", meta)):
+                path = self.directory / f"{key}{suffix}"
+                tmp = path.with_name(path.name + ".tmp")
+                tmp.write_bytes(content)
+                os.replace(tmp, path)
+            self._index[key] = (len(blob) + len(meta), time.time())
+            self.stats["stores"] += 1
+            self._evict()
+
+    def _drop(self, key: str):
+        self._index.pop(key, None)
+        for suffix in (".json", ".bin"):
+            (self.directory / f"{key}{suffix}").unlink(missing_ok=True)
+
+    def _evict(self):
+        total = self.size_bytes
+        if total <= self.max_bytes:
+            return
+        for key, (size, _) in sorted(self._index.items(), key=lambda kv: kv[1][1]):
+            self._drop(key)
+            self.stats["evictions"] += 1
+            total -= size
+            if total <= self.max_bytes:
+                break
+
+    def save_stats(self):
+        """Add this run's counters to the cumulative totals in stats.json."""
+        path = self.directory / STATS_FILE
+        with self._lock:
+            try:
+                totals = json.loads(path.read_text(encoding="utf-8"))
+            except (OSError, ValueError):
+                totals = {}
+            for name, value in self.stats.items():
+                totals[name] = totals.get(name, 0) + value
+            tmp = path.with_name(path.name + ".tmp")
+            tmp.write_text(json.dumps(totals, indent=2), encoding="utf-8")
+            os.replace(tmp, path)
+        return totals
+
+    def summary(self) -> str:
+        lookups = self.stats["hits"] + self.stats["misses"]
+        rate = (100.0 * self.stats["hits"] / lookups) if lookups else 0.0
+        return (f"{self.stats['hits']} hits / {self.stats['misses']} misses ({rate:.0f}% hit rate), "
+                f"{self.stats['evictions']} evicted, {self.size_bytes / 1e6:.1f} of "
+                f"{self.max_bytes / 1e6:.0f} MB used")
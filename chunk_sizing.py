@@ -0,0 +1,154 @@
+"""
+Per-model chunk size selection from measured request latency.
+
+Every synthesized chunk is recorded against the chunk size (max_chars) it was
+cut with: characters delivered, seconds spent in requests (including failed
+and disconnected attempts, excluding rate-limiter waits and backoff), audio
+bytes returned, requests made and stream disconnects. The history is kept
+per model in a JSON file, so flash and pro converge independently.
+
+choose() returns the size with the lowest request time per delivered
+character among sizes with enough samples. With exploration switched on,
+a neighbouring size (one STEP up or down) that has too few samples is tried
+instead, so each run moves at most one step and the choice settles on a
+local optimum. A different chunk size produces different chunks, so an
+exploring run does not hit the chunk audio cache; that is why exploration
+is opt-in, for runs whose script is new anyway.
+
+Settings (environment):
+  TTS_CHUNK_CHARS          fixed chunk size, disables the automatic choice
+  TTS_CHUNK_HISTORY        history file (default .tts_chunk_history.json)
+  TTS_CHUNK_EXPLORE        1 = try neighbouring sizes without data (default 0)
+"""
+import json
+import os
+import threading
+from pathlib import Path
+
+DEFAULT_HISTORY_FILE = ".tts_chunk_history.json"
+DEFAULT_CHUNK_CHARS = 1500
+MIN_CHUNK_CHARS = 750
+MAX_CHUNK_CHARS = 3000
+STEP = 250
+# Samples a size needs before its score is trusted
+MIN_SAMPLES = 4
+# Aggregates are halved beyond this many samples, so old runs fade out
+MAX_SAMPLES = 60
+
+_FIELDS = ("samples", "chars", "seconds", "bytes", "requests", "disconnects", "failures")
+
+
+def candidate_sizes() -> list[int]:
+    """Chunk sizes on the STEP grid through DEFAULT_CHUNK_CHARS, within bounds."""
+    sizes = set()
+    size = DEFAULT_CHUNK_CHARS
+    while size >= MIN_CHUNK_CHARS:
+        sizes.add(size)
+        size -= STEP
+    size = DEFAULT_CHUNK_CHARS
+    while size <= MAX_CHUNK_CHARS:
+        sizes.add(size)
+        size += STEP
+    return sorted(sizes)
+
+
+def _snap(size: int) -> int:
+    return min(candidate_sizes(), key=lambda s: abs(s - size))
+
+
+class ChunkSizeHistory:
+    """Latency/failure history per (model, chunk size), persisted as JSON."""
+
+    def __init__(self, path=DEFAULT_HISTORY_FILE, explore: bool = False, fixed_size: int | None = None):
+        self.path = Path(path)
+        self.explore = explore
+        self.fixed_size = fixed_size
+        self._lock = threading.Lock()
+        # model -> chunk size the current run was cut with
+        self.active = {}
+        try:
+            self.data = json.loads(self.path.read_text(encoding="utf-8"))
+        except FileNotFoundError:
+            self.data = {}
+        except (OSError, ValueError) as e:
+            print(f"⚠ Ignoring unreadable chunk size history {self.path}: {e}")
+            self.data = {}
+
+    @classmethod
+    def from_env(cls):
+        raw = os.environ.get("TTS_CHUNK_CHARS", "")
+        fixed = None
+        if raw.strip():
+            try:
+                fixed = max(1, int(raw))
+            except ValueError:
+                print(f"⚠ Ignoring invalid TTS_CHUNK_CHARS={raw!r}")
+        explore = os.environ.get("TTS_CHUNK_EXPLORE", "0").strip() in ("1", "true", "yes")
+        return cls(os.environ.get("TTS_CHUNK_HISTORY", DEFAULT_HISTORY_FILE), explore, fixed)
+
+    def _stats(self, model: str, size: int) -> dict:
+        return self.data.get(model, {}).get(str(size), {})
+
+    def cost(self, model: str, size: int) -> float | None:
+        """Request seconds per delivered character, or None without enough samples."""
+        stats = self._stats(model, size)
+        if stats.get("samples", 0) < MIN_SAMPLES:
+            return None
+        if not stats.get("chars"):
+            return float("inf")
+        return stats["seconds"] / stats["chars"]
+
+    def choose(self, model: str) -> int:
+        """Pick the chunk size for the next run of `model` and remember it."""
+        if self.fixed_size:
+            size = self.fixed_size
+        else:
+            scored = {s: self.cost(model, s) for s in candidate_sizes()}
+            known = {s: c for s, c in scored.items() if c is not None}
+            if not known:
+                size = DEFAULT_CHUNK_CHARS
+            else:
+                size = min(known, key=known.get)
+                if self.explore:
+                    for neighbour in (size + STEP, size - STEP):
+                        if neighbour in scored and scored[neighbour] is None:
+                            size = neighbour
+                            break
+        self.active[model] = size
+        return size
+
+    def record(self, model: str, chars: int, seconds: float, audio_bytes: int,
+               requests: int, disconnects: int, ok: bool):
+        """Add one chunk outcome to the size this run of `model` was cut with."""
+        size = self.active.get(model) or _snap(chars)
+        with self._lock:
+            stats = self.data.setdefault(model, {}).setdefault(str(size), dict.fromkeys(_FIELDS, 0))
+            stats["samples"] += 1
+            stats["chars"] += chars if ok else 0
+            stats["seconds"] += seconds
+            stats["bytes"] += audio_bytes
+            stats["requests"] += requests
+            stats["disconnects"] += disconnects
+            stats["failures"] += 0 if ok else 1
+            if stats["samples"] > MAX_SAMPLES:
+                for field in _FIELDS:
+                    stats[field] /= 2
+
+    def describe(self, model: str) -> list[str]:
+        """One line per chunk size with data for `model`."""
+        lines = []
+        for size, stats in sorted(self.data.get(model, {}).items(), key=lambda kv: int(kv[0])):
+            samples = stats["samples"] or 1
+            per_char = stats["seconds"] / stats["chars"] if stats["chars"] else float("inf")
+            lines.append(f"{int(size):>5} chars: {stats['samples']:.0f} chunks, "
+                         f"{per_char * 1000:.1f} ms/char, "
+                         f"{stats['disconnects'] / max(1, stats['requests']):.0%} disconnects, "
+                         f"{stats['failures'] / samples:.0%} failed")
+        return lines
+
+    def save(self):
+        """Write the history atomically."""
+        with self._lock:
+            tmp = self.path.with_name(self.path.name + ".tmp")
+            tmp.write_text(json.dumps(self.data, indent=1, sort_keys=True), encoding="utf-8")
+            os.replace(tmp, self.path)
@@ -2,60 +2,64 @@
 """
 Quick concatenation script for partial podcast (skipping missing chunks).
 Useful when quota ran out but some chunks were already generated.
+--profile writes CPU and allocation profiles of the concat (see profiling.py).
 """
-import wave
 from pathlib import Path
 import re
+import sys
 
-p = Path('.')
-files = sorted(p.glob('Podcast_Audio_*.wav'))
+from job_manifest import JobManifest
+from audio_encoder import encoder_settings_from_env
+from loudness import loudness_target_from_env, true_peak_from_env
+from profiling import profiler_from_argv
+from seams import seam_settings_from_env
+from wav_io import concat_wav_files
 
-if not files:
-    print("No Podcast_Audio_*.wav files found!")
-    exit(1)
 
-# Sort by numeric index
-def index_from_name(fn: Path):
-    m = re.search(r'_(\d+)\.', fn.name)
-    if m:
-        return int(m.group(1))
+def main(argv=None):
+    manifest = JobManifest.load()
+    if manifest:
+        # Done chunks in chunk order; pending/failed chunks are simply left out
+        files = [Path(f) for f in manifest.chunk_files()]
+        print(f"Using job manifest {manifest.path}: {len(files)} of {len(manifest.chunks)} chunks done")
+    else:
+        p = Path('.')
+        files = sorted(f for f in p.glob('Podcast_Audio_*.wav') if f.name != 'Podcast_Audio_full.wav')
+
+        # Sort by numeric index
+        def index_from_name(fn: Path):
+            m = re.search(r'_(\d+)\.', fn.name)
+            if m:
+                return int(m.group(1))
+            return 0
+
+        files = sorted(files, key=index_from_name)
+
+    if not files:
+        print("No Podcast_Audio_*.wav files found!")
+        return 1
+
+    print(f"Found {len(files)} chunk files:")
+    for f in files:
+        print(f"  {f.name}")
+
+    # Stream chunks into the output block by block (constant memory)
+    output_wav = 'Podcast_Audio_full.wav'
+    profiler = profiler_from_argv(sys.argv[1:] if argv is None else argv, output_wav)
+    print(f"\nConcatenating {len(files)} chunks into {output_wav}...")
+    try:
+        with profiler.stage("concat"):
+            params, total_size, used = concat_wav_files(files, output_wav, loudness_target=loudness_target_from_env(),
+                                                         true_peak_db=true_peak_from_env(), seams=seam_settings_from_env(),
+                                                         encode=encoder_settings_from_env('Podcast_Audio_full'))
+    finally:
+        profiler.close()
+    print(f"WAV params: {params.nchannels} channels, {params.sampwidth} bytes/sample, {params.framerate} Hz")
+    print(f"✓ Partial podcast created: {output_wav} ({total_size} bytes of audio)")
+    total_chunks = len(manifest.chunks) if manifest else len(files)
+    print(f"  (Note: {len(used)} chunks of {total_chunks} total)")
     return 0
 
-files = sorted(files, key=index_from_name)
-print(f"Found {len(files)} chunk files:")
-for f in files:
-    print(f"  {f.name}")
-
-# Check WAV params
-params = None
-frames = []
-total_size = 0
-
-for fpath in files:
-    with wave.open(str(fpath), 'rb') as w:
-        p_info = w.getparams()
-        if params is None:
-            params = p_info
-            print(f"\nWAV params: {p_info.nchannels} channels, {p_info.sampwidth} bytes/sample, {p_info.framerate} Hz")
-        else:
-            if (p_info.nchannels, p_info.sampwidth, p_info.framerate) != (params.nchannels, params.sampwidth, params.framerate):
-                print(f"⚠ {fpath.name} has incompatible params, skipping")
-                continue
-        
-        data = w.readframes(w.getnframes())
-        frames.append(data)
-        total_size += len(data)
-        print(f"  ✓ {fpath.name}: {len(data)} bytes")
-
-# Write concatenated file
-output_wav = 'Podcast_Audio_full.wav'
-print(f"\nConcatenating {len(frames)} chunks ({total_size} bytes) into {output_wav}...")
-
-with wave.open(output_wav, 'wb') as out:
-    out.setnchannels(params.nchannels)
-    out.setsampwidth(params.sampwidth)
-    out.setframerate(params.framerate)
-    out.writeframes(b''.join(frames))
-
-print(f"✓ Partial podcast created: {output_wav}")
-print(f"  (Note: {len(files)} chunks of {len(files)} total)")
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -3,6 +3,8 @@ from dotenv import load_dotenv
 from google import genai
 from google.genai import types
 
+from rate_limiter import get_rate_limiter
+
 print("="*60)
 print("GEMINI API DIAGNOSE")
 print("="*60)
@@ -44,6 +46,7 @@ print("\n" + "-"*60)
 print("TEST 1: Einfache Text-Generierung")
 print("-"*60)
 try:
+    get_rate_limiter("models/gemini-2.0-flash-exp").acquire()
     response = client.models.generate_content(
         model="models/gemini-2.0-flash-exp",
         contents="Say hello in one word"
@@ -94,6 +97,7 @@ for model_name in test_models:
         
         # Try non-streaming first
         print("  Versuche non-streaming...")
+        get_rate_limiter(model_name).acquire(len(contents[0].parts[0].text))
         response = client.models.generate_content(
             model=model_name,
             contents=contents,
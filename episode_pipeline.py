@@ -0,0 +1,202 @@
+"""
+Episode output written while the chunks are still being synthesized.
+
+    synthesis (async, N requests) -> add() -> prepare (thread pool) -> ordered writer (thread) -> WAV + ffmpeg
+
+add() is called in chunk order from the synthesis callback, which
+synthesize_chunks() runs in a worker thread, off the event loop. Each chunk is
+prepared in a thread pool (header parsed, converted to the episode format
+if needed, loudness measured) while later chunks are still in flight. One
+writer thread takes the prepared chunks in order, plans the seams and
+streams the audio into the episode WAV and, if enabled, the compressed
+encoder. The queue between the stages holds at most QUEUE_CHUNKS chunks:
+when the writer falls behind, add() blocks, chunks stop being handed over,
+and synthesize_chunks() stops starting new chunks once its window is full;
+the requests already in flight finish undisturbed.
+Audio is only held in memory one block and one seam at a time.
+
+Unlike concat_wav_files(), the loudness offset of the episode is not known
+up front: chunk i gets its own gain plus the offset predicted from chunks
+0..i. The loudness reached is printed at the end.
+"""
+import contextlib
+import os
+import queue
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from itertools import chain
+
+import numpy as np
+
+from loudness import (DEFAULT_TRUE_PEAK_DB, chunk_gain_db, episode_offset_db, integrated_loudness, measure,
+                      write_limited)
+from profiling import NullProfiler
+from seams import SeamPlanner, write_pieces
+from wav_io import TeeWriter, convert_for_concat, parse_wav_header, read_wav_layout, wav_header, whole_piece
+
+# Prepared chunks queued for the writer before add() blocks
+QUEUE_CHUNKS = 8
+
+
+class EpisodeAborted(Exception):
+    """Raised inside the writer thread when abort() is called."""
+
+
+class EpisodeWriter:
+    """Stream chunk WAV files into one episode WAV as they are added, in order.
+
+    Settings are those of concat_wav_files(). The output format is `target`,
+    or else that of the first chunk added whose header can be read; chunks
+    added before it are skipped, other chunks are converted.
+    close() finishes the file and returns (WavParams, audio bytes written,
+    files used); abort() stops and removes the partial output. With a
+    profiling.StageProfiler the writer thread is profiled as stage
+    "episode_writer".
+    """
+
+    def __init__(self, output_path, loudness_target: float | None = None,
+                 true_peak_db: float = DEFAULT_TRUE_PEAK_DB, seams: dict | None = None,
+                 encode: dict | None = None, target=None, workers: int | None = None, profiler=None):
+        self.output_path = output_path
+        self.loudness_target = loudness_target
+        self.true_peak_db = true_peak_db
+        self.seams = seams
+        self.encode = encode
+        self.params = target
+        self.profiler = profiler or NullProfiler()
+        self.written = 0
+        self.used = []
+        self._added = 0
+        self._segments = []
+        self._error = None
+        self._ended = False
+        self._aborted = threading.Event()
+        self._tmpdir = tempfile.TemporaryDirectory(
+            prefix=".episode-", dir=os.path.dirname(os.path.abspath(output_path)))
+        self._pool = ThreadPoolExecutor(max_workers=workers or os.cpu_count() or 1)
+        self._queue = queue.Queue(maxsize=QUEUE_CHUNKS)
+        self._thread = threading.Thread(target=self._run, name="episode-writer", daemon=True)
+        self._thread.start()
+
+    def add(self, path) -> None:
+        """Queue the next chunk file; blocks while the writer is QUEUE_CHUNKS behind."""
+        if self._error is not None:
+            raise self._error
+        if self.params is None:
+            with contextlib.suppress(OSError, ValueError):
+                self.params = parse_wav_header(path).params
+        self._queue.put((path, self._pool.submit(self._prepare, path, self._added)))
+        self._added += 1
+
+    def close(self):
+        """Wait for the writer to finish the episode; returns (WavParams, bytes written, files used)."""
+        self._queue.put(None)
+        self._thread.join()
+        self._pool.shutdown()
+        self._tmpdir.cleanup()
+        if self._error is not None:
+            raise self._error
+        return self.params, self.written, self.used
+
+    def abort(self) -> None:
+        """Stop writing and remove the partial episode."""
+        self._aborted.set()
+        self._queue.put(None)
+        self._thread.join()
+        self._pool.shutdown(cancel_futures=True)
+        self._tmpdir.cleanup()
+        with contextlib.suppress(OSError):
+            os.remove(self.output_path)
+
+    def _prepare(self, path, n: int):
+        """Runs in the pool: (source, offset, length, loudness segments or None) in the episode format."""
+        params, offset, length = read_wav_layout(path)
+        if self.params is None:
+            # add() could not read this header; the next readable chunk sets the format
+            raise ValueError("episode format unknown, the WAV header could not be read when the chunk was added")
+        source = path
+        if params != self.params:
+            source = convert_for_concat(path, os.path.join(self._tmpdir.name, f"{n}.wav"), self.params)
+            _, offset, length = read_wav_layout(source)
+            print(f"↻ Converted {path}: {params.nchannels}ch/{params.sampwidth * 8}bit/{params.framerate}Hz -> "
+                  f"{self.params.nchannels}ch/{self.params.sampwidth * 8}bit/{self.params.framerate}Hz")
+        segments = None
+        if self.loudness_target is not None:
+            segments = measure(source, offset, length, self.params)
+        return source, offset, length, segments
+
+    def _prepared(self):
+        """Prepared chunks in order, skipping those that could not be read or converted."""
+        while (item := self._queue.get()) is not None:
+            if self._aborted.is_set():
+                raise EpisodeAborted
+            path, future = item
+            try:
+                prepared = future.result()
+            except (OSError, ValueError) as e:
+                print(f"⚠ Warning: could not add {path} to the episode ({e}), skipping.")
+                continue
+            self.used.append(path)
+            yield prepared
+        self._ended = True
+        if self._aborted.is_set():
+            raise EpisodeAborted
+
+    def _pieces(self, prepared):
+        """Pieces with seams and loudness gains, one chunk behind the input when seams are planned."""
+        planner = SeamPlanner(self.params, **self.seams) if self.seams is not None else None
+        gains_db = []
+        gain = previous_gain = 1.0
+        for n, (source, offset, length, segments) in enumerate(prepared):
+            if segments is not None:
+                loudness = integrated_loudness(segments)
+                self._segments.append(segments)
+                gains_db.append(chunk_gain_db(loudness, self.loudness_target))
+                gain_db = gains_db[-1] + episode_offset_db(self._segments, gains_db, self.loudness_target)
+                gain = 10 ** (gain_db / 20)
+                print(f"  Chunk {n}: {loudness:6.1f} LUFS, gain {gain_db:+5.1f} dB")
+            if planner is None:
+                yield whole_piece(source, offset, length)._replace(gain=gain)
+                continue
+            piece = planner.add(source, offset, length)
+            if piece is not None:
+                yield piece._replace(gain=previous_gain)
+            previous_gain = gain
+        if planner is not None and (piece := planner.finish()) is not None:
+            yield piece._replace(gain=previous_gain)
+
+    def _run(self):
+        # Errors of the profiler too: add() and close() re-raise them instead of waiting forever
+        try:
+            with self.profiler.stage("episode_writer"):
+                self._write_episode()
+        except BaseException as e:
+            self._error = e
+            # Unblock add() until close()/abort() sends the end marker
+            while not self._ended and self._queue.get() is not None:
+                pass
+
+    def _write_episode(self):
+        prepared = self._prepared()
+        first = next(prepared, None)
+        if first is None:
+            return
+        params = self.params
+        with contextlib.ExitStack() as stack:
+            out = stack.enter_context(open(self.output_path, "wb", buffering=0))
+            out.write(wav_header(0, params.framerate, params.nchannels, params.sampwidth * 8))
+            sink = out
+            if self.encode is not None:
+                from audio_encoder import StreamingEncoder
+                sink = TeeWriter(out, stack.enter_context(StreamingEncoder(params, **self.encode)))
+            pieces = self._pieces(chain([first], prepared))
+            if self.loudness_target is None:
+                self.written = write_pieces(pieces, sink, params)
+            else:
+                self.written, output, limited = write_limited(pieces, sink, params, self.true_peak_db)
+                print(f"✓ Loudness: {integrated_loudness(np.concatenate(self._segments)):.1f} LUFS -> "
+                      f"{integrated_loudness(output):.1f} LUFS (target {self.loudness_target:.1f}), "
+                      f"{limited} samples limited to {self.true_peak_db:.1f} dBTP")
+            out.seek(0)
+            out.write(wav_header(self.written, params.framerate, params.nchannels, params.sampwidth * 8))
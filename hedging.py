@@ -0,0 +1,92 @@
+"""
+Hedged requests for straggler chunks.
+
+Chunk latency has a long tail: a few requests hang far longer than the
+rest and the episode waits on them. With hedging on, a chunk that has been
+running longer than the given percentile of the latencies observed so far
+in this run gets a duplicate request, optionally to another (faster) model.
+Whichever returns audio first wins; the other is cancelled. The duplicates
+go through the same rate limiter and are capped at a fraction of the
+chunks, so hedging cannot eat more than that share of extra quota.
+
+Settings (environment):
+  TTS_HEDGE_PERCENTILE     latency percentile that triggers a duplicate, 0 = off (default 0)
+  TTS_HEDGE_MODEL          model for the duplicate request (default: the chunk's model)
+  TTS_HEDGE_MAX_FRACTION   duplicates allowed per chunk of the episode, 0 = none (default 0.1)
+"""
+import os
+import threading
+
+import numpy as np
+
+DEFAULT_MAX_FRACTION = 0.1
+# Completed chunks needed before the percentile is trusted
+MIN_SAMPLES = 3
+# Never hedge a chunk that has been running for less than this
+MIN_HEDGE_SECONDS = 5.0
+
+
+class HedgePolicy:
+    """Latency percentile and budget deciding when a chunk gets a duplicate request."""
+
+    def __init__(self, percentile: float = 90.0, model: str | None = None,
+                 max_fraction: float = DEFAULT_MAX_FRACTION):
+        self.percentile = percentile
+        self.model = model
+        self.max_fraction = max_fraction
+        self._lock = threading.Lock()
+        self.latencies = []
+        self.hedged = 0
+        self.won = 0
+
+    @classmethod
+    def from_env(cls):
+        """Policy from TTS_HEDGE_* settings; None when hedging is off."""
+        raw = os.environ.get("TTS_HEDGE_PERCENTILE", "").strip()
+        try:
+            percentile = float(raw) if raw else 0.0
+        except ValueError:
+            print(f"⚠ Ignoring invalid TTS_HEDGE_PERCENTILE={raw!r}, hedging stays off")
+            percentile = 0.0
+        if not 0 < percentile < 100:
+            return None
+        raw = os.environ.get("TTS_HEDGE_MAX_FRACTION", "").strip()
+        try:
+            max_fraction = float(raw) if raw else DEFAULT_MAX_FRACTION
+        except ValueError:
+            print(f"⚠ Ignoring invalid TTS_HEDGE_MAX_FRACTION={raw!r}, using {DEFAULT_MAX_FRACTION}")
+            max_fraction = DEFAULT_MAX_FRACTION
+        return cls(percentile, os.environ.get("TTS_HEDGE_MODEL", "").strip() or None, max_fraction)
+
+    def record(self, seconds: float):
+        """Add the latency of a completed chunk."""
+        with self._lock:
+            self.latencies.append(seconds)
+
+    def threshold(self) -> float | None:
+        """Seconds after which a running chunk is hedged; None until enough chunks completed."""
+        with self._lock:
+            if len(self.latencies) < MIN_SAMPLES:
+                return None
+            return max(MIN_HEDGE_SECONDS, float(np.percentile(self.latencies, self.percentile)))
+
+    def budget(self, total_chunks: int) -> int:
+        """Duplicate requests allowed for an episode of `total_chunks`: at least one unless the fraction is 0."""
+        if self.max_fraction <= 0:
+            return 0
+        return max(1, int(self.max_fraction * total_chunks))
+
+    def try_spend(self, total_chunks: int) -> bool:
+        """Take one duplicate request from the budget, if any is left."""
+        with self._lock:
+            if self.hedged >= self.budget(total_chunks):
+                return False
+            self.hedged += 1
+            return True
+
+    def describe(self) -> str:
+        return f"p{self.percentile:g} latency, at most {self.max_fraction:.0%} extra requests" + (
+            f", duplicates to {self.model}" if self.model else "")
+
+    def summary(self) -> str:
+        return f"{self.hedged} chunks hedged, {self.won} won by the duplicate"
@@ -0,0 +1,183 @@
+"""
+Durable per-job manifest for podcast generation (podcast_manifest.json).
+
+The manifest lists every text chunk of a job with its text hash, status,
+attempt count and the audio file(s) it produced (byte length, SHA-256 and
+audio parameters). It is rewritten atomically (temp file + os.replace) after
+every chunk, so it always describes a consistent state even if the run dies.
+
+Resume, concat and fallback tools read the manifest instead of re-chunking
+the script and regex-matching `Podcast_Audio_*` filenames, and they can tell
+a truncated chunk file from a complete one.
+"""
+import hashlib
+import json
+import os
+import time
+from pathlib import Path
+
+from wav_io import parse_wav_header
+
+MANIFEST_NAME = "podcast_manifest.json"
+MANIFEST_VERSION = 1
+
+STATUS_PENDING = "pending"
+STATUS_DONE = "done"
+STATUS_FAILED = "failed"
+
+
+def text_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def file_checksum(path) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def describe_audio_file(path, data: bytes | None = None) -> dict:
+    """File record for the manifest: path, byte length, checksum, audio params."""
+    path = Path(path)
+    if data is not None:
+        size, checksum = len(data), hashlib.sha256(data).hexdigest()
+    else:
+        size, checksum = path.stat().st_size, file_checksum(path)
+    record = {"path": str(path), "bytes": size, "sha256": checksum}
+    try:
+        header = parse_wav_header(path)
+    except (ValueError, OSError):
+        return record  # not a WAV container (mp3/ogg/...) — size and checksum still apply
+    params = header.params
+    record.update({
+        "channels": params.nchannels,
+        "sample_width": params.sampwidth,
+        "rate": params.framerate,
+        "frames": header.data_length // (params.nchannels * params.sampwidth),
+    })
+    return record
+
+
+class JobManifest:
+    """In-memory view of podcast_manifest.json; save() persists it atomically."""
+
+    def __init__(self, data: dict, path=MANIFEST_NAME):
+        self.data = data
+        self.path = Path(path)
+
+    @classmethod
+    def create(cls, chunks: list[str], model: str, script: str = "script.txt", path=MANIFEST_NAME):
+        """Start a new job with every chunk pending and write it to disk."""
+        now = time.time()
+        data = {
+            "version": MANIFEST_VERSION,
+            "job_id": hashlib.sha256("\n".join([model] + [text_hash(c) for c in chunks]).encode()).hexdigest()[:16],
+            "script": script,
+            "model": model,
+            "created": now,
+            "updated": now,
+            "chunks": [
+                {
+                    "index": i,
+                    "text": text,
+                    "text_sha256": text_hash(text),
+                    "chars": len(text),
+                    "status": STATUS_PENDING,
+                    "attempts": 0,
+                    "files": [],
+                }
+                for i, text in enumerate(chunks)
+            ],
+        }
+        manifest = cls(data, path)
+        manifest.save()
+        return manifest
+
+    @classmethod
+    def load(cls, path=MANIFEST_NAME):
+        """Read an existing manifest, or return None if there is none."""
+        path = Path(path)
+        try:
+            data = json.loads(path.read_text(encoding="utf-8"))
+        except FileNotFoundError:
+            return None
+        if data.get("version") != MANIFEST_VERSION:
+            raise ValueError(f"{path}: unsupported manifest version {data.get('version')!r}")
+        return cls(data, path)
+
+    @property
+    def chunks(self) -> list[dict]:
+        return self.data["chunks"]
+
+    @property
+    def model(self) -> str:
+        return self.data["model"]
+
+    def save(self):
+        """Write the manifest atomically: readers see the old or the new version, never half."""
+        self.data["updated"] = time.time()
+        tmp = self.path.with_name(self.path.name + ".tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.data, f, indent=1, ensure_ascii=False)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path)
+
+    def mark_done(self, idx: int, files: list[dict], attempts: int = 1):
+        entry = self.chunks[idx]
+        entry.update(status=STATUS_DONE, files=files, attempts=entry["attempts"] + attempts, error=None)
+        self.save()
+
+    def mark_failed(self, idx: int, error: str, attempts: int = 1):
+        entry = self.chunks[idx]
+        entry.update(status=STATUS_FAILED, attempts=entry["attempts"] + attempts, error=error[:500])
+        self.save()
+
+    def is_complete(self, idx: int, verify_checksum: bool = True) -> bool:
+        """A chunk is complete when it is marked done and its files match the record."""
+        entry = self.chunks[idx]
+        if entry["status"] != STATUS_DONE or not entry["files"]:
+            return False
+        for record in entry["files"]:
+            try:
+                if os.path.getsize(record["path"]) != record["bytes"]:
+                    return False
+            except OSError:
+                return False
+            if verify_checksum and file_checksum(record["path"]) != record["sha256"]:
+                return False
+        return True
+
+    def missing_chunks(self, verify_checksum: bool = True) -> list[int]:
+        """Indices of chunks that still need audio (pending, failed, truncated or changed)."""
+        return [e["index"] for e in self.chunks if not self.is_complete(e["index"], verify_checksum)]
+
+    def chunk_files(self) -> list[str]:
+        """Audio files of all done chunks, in chunk order."""
+        return [r["path"] for e in self.chunks if e["status"] == STATUS_DONE for r in e["files"]]
+
+    def chunk_filename(self, idx: int, extension: str = ".wav") -> str:
+        """`Podcast_Audio_{idx}{ext}`, unless another chunk of this job already owns that name."""
+        name = f"Podcast_Audio_{idx}{extension}"
+        owners = {r["path"]: e["index"] for e in self.chunks for r in e["files"]}
+        if owners.get(name, idx) == idx:
+            return name
+        return f"Podcast_Audio_{idx}_chunk{extension}"
+
+
+def adopt_legacy_job(chunks: list[str], model: str, script: str = "script.txt", path=MANIFEST_NAME) -> JobManifest:
+    """Create a manifest for chunk files written before manifests existed.
+
+    Only the old `Podcast_Audio_{i}.wav` naming can be trusted here; every
+    such file is recorded as-is for chunk i, everything else stays pending.
+    """
+    manifest = JobManifest.create(chunks, model, script, path)
+    for i in range(len(chunks)):
+        legacy = Path(f"Podcast_Audio_{i}.wav")
+        if legacy.exists():
+            entry = manifest.chunks[i]
+            entry.update(status=STATUS_DONE, files=[describe_audio_file(legacy)])
+    manifest.save()
+    return manifest
@@ -1,125 +1,85 @@
+#!/usr/bin/env python3
+"""
+Synthesize the job's missing chunks offline with pyttsx3 and concatenate the episode.
+"""
 import os
-import re
-import time
-import struct
+import sys
 from pathlib import Path
-try:
-    import pyttsx3
-except Exception:
-    print('pyttsx3 not installed. Run: pip install pyttsx3')
-    raise
+from job_manifest import JobManifest, adopt_legacy_job, describe_audio_file
+from audio_encoder import encoder_settings_from_env
+from backends import local_engine
+from loudness import loudness_target_from_env, true_peak_from_env
+from seams import seam_settings_from_env
+from resample_chunks import TARGET_RATE, resample_in_place
+from script_chunker import chunk_script
+from segment_library import MARKER_RE
+from wav_io import concat_wav_files
 
-# Load chunks from script.txt
-def chunk_text(text, max_chars=1500):
-    import re
-    paragraphs = [p.strip() for p in text.split("\n\n") if p.strip()]
-    chunks = []
-    current = ""
-    for p in paragraphs:
-        if len(current) + len(p) + 2 <= max_chars:
-            current = (current + "\n\n" + p).strip()
-        else:
-            if current:
-                chunks.append(current)
-            if len(p) <= max_chars:
-                current = p
-            else:
-                sentences = re.split(r'(?<=[.!?])\s+', p)
-                cur2 = ""
-                for s in sentences:
-                    if len(cur2) + len(s) + 1 <= max_chars:
-                        cur2 = (cur2 + " " + s).strip()
-                    else:
-                        if cur2:
-                            chunks.append(cur2)
-                        cur2 = s
-                if cur2:
-                    current = cur2
-                else:
-                    current = ""
-    if current:
-        chunks.append(current)
-    return chunks
-
-SCRIPT = Path('script.txt')
-if not SCRIPT.exists():
-    print('script.txt not found; cannot proceed')
-    raise SystemExit(1)
-
-text = SCRIPT.read_text(encoding='utf-8')
-chunks = chunk_text(text, max_chars=1500)
-print(f'Chunks total: {len(chunks)}')
 
-# Find missing chunk indices
-existing = set()
-for p in Path('.').glob('Podcast_Audio_*.wav'):
-    m = re.search(r'_(\d+)\.', p.name)
-    if m:
-        existing.add(int(m.group(1)))
-missing = [i for i in range(len(chunks)) if i not in existing]
-print('Existing chunks:', sorted(existing))
-print('Missing chunks:', missing)
-if not missing:
-    print('No missing chunks to synthesize locally.')
-    raise SystemExit(0)
+def main(argv=None):
+    manifest = JobManifest.load()
+    if manifest:
+        chunks = [entry['text'] for entry in manifest.chunks]
+        print(f'Job manifest loaded: {manifest.path} ({len(chunks)} chunks)')
+    else:
+        script_path = Path('script.txt')
+        if not script_path.exists():
+            print('script.txt not found; cannot proceed')
+            return 1
 
-engine = pyttsx3.init()
-# Choose a German voice if present
-voices = engine.getProperty('voices')
-german_voice = None
-for v in voices:
-    name = v.name.lower() + ' ' + (getattr(v, 'id', '')).lower()
-    if 'german' in name or 'de_' in name or 'de-' in name or 'deu' in name:
-        german_voice = v.id
-        break
-if german_voice:
-    engine.setProperty('voice', german_voice)
-    print('Using German voice:', german_voice)
-else:
-    print('German voice not found, using default voice')
+        text = script_path.read_text(encoding='utf-8')
+        chunks = chunk_script(text, max_chars=1500)
+        manifest = adopt_legacy_job(chunks, 'local/pyttsx3', str(script_path))
+        print(f'Chunks total: {len(chunks)} (manifest created: {manifest.path})')
 
-rate = engine.getProperty('rate')
-engine.setProperty('rate', 150)  # slightly slower for clarity
+    # Missing chunks according to the manifest (pending, failed or truncated files)
+    missing = manifest.missing_chunks()
+    existing = [i for i in range(len(chunks)) if i not in missing]
+    # Recorded segments (segment_library.py): pyttsx3 would read the marker aloud
+    recorded = [i for i in missing if manifest.chunks[i].get('segment') and MARKER_RE.match(chunks[i])]
+    for i in recorded:
+        print(f"⚠ Chunk {i}: recorded segment {manifest.chunks[i]['segment']!r} lost its audio file, skipped")
+        manifest.mark_failed(i, 'segment audio file missing', attempts=0)
+    missing = [i for i in missing if i not in recorded]
+    print('Existing chunks:', existing)
+    print('Missing chunks:', missing)
+    if not missing:
+        print('No missing chunks to synthesize locally.')
+        return 0
 
-for idx in missing:
-    filename = f'Podcast_Audio_{idx}.wav'
-    print(f'Synthesizing chunk {idx} -> {filename} (len={len(chunks[idx])} chars)')
-    engine.save_to_file(chunks[idx], filename)
-    engine.runAndWait()
-    # small pause
-    time.sleep(1)
-    print('  saved', filename)
+    try:
+        engine = local_engine()
+    except ImportError:
+        print('pyttsx3 not installed. Run: pip install pyttsx3')
+        return 1
 
-# After generating missing pieces, concatenate all chunks
-chunk_files = sorted([str(p) for p in Path('.').glob('Podcast_Audio_*.wav') if p.name != 'Podcast_Audio_full.wav'], key=lambda x: int(re.search(r'_(\d+)\.', x).group(1)))
-print('Files to concatenate:', chunk_files)
-
-# Read WAV params from first file
-with open(chunk_files[0], 'rb') as f:
-    hdr = f.read(44)
-    num_channels = int.from_bytes(hdr[8:10], 'little')
-    sample_rate = int.from_bytes(hdr[24:28], 'little')
-    bits_per_sample = int.from_bytes(hdr[34:36], 'little')
+    for idx in missing:
+        filename = manifest.chunk_filename(idx)
+        print(f'Synthesizing chunk {idx} -> {filename} (len={len(chunks[idx])} chars)')
+        engine.save_to_file(chunks[idx], filename)
+        engine.runAndWait()
+        if Path(filename).exists():
+            # pyttsx3 voices write 22050 Hz; match Gemini's 24000 Hz so concat keeps the chunk
+            try:
+                resample_in_place(filename, TARGET_RATE)
+            except ValueError as e:
+                print(f'  ⚠ Could not resample {filename}: {e}')
+            manifest.mark_done(idx, [describe_audio_file(filename)])
+            print('  saved', filename)
+        else:
+            manifest.mark_failed(idx, 'pyttsx3 wrote no file')
+            print('  ✗ pyttsx3 did not write', filename)
 
-audio_data = b''
-for cf in chunk_files:
-    with open(cf, 'rb') as f:
-        f.seek(44)
-        audio_data += f.read()
+    # After generating missing pieces, concatenate all chunks in manifest order
+    chunk_files = manifest.chunk_files()
+    print('Files to concatenate:', chunk_files)
 
-bytes_per_sample = bits_per_sample // 8
-block_align = num_channels * bytes_per_sample
-byte_rate = sample_rate * block_align
-chunk_size = 36 + len(audio_data)
+    out_name = 'Podcast_Audio_full.wav'
+    concat_wav_files(chunk_files, out_name, loudness_target=loudness_target_from_env(), true_peak_db=true_peak_from_env(), seams=seam_settings_from_env(),
+                     encode=encoder_settings_from_env('Podcast_Audio_full'))
+    print('✓ Created', out_name)
+    return 0
 
-wav_header = struct.pack(
-    "<4sI4s4sIHHIIHH4sI",
-    b"RIFF", chunk_size, b"WAVE",
-    b"fmt ", 16, 1, num_channels, sample_rate, byte_rate, block_align, bits_per_sample,
-    b"data", len(audio_data)
-)
 
-out_name = 'Podcast_Audio_full.wav'
-with open(out_name, 'wb') as out:
-    out.write(wav_header + audio_data)
-print('✓ Created', out_name)
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,287 @@
+"""
+Streaming EBU R128 / ITU-R BS.1770 loudness normalization.
+
+Measurement: the K-weighting (high-shelf pre-filter + RLB high-pass) is
+applied as a linear-phase FIR with the magnitude response of the BS.1770
+biquads, computed for the file's sample rate and run block by block with
+FFT convolution. Mean-square energy is kept per 100 ms segment, which is all
+the gating needs: 400 ms blocks with 75% overlap, absolute gate at -70 LUFS,
+relative gate 10 LU below the ungated level.
+
+Normalization: every chunk is measured, given the gain that brings it to
+the target (bounded to +/- MAX_CHUNK_GAIN_DB), and the whole episode is then
+offset so its predicted integrated loudness hits the target. The gains are
+applied while streaming the chunks into the output, followed by a
+look-ahead limiter on the 4x oversampled true peak. Only one block per
+chunk is in memory at a time; the episode is never loaded as a whole.
+
+Settings (environment):
+  TTS_LOUDNESS_TARGET   integrated loudness in LUFS, "on" for -16 (default off)
+  TTS_TRUE_PEAK         true-peak ceiling in dBTP (default -1)
+"""
+import os
+from functools import lru_cache
+from itertools import repeat
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+from resample_chunks import BLOCK_FRAMES, HALF_TAPS, float_to_pcm, pcm_to_float, polyphase_kernels
+from seams import iter_seamed
+from wav_io import process_pool
+
+DEFAULT_TARGET_LUFS = -16.0
+DEFAULT_TRUE_PEAK_DB = -1.0
+# Chunks are never pushed further than this towards the target
+MAX_CHUNK_GAIN_DB = 12.0
+ABSOLUTE_GATE_LUFS = -70.0
+RELATIVE_GATE_LU = -10.0
+SEGMENT_SECONDS = 0.1
+SEGMENTS_PER_BLOCK = 4
+# Limiter look-ahead / hold time
+LIMITER_SECONDS = 0.005
+OVERSAMPLING = 4
+
+
+def _float_env(name: str, default):
+    raw = os.environ.get(name, "").strip()
+    if not raw:
+        return default
+    if raw.lower() in ("off", "none", "false", "no"):
+        return None
+    try:
+        return float(raw)
+    except ValueError:
+        print(f"⚠ Ignoring invalid {name}={raw!r}, using {'off' if default is None else default}")
+        return default
+
+
+def loudness_target_from_env() -> float | None:
+    """Target loudness from TTS_LOUDNESS_TARGET; None (normalization off) unless it is set."""
+    if os.environ.get("TTS_LOUDNESS_TARGET", "").strip().lower() in ("on", "yes", "true"):
+        return DEFAULT_TARGET_LUFS
+    return _float_env("TTS_LOUDNESS_TARGET", None)
+
+
+def true_peak_from_env() -> float:
+    """True-peak ceiling in dBTP from TTS_TRUE_PEAK; "off" keeps the default, 0 is a valid ceiling."""
+    value = _float_env("TTS_TRUE_PEAK", DEFAULT_TRUE_PEAK_DB)
+    return DEFAULT_TRUE_PEAK_DB if value is None else value
+
+
+def _biquad_response(b, a, w):
+    z = np.exp(-1j * w)
+    return (b[0] + b[1] * z + b[2] * z * z) / (a[0] + a[1] * z + a[2] * z * z)
+
+
+@lru_cache(maxsize=None)
+def k_weighting_fir(rate: int) -> np.ndarray:
+    """Linear-phase FIR with the magnitude response of the BS.1770 K-weighting at `rate`."""
+    # High-shelf pre-filter
+    k = np.tan(np.pi * 1681.974450955533 / rate)
+    q = 0.7071752369554196
+    vh = 10 ** (3.999843853973347 / 20)
+    vb = vh ** 0.4996667741545416
+    a0 = 1 + k / q + k * k
+    shelf_b = ((vh + vb * k / q + k * k) / a0, 2 * (k * k - vh) / a0, (vh - vb * k / q + k * k) / a0)
+    shelf_a = (1.0, 2 * (k * k - 1) / a0, (1 - k / q + k * k) / a0)
+    # RLB high-pass
+    k = np.tan(np.pi * 38.13547087602444 / rate)
+    q = 0.5003270373238773
+    a0 = 1 + k / q + k * k
+    hp_b = (1.0, -2.0, 1.0)
+    hp_a = (1.0, 2 * (k * k - 1) / a0, (1 - k / q + k * k) / a0)
+
+    nfft = 1 << 15
+    w = 2 * np.pi * np.arange(nfft // 2 + 1) / nfft
+    magnitude = np.abs(_biquad_response(shelf_b, shelf_a, w) * _biquad_response(hp_b, hp_a, w))
+    taps = 2 * int(rate * 0.04) + 1
+    impulse = np.roll(np.fft.irfft(magnitude, nfft), taps // 2)[:taps]
+    return impulse * np.hanning(taps + 2)[1:-1]
+
+
+class LoudnessMeter:
+    """Feed normalized float frames (n x channels); collects 100 ms K-weighted energies."""
+
+    def __init__(self, rate: int, channels: int):
+        self.fir = k_weighting_fir(rate)
+        self.segment = max(1, int(rate * SEGMENT_SECONDS))
+        self._history = np.zeros((len(self.fir) - 1, channels))
+        self._partial = np.zeros((0, channels))
+        self._segments = []
+        # Only the first two channels count (weight 1); surround weighting is not needed here
+        self.channels = min(channels, 2)
+
+    def process(self, frames: np.ndarray):
+        x = np.concatenate([self._history, frames])
+        nfft = 1 << int(np.ceil(np.log2(len(x))))
+        spectrum = np.fft.rfft(x, nfft, axis=0) * np.fft.rfft(self.fir, nfft)[:, None]
+        weighted = np.fft.irfft(spectrum, nfft, axis=0)[len(self.fir) - 1:len(x)]
+        self._history = x[len(x) - len(self._history):]
+        energy = np.concatenate([self._partial, weighted[:, :self.channels] ** 2])
+        full = len(energy) // self.segment * self.segment
+        if full:
+            self._segments.append(energy[:full].reshape(-1, self.segment, energy.shape[1]).sum(axis=1))
+        self._partial = energy[full:]
+
+    def segments(self) -> np.ndarray:
+        """Mean-square energy per 100 ms segment, summed over channels."""
+        if not self._segments:
+            return np.zeros(0)
+        return np.concatenate(self._segments).sum(axis=1) / self.segment
+
+
+def integrated_loudness(segments: np.ndarray) -> float:
+    """Gated integrated loudness (LUFS) from 100 ms segment energies; -inf if too short or silent."""
+    if len(segments) < SEGMENTS_PER_BLOCK:
+        return float("-inf")
+    blocks = sliding_window_view(segments, SEGMENTS_PER_BLOCK).mean(axis=1)
+    with np.errstate(divide="ignore"):
+        levels = -0.691 + 10 * np.log10(blocks)
+    gated = blocks[levels > ABSOLUTE_GATE_LUFS]
+    if not len(gated):
+        return float("-inf")
+    relative = -0.691 + 10 * np.log10(gated.mean()) + RELATIVE_GATE_LU
+    gated = blocks[(levels > ABSOLUTE_GATE_LUFS) & (levels > relative)]
+    return float(-0.691 + 10 * np.log10(gated.mean()))
+
+
+class TruePeakLimiter:
+    """Look-ahead limiter on the 4x oversampled peak; output lags input by one look-ahead."""
+
+    def __init__(self, rate: int, channels: int, ceiling_db: float = DEFAULT_TRUE_PEAK_DB):
+        self.ceiling = 10 ** (ceiling_db / 20)
+        self.hold = max(1, int(rate * LIMITER_SECONDS))
+        self.smooth = max(1, self.hold // 2)
+        self.phases = polyphase_kernels(OVERSAMPLING, 1)
+        self.context = self.hold + self.smooth + HALF_TAPS + 1
+        self._buf = np.zeros((self.context, channels))
+        self.limited = 0
+
+    def _gain(self, x: np.ndarray) -> np.ndarray:
+        """Per-sample gain that keeps the oversampled peak of x under the ceiling."""
+        padded = np.pad(x, ((HALF_TAPS, HALF_TAPS), (0, 0)))
+        windows = sliding_window_view(padded, self.phases.shape[1], axis=0)
+        peak = np.abs(np.einsum("nct,pt->ncp", windows, self.phases)).max(axis=(1, 2))
+        peak = np.maximum(peak, np.abs(x).max(axis=1))
+        required = np.minimum(1.0, self.ceiling / np.maximum(peak, 1e-12))
+        if required.min() >= 1.0:
+            return required
+        # Minimum over +/-hold, then a +/-smooth moving average: never above `required`
+        held = sliding_window_view(np.pad(required, self.hold, constant_values=1.0), 2 * self.hold + 1).min(axis=1)
+        total = np.concatenate([[0.0], np.cumsum(np.pad(held, self.smooth, constant_values=1.0))])
+        width = 2 * self.smooth + 1
+        return (total[width:] - total[:-width]) / width
+
+    def _run(self, end: int) -> np.ndarray:
+        c = self.context
+        if end <= c:
+            return np.zeros((0, self._buf.shape[1]))
+        window = self._buf[:end + c]
+        gain = self._gain(window)
+        out = window[c:end] * gain[c:end, None]
+        self.limited += int((gain[c:end] < 1.0).sum())
+        self._buf = self._buf[end - c:]
+        return out
+
+    def process(self, frames: np.ndarray) -> np.ndarray:
+        self._buf = np.concatenate([self._buf, frames])
+        return self._run(len(self._buf) - self.context)
+
+    def flush(self) -> np.ndarray:
+        self._buf = np.concatenate([self._buf, np.zeros_like(self._buf[:self.context])])
+        return self._run(len(self._buf) - self.context)
+
+
+def _read_blocks(path, offset: int, length: int, params, block_frames: int = BLOCK_FRAMES):
+    """Yield normalized float frames of a PCM byte range, one block at a time."""
+    frame_bytes = params.nchannels * params.sampwidth
+    full_scale = float(1 << (params.sampwidth * 8 - 1))
+    with open(path, "rb") as f:
+        f.seek(offset)
+        remaining = length
+        while remaining > 0:
+            raw = f.read(min(remaining, block_frames * frame_bytes))
+            if not raw:
+                break
+            remaining -= len(raw)
+            yield pcm_to_float(raw, params.sampwidth, params.nchannels) / full_scale
+
+
+def measure(path, offset: int, length: int, params) -> np.ndarray:
+    """100 ms segment energies of one chunk's audio."""
+    meter = LoudnessMeter(params.framerate, params.nchannels)
+    for block in _read_blocks(path, offset, length, params):
+        meter.process(block)
+    return meter.segments()
+
+
+def chunk_gain_db(loudness: float, target_lufs: float) -> float:
+    """Gain that brings a chunk measured at `loudness` to the target, bounded to +/- MAX_CHUNK_GAIN_DB."""
+    if np.isinf(loudness):
+        return 0.0
+    return float(np.clip(target_lufs - loudness, -MAX_CHUNK_GAIN_DB, MAX_CHUNK_GAIN_DB))
+
+
+def episode_offset_db(segments, gains_db, target_lufs: float) -> float:
+    """Common gain that moves the predicted loudness of the gained chunks onto the target."""
+    predicted = integrated_loudness(np.concatenate([s * 10 ** (g / 10) for s, g in zip(segments, gains_db)]))
+    return 0.0 if np.isinf(predicted) else target_lufs - predicted
+
+
+def write_limited(pieces, out, params, true_peak_db: float = DEFAULT_TRUE_PEAK_DB):
+    """Stream Pieces into `out` with their gains applied, through the true-peak limiter.
+
+    `pieces` may be a generator; the output is measured on the way.
+    Returns (audio bytes written, output segment energies, samples limited).
+    """
+    limiter = TruePeakLimiter(params.framerate, params.nchannels, true_peak_db)
+    meter = LoudnessMeter(params.framerate, params.nchannels)
+    full_scale = float(1 << (params.sampwidth * 8 - 1))
+    written = 0
+
+    def emit(frames):
+        nonlocal written
+        if len(frames):
+            meter.process(frames)
+            pcm = float_to_pcm(frames * full_scale, params.sampwidth)
+            out.write(pcm)
+            written += len(pcm)
+
+    for item in iter_seamed(pieces):
+        if isinstance(item, np.ndarray):
+            emit(limiter.process(item))
+            continue
+        path, offset, length, gain = item
+        for block in _read_blocks(path, offset, length, params):
+            emit(limiter.process(block * gain))
+    emit(limiter.flush())
+    return written, meter.segments(), limiter.limited
+
+
+def write_normalized(pieces, out, params, target_lufs: float = DEFAULT_TARGET_LUFS,
+                     true_peak_db: float = DEFAULT_TRUE_PEAK_DB) -> int:
+    """Stream chunk Pieces (see wav_io.Piece) into `out`, loudness-normalized.
+
+    Each chunk is measured over its whole data range; the gain is applied
+    to its body and to its seam edges. All pieces share `params`. Returns
+    the number of audio bytes written.
+    """
+    if not pieces:
+        return 0
+    # Chunks are measured in parallel; each worker holds one block at a time
+    with process_pool(len(pieces)) as pool:
+        segments = list(pool.map(measure, [p.path for p in pieces], [p.offset for p in pieces],
+                                 [p.length for p in pieces], repeat(params)))
+    loudness = [integrated_loudness(s) for s in segments]
+    gains_db = [chunk_gain_db(l, target_lufs) for l in loudness]
+    before = integrated_loudness(np.concatenate(segments))
+    offset_db = episode_offset_db(segments, gains_db, target_lufs)
+    for i, (l, g) in enumerate(zip(loudness, gains_db)):
+        print(f"  Chunk {i}: {l:6.1f} LUFS, gain {g + offset_db:+5.1f} dB")
+
+    pieces = [p._replace(gain=10 ** ((g + offset_db) / 20)) for p, g in zip(pieces, gains_db)]
+    written, output, limited = write_limited(pieces, out, params, true_peak_db)
+    print(f"✓ Loudness: {before:.1f} LUFS -> {integrated_loudness(output):.1f} LUFS "
+          f"(target {target_lufs:.1f}), {limited} samples limited to {true_peak_db:.1f} dBTP")
+    return written
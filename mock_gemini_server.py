@@ -0,0 +1,295 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for the Gemini TTS API, for load and failure testing.
+
+Speaks enough of the REST protocol for the genai client:
+POST /v1beta/models/<model>:generateContent and
+POST /v1beta/models/<model>:streamGenerateContent?alt=sse. Every request
+returns deterministic 16-bit PCM ("audio/L16;codec=pcm;rate=24000"): the
+same text always gives the same audio, about 15 characters per second of
+speech-like tone bursts framed by short silences. Failures are injected at
+configurable rates, from one seeded random stream:
+
+  429             JSON error with RetryInfo and a Retry-After header
+  disconnect      the SSE stream stops mid-body (httpx RemoteProtocolError)
+  empty           a candidate without content parts
+
+Latency per response is log-normal around --latency seconds plus
+--per-kchar seconds per 1000 characters of text; streamed
+responses deliver their first fragment after --ttfb of it. Per-model
+settings (matched as a substring of the model name) override the defaults,
+e.g. --model pro:rate_429=1 to simulate an exhausted pro quota.
+
+Usage:
+  python mock_gemini_server.py --port 8765 --rate-429 0.05 --disconnect-rate 0.05
+  GEMINI_BASE_URL=http://127.0.0.1:8765 GEMINI_API_KEY=mock python IVSC_Podcast_German.py
+
+GET /stats returns the request and failure counters as JSON.
+"""
+import argparse
+import base64
+import hashlib
+import json
+import math
+import random
+import re
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+RATE = 24000
+MIME_TYPE = f"audio/L16;codec=pcm;rate={RATE}"
+CHARS_PER_SECOND = 15.0
+_PATH_RE = re.compile(r"/models/([^/:]+):(generateContent|streamGenerateContent)")
+
+DEFAULTS = {
+    "latency": 1.0,        # median seconds per response
+    "per_kchar": 0.0,      # added median seconds per 1000 characters of text
+    "latency_sigma": 0.3,  # log-normal shape; 0 = fixed latency
+    "ttfb": 0.3,           # share of the latency before the first streamed fragment
+    "rate_429": 0.0,
+    "disconnect_rate": 0.0,
+    "empty_rate": 0.0,
+    "retry_after": 1.0,    # seconds announced with a 429
+    "fragments": 4,        # SSE events per streamed response
+}
+
+
+def synthetic_pcm(text: str) -> bytes:
+    """Deterministic speech-like 16-bit mono PCM for `text` (~CHARS_PER_SECOND)."""
+    seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+    rng = np.random.default_rng(seed)
+    words = text.split() or [""]
+    seconds_per_char = 1.0 / CHARS_PER_SECOND
+    pieces = [np.zeros(int(RATE * 0.2))]
+    for word in words:
+        n = max(1, int(RATE * seconds_per_char * (len(word) + 1)))
+        voiced = int(n * 0.8)
+        t = np.arange(voiced) / RATE
+        pitch = rng.uniform(110, 240)
+        envelope = np.sin(np.pi * np.arange(voiced) / voiced) ** 2
+        tone = 0.25 * envelope * (np.sin(2 * np.pi * pitch * t) + 0.3 * np.sin(4 * np.pi * pitch * t))
+        pieces.extend([tone, np.zeros(n - voiced)])
+    pieces.append(np.zeros(int(RATE * 0.3)))
+    return (np.concatenate(pieces) * 32767).astype("<i2").tobytes()
+
+
+class MockState:
+    """Settings, the seeded failure stream and counters shared by all handler threads."""
+
+    def __init__(self, settings: dict | None = None, overrides: dict | None = None, seed: int = 0):
+        self.settings = {**DEFAULTS, **(settings or {})}
+        # model substring -> settings that replace the defaults for matching models
+        self.overrides = overrides or {}
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.stats = {"requests": 0, "streamed": 0, "ok": 0, "rate_limited": 0, "disconnects": 0, "empty": 0,
+                      "chars": 0, "audio_bytes": 0}
+
+    def for_model(self, model: str) -> dict:
+        settings = dict(self.settings)
+        for pattern, override in self.overrides.items():
+            if pattern in model:
+                settings.update(override)
+        return settings
+
+    def draw(self, settings: dict, chars: int = 0) -> tuple[str, float]:
+        """Outcome ("429", "disconnect", "empty" or "ok") and latency of the next request."""
+        with self._lock:
+            roll = self._random.random()
+            sigma = settings["latency_sigma"]
+            median = settings["latency"] + settings["per_kchar"] * chars / 1000
+            latency = median * (math.exp(self._random.gauss(0, sigma)) if sigma > 0 else 1.0)
+        for outcome, rate in (("429", settings["rate_429"]), ("disconnect", settings["disconnect_rate"]),
+                              ("empty", settings["empty_rate"])):
+            if roll < rate:
+                return outcome, latency
+            roll -= rate
+        return "ok", latency
+
+    def count(self, **increments):
+        with self._lock:
+            for key, value in increments.items():
+                self.stats[key] += value
+
+
+def _candidate(parts) -> dict:
+    content = {"role": "model"}
+    if parts:
+        content["parts"] = parts
+    return {"candidates": [{"content": content, "finishReason": "STOP" if parts else "OTHER", "index": 0}]}
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server_version = "MockGemini/1.0"
+
+    @property
+    def state(self) -> MockState:
+        return self.server.state
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def do_GET(self):
+        if self.path.rstrip("/") == "/stats":
+            self._send_json(200, self.state.stats)
+        else:
+            self._send_json(404, {"error": {"code": 404, "message": "not found", "status": "NOT_FOUND"}})
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        body = json.loads(self.rfile.read(length) or b"{}")
+        match = _PATH_RE.search(self.path)
+        if not match:
+            self._send_json(404, {"error": {"code": 404, "message": f"unknown path {self.path}", "status": "NOT_FOUND"}})
+            return
+        model, method = match.groups()
+        text = "".join(part.get("text", "") for content in body.get("contents", [])
+                       for part in content.get("parts", []))
+        settings = self.state.for_model(model)
+        outcome, latency = self.state.draw(settings, len(text))
+        streamed = method == "streamGenerateContent"
+        self.state.count(requests=1, streamed=int(streamed), chars=len(text))
+
+        if outcome == "429":
+            time.sleep(latency * settings["ttfb"])
+            self.state.count(rate_limited=1)
+            retry = settings["retry_after"]
+            self._send_json(429, {"error": {
+                "code": 429, "message": "Resource has been exhausted (mock quota).", "status": "RESOURCE_EXHAUSTED",
+                "details": [{"@type": "type.googleapis.com/google.rpc.RetryInfo", "retryDelay": f"{retry:g}s"}],
+            }}, {"Retry-After": f"{retry:g}"})
+            return
+        if outcome == "empty":
+            time.sleep(latency)
+            self.state.count(empty=1)
+            event = _candidate(None)
+            if streamed:
+                self._send_stream([event], [0.0])
+            else:
+                self._send_json(200, event)
+            return
+
+        pcm = synthetic_pcm(text)
+        if not streamed:
+            time.sleep(latency)
+            self.state.count(ok=1, audio_bytes=len(pcm))
+            self._send_json(200, _candidate([{"inlineData": {"mimeType": MIME_TYPE,
+                                                              "data": base64.b64encode(pcm).decode()}}]))
+            return
+        # Fragments on sample boundaries, the first after the TTFB share of the latency
+        n = max(1, int(settings["fragments"]))
+        step = -(-len(pcm) // n // 2) * 2
+        events = [_candidate([{"inlineData": {"mimeType": MIME_TYPE,
+                                              "data": base64.b64encode(pcm[i:i + step]).decode()}}])
+                  for i in range(0, len(pcm), step)]
+        delays = [latency * settings["ttfb"]] + [latency * (1 - settings["ttfb"]) / max(1, len(events) - 1)] * (len(events) - 1)
+        if outcome == "disconnect":
+            self.state.count(disconnects=1)
+            cut = max(1, len(events) // 2)
+            self._send_stream(events[:cut], delays[:cut], complete=False)
+            return
+        self.state.count(ok=1, audio_bytes=len(pcm))
+        self._send_stream(events, delays)
+
+    def _send_json(self, status: int, payload: dict, headers: dict | None = None):
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=UTF-8")
+        self.send_header("Content-Length", str(len(data)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_stream(self, events, delays, complete: bool = True):
+        """Server-sent events in chunked encoding; `complete=False` drops the connection mid-body."""
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        for event, delay in zip(events, delays):
+            time.sleep(delay)
+            data = f"data: {json.dumps(event)}\r\n\r\n".encode()
+            self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+            self.wfile.flush()
+        if complete:
+            self.wfile.write(b"0\r\n\r\n")
+            return
+        self.close_connection = True
+        self.connection.shutdown(socket.SHUT_RDWR)
+
+
+class MockGeminiServer(ThreadingHTTPServer):
+    """Threaded mock server; start() serves in a background thread and returns the base URL."""
+
+    daemon_threads = True
+
+    def __init__(self, state: MockState | None = None, host: str = "127.0.0.1", port: int = 0,
+                 verbose: bool = False):
+        super().__init__((host, port), MockHandler)
+        self.state = state or MockState()
+        self.verbose = verbose
+        self._thread = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> str:
+        self._thread = threading.Thread(target=self.serve_forever, name="mock-gemini", daemon=True)
+        self._thread.start()
+        return self.base_url
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+def parse_overrides(values) -> dict:
+    """["pro:rate_429=1,latency=3", ...] -> {"pro": {"rate_429": 1.0, "latency": 3.0}}."""
+    overrides = {}
+    for value in values or []:
+        pattern, _, assignments = value.partition(":")
+        settings = overrides.setdefault(pattern, {})
+        for assignment in filter(None, assignments.split(",")):
+            key, _, number = assignment.partition("=")
+            if key not in DEFAULTS:
+                raise ValueError(f"unknown mock setting {key!r} (one of {', '.join(DEFAULTS)})")
+            settings[key] = float(number)
+    return overrides
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Local mock of the Gemini TTS API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--seed", type=int, default=0, help="seed of the failure/latency stream")
+    for key, default in DEFAULTS.items():
+        parser.add_argument(f"--{key.replace('_', '-')}", dest=key, type=float, default=default)
+    parser.add_argument("--model", action="append", metavar="SUBSTR:KEY=VALUE,...",
+                        help="per-model settings, e.g. pro:rate_429=1 (repeatable)")
+    parser.add_argument("--verbose", action="store_true", help="log every request")
+    args = parser.parse_args(argv)
+
+    state = MockState({key: getattr(args, key) for key in DEFAULTS}, parse_overrides(args.model), args.seed)
+    server = MockGeminiServer(state, args.host, args.port, args.verbose)
+    print(f"✓ Mock Gemini TTS API on {server.base_url}")
+    print(f"  export GEMINI_BASE_URL={server.base_url} GEMINI_API_KEY=mock")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(f"Stats: {json.dumps(state.stats)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""
+One entry point for the podcast tools.
+
+Usage:
+  python podcast_cli.py generate [--pro] [--profile]   synthesize script.txt into the episode (flash by default)
+  python podcast_cli.py batch SCRIPTS... [--pro]       synthesize several scripts under one request budget
+  python podcast_cli.py resume                         synthesize the job's missing chunks, then concatenate
+  python podcast_cli.py concat [--profile]             concatenate the chunks that are done
+  python podcast_cli.py resample [FILES] [--rate HZ]   resample chunks to a common sample rate
+  python podcast_cli.py inspect [FILES]                show the WAV headers of the chunks
+  python podcast_cli.py segments list|build [--pro]    show or pre-render the segment library
+  python podcast_cli.py fallback                       synthesize missing chunks offline with pyttsx3
+  python podcast_cli.py startup [--runs N]             measure the start-up time of every command
+
+A command imports its module only when it runs. The offline commands
+(concat, resample, inspect) never load google-genai, httpx or python-dotenv
+and need no API key; resume only needs them when chunks are missing.
+"""
+import json
+import statistics
+import subprocess
+import sys
+import time
+
+# command -> (module, usage)
+COMMANDS = {
+    "generate": ("IVSC_Podcast_German_flash", "generate [--pro] [--profile[=DIR]]"),
+    "batch": ("batch", "batch SCRIPTS... [--pro] [--out DIR]"),
+    "resume": ("generate_missing_chunks", "resume"),
+    "concat": ("concat_partial", "concat [--profile[=DIR]]"),
+    "resample": ("resample_chunks", "resample [FILES] [--rate HZ] [--profile [DIR]]"),
+    "inspect": ("check_wav_headers", "inspect [FILES]"),
+    "segments": ("segment_library", "segments list|build [--pro] [--force] [--dir DIR]"),
+    "fallback": ("local_tts_fallback", "fallback"),
+}
+PRO_MODULE = "IVSC_Podcast_German"
+# Commands that must start without the network stack
+OFFLINE = ("concat", "resample", "inspect")
+HEAVY_MODULES = ("google.genai", "httpx", "dotenv", "numpy")
+DEFAULT_RUNS = 5
+
+
+def run_command(name: str, argv: list[str]) -> int:
+    module_name = COMMANDS[name][0]
+    if name == "generate":
+        if "--pro" in argv:
+            module_name = PRO_MODULE
+        argv = [a for a in argv if a not in ("--pro", "--flash")]
+    module = __import__(module_name)
+    return module.main(argv) or 0
+
+
+def _imported_modules(name: str):
+    """Child of `startup`: import the command's module and report which heavy modules came along."""
+    __import__(COMMANDS[name][0])
+    print(json.dumps([m for m in HEAVY_MODULES if m in sys.modules]))
+
+
+def measure_startup(runs: int = DEFAULT_RUNS) -> int:
+    """Median time to start the interpreter and import each command; fails if an offline command is heavy."""
+
+    def timed(cmd):
+        samples = []
+        for _ in range(runs):
+            started = time.perf_counter()
+            result = subprocess.run(cmd, capture_output=True, text=True)
+            samples.append((time.perf_counter() - started) * 1000)
+        return statistics.median(samples), result
+
+    baseline, _ = timed([sys.executable, "-c", "pass"])
+    print(f"{'python -c pass':<12} {baseline:7.1f} ms")
+    failed = False
+    for name in COMMANDS:
+        ms, result = timed([sys.executable, __file__, "--imports", name])
+        if result.returncode != 0:
+            print(f"{name:<12}  import failed: {result.stderr.strip().splitlines()[-1]}")
+            failed |= name in OFFLINE
+            continue
+        heavy = json.loads(result.stdout.strip().splitlines()[-1])
+        networked = [m for m in heavy if m != "numpy"]
+        problem = name in OFFLINE and networked
+        failed |= bool(problem)
+        print(f"{name:<12} {ms:7.1f} ms  (+{ms - baseline:.1f})  {', '.join(heavy) or '-'}"
+              + ("  ✗ offline command loads the network stack" if problem else ""))
+    return 1 if failed else 0
+
+
+def usage() -> str:
+    return __doc__.split("Usage:\n", 1)[1].split("\n\n", 1)[0]
+
+
+def main(argv=None) -> int:
+    argv = sys.argv[1:] if argv is None else argv
+    if argv[:1] == ["--imports"]:
+        _imported_modules(argv[1])
+        return 0
+    if not argv or argv[0] in ("-h", "--help"):
+        print("Usage:\n" + usage())
+        return 0
+    name, rest = argv[0], argv[1:]
+    if name == "startup":
+        runs = int(rest[rest.index("--runs") + 1]) if "--runs" in rest else DEFAULT_RUNS
+        return measure_startup(runs)
+    if name not in COMMANDS:
+        print(f"✗ Unknown command {name!r}\nUsage:\n{usage()}")
+        return 2
+    if rest[:1] in (["-h"], ["--help"]) and name not in ("resample", "batch", "segments"):
+        print(f"Usage: python podcast_cli.py {COMMANDS[name][1]}")
+        return 0
+    return run_command(name, rest)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,152 @@
+"""
+Per-stage CPU and allocation profiles for the generator and the audio tools.
+
+With --profile, every pipeline stage runs under its own cProfile profiler
+and between two tracemalloc snapshots. Each stage writes <stage>.pstats
+(python -m pstats, snakeviz) into the profile directory, by default
+<output>.profile/ next to the output file, and allocations.txt lists per
+stage the wall time, the peak traced memory, the net growth and the lines
+that still hold the most of it at the end of the stage.
+
+cProfile only sees the thread that runs the stage, and only one profiler
+may be active at a time (Python 3.12 refuses a second one): a stage that
+starts while another is being profiled, such as the episode writer thread
+during synthesis, records its allocations only and says so in
+allocations.txt. Pool workers are not profiled. tracemalloc is
+process-wide, so a stage's allocations and peak include those of threads
+running at the same time.
+
+Without --profile, stage() returns one shared no-op context manager, so
+the instrumented code pays a method call per stage and nothing else.
+"""
+import contextlib
+import cProfile
+import threading
+import time
+import tracemalloc
+from pathlib import Path
+
+# Allocation sites listed per stage
+TOP_ALLOCATIONS = 15
+_NO_STAGE = contextlib.nullcontext()
+_TRACE_FILTERS = [
+    tracemalloc.Filter(False, __file__),
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+    tracemalloc.Filter(False, "<unknown>"),
+]
+
+
+class NullProfiler:
+    """Profiling off: stages cost nothing."""
+
+    enabled = False
+
+    def stage(self, name: str):
+        return _NO_STAGE
+
+    def close(self) -> None:
+        pass
+
+
+class StageProfiler:
+    """cProfile + tracemalloc per stage, written to `directory`."""
+
+    enabled = True
+
+    def __init__(self, directory):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._names = {}
+        self._sections = []
+        self._active = 0
+        self._profiling = False
+        self._peak = 0
+        tracemalloc.start()
+
+    @contextlib.contextmanager
+    def stage(self, name: str):
+        with self._lock:
+            # Repeated stages get numbered files
+            count = self._names[name] = self._names.get(name, 0) + 1
+            self._active += 1
+            if self._active == 1:
+                # Peak of this stage alone, unless another stage is running
+                self._peak = max(self._peak, tracemalloc.get_traced_memory()[1])
+                tracemalloc.reset_peak()
+            # One cProfile at a time; a stage that overlaps the profiled one traces allocations only
+            profile = None if self._profiling else cProfile.Profile()
+            if profile is not None:
+                self._profiling = True
+        label = name if count == 1 else f"{name}-{count}"
+        before = None
+        started = time.perf_counter()
+        try:
+            before = tracemalloc.take_snapshot().filter_traces(_TRACE_FILTERS)
+            if profile is not None:
+                try:
+                    profile.enable()
+                except ValueError:
+                    # Another profiling tool (a debugger, an outer cProfile) holds the hook
+                    with self._lock:
+                        self._profiling = False
+                    profile = None
+            started = time.perf_counter()
+            yield
+        finally:
+            seconds = time.perf_counter() - started
+            if profile is not None:
+                profile.disable()
+            stage_peak = tracemalloc.get_traced_memory()[1]
+            with self._lock:
+                self._active -= 1
+                self._peak = max(self._peak, stage_peak)
+                if profile is not None:
+                    self._profiling = False
+            if before is not None:
+                self._report(label, seconds, stage_peak, before, profile)
+
+    def _report(self, label: str, seconds: float, stage_peak: int, before, profile):
+        """Write the stage's .pstats (if it was profiled) and add its section to allocations.txt."""
+        if profile is not None:
+            profile.dump_stats(self.directory / f"{label}.pstats")
+        after = tracemalloc.take_snapshot().filter_traces(_TRACE_FILTERS)
+        growth = after.compare_to(before, "lineno")
+        lines = [f"== {label}: {seconds:.2f}s, peak {stage_peak / 2**20:.1f} MB, "
+                 f"{sum(s.size_diff for s in growth) / 2**20:+.1f} MB net"
+                 + ("" if profile is not None else ", allocations only (cProfile was in use)")]
+        for stat in sorted(growth, key=lambda s: s.size_diff, reverse=True)[:TOP_ALLOCATIONS]:
+            frame = stat.traceback[0]
+            lines.append(f"  {stat.size_diff / 1024:+10.0f} KiB {stat.count_diff:+8d} blocks  "
+                         f"{frame.filename}:{frame.lineno}")
+        with self._lock:
+            self._sections.append("\n".join(lines))
+            self._write()
+
+    def _write(self):
+        current, peak = tracemalloc.get_traced_memory()
+        peak = max(peak, self._peak)
+        text = "\n\n".join(self._sections)
+        text += f"\n\nTraced memory: {current / 2**20:.1f} MB now, {peak / 2**20:.1f} MB peak\n"
+        (self.directory / "allocations.txt").write_text(text, encoding="utf-8")
+
+    def close(self) -> None:
+        """Write the final summary and stop tracing."""
+        with self._lock:
+            self._write()
+        tracemalloc.stop()
+        print(f"✓ Profiles written to {self.directory}/ (*.pstats, allocations.txt)")
+
+
+def profiler_from_argv(argv, output_path):
+    """StageProfiler for `--profile` / `--profile=DIR` in `argv`, else a NullProfiler.
+
+    The default directory is `output_path` with its suffix replaced by .profile.
+    """
+    for arg in argv:
+        if arg == "--profile" or arg.startswith("--profile="):
+            directory = arg.partition("=")[2] or Path(output_path).with_suffix(".profile")
+            return StageProfiler(directory)
+    return NullProfiler()
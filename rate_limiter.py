@@ -0,0 +1,208 @@
+"""
+Adaptive rate limiters for Gemini TTS requests, one per model.
+
+Each model has its own quota, so each gets its own limiter, shared by every
+caller in the process that sends requests to that model. Two token buckets
+pace every `generate_content*` call: one for requests per minute, one for
+characters per minute. A 429 halves the model's allowed rate and pauses
+all its callers until the server's Retry-After (header or RetryInfo
+detail) has passed; each successful request raises the rate again step by
+step up to the configured ceiling. Callers reserve capacity first and then
+sleep for the returned delay, so the same limiter serves threads and asyncio.
+
+Settings (environment):
+  TTS_REQUESTS_PER_MIN   request ceiling per minute (default 10)
+  TTS_CHARS_PER_MIN      character ceiling per minute (default 30000)
+Set either to 0 to disable that bucket.
+"""
+import asyncio
+import os
+import re
+import threading
+import time
+
+DEFAULT_REQUESTS_PER_MIN = 10
+DEFAULT_CHARS_PER_MIN = 30000
+# Seconds of traffic the buckets may release at once
+BURST_SECONDS = 10
+# Back-off used after a 429 that carries no Retry-After information
+DEFAULT_COOLDOWN = 15.0
+MAX_COOLDOWN = 300.0
+MIN_RATE_FRACTION = 0.1
+
+
+class TokenBucket:
+    """Token bucket whose balance may go negative (reservations queue up)."""
+
+    def __init__(self, per_minute: float, burst_seconds: float = BURST_SECONDS):
+        self.max_rate = per_minute / 60.0
+        self.rate = self.max_rate
+        self.burst_seconds = burst_seconds
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    @property
+    def capacity(self) -> float:
+        return max(1.0, self.rate * self.burst_seconds)
+
+    def _refill(self, now: float):
+        if self.max_rate <= 0:
+            return
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, amount: float, now: float) -> float:
+        """Take `amount` tokens and return how long the caller must wait."""
+        if self.max_rate <= 0:
+            return 0.0  # unlimited
+        self._refill(now)
+        self.tokens -= amount
+        if self.tokens >= 0:
+            return 0.0
+        return -self.tokens / self.rate
+
+    def scale(self, factor: float, now: float):
+        if self.max_rate <= 0:
+            return
+        self._refill(now)
+        self.rate = min(self.max_rate, max(self.max_rate * MIN_RATE_FRACTION, self.rate * factor))
+        self.tokens = min(self.tokens, self.capacity)
+
+
+class RateLimiter:
+    """Adaptive request/character limiter shared by all threads and tasks."""
+
+    def __init__(self, requests_per_min: float = DEFAULT_REQUESTS_PER_MIN,
+                 chars_per_min: float = DEFAULT_CHARS_PER_MIN):
+        self._lock = threading.Lock()
+        self.requests = TokenBucket(requests_per_min)
+        self.chars = TokenBucket(chars_per_min)
+        self.blocked_until = 0.0
+        self.consecutive_limits = 0
+        self.rate_limited_total = 0
+
+    def reserve(self, chars: int = 0) -> float:
+        """Reserve one request of `chars` characters; returns the delay in seconds."""
+        with self._lock:
+            now = time.monotonic()
+            wait = max(self.requests.reserve(1, now), self.chars.reserve(chars, now))
+            return max(wait, self.blocked_until - now, 0.0)
+
+    def acquire(self, chars: int = 0):
+        """Block the calling thread until the request may be sent."""
+        delay = self.reserve(chars)
+        if delay > 0:
+            time.sleep(delay)
+
+    async def acquire_async(self, chars: int = 0):
+        """Wait (without blocking the event loop) until the request may be sent."""
+        delay = self.reserve(chars)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def report_success(self):
+        """Additive increase: recover 10% of the ceiling per successful request."""
+        with self._lock:
+            self.consecutive_limits = 0
+            now = time.monotonic()
+            for bucket in (self.requests, self.chars):
+                bucket._refill(now)
+                bucket.rate = min(bucket.max_rate, bucket.rate + bucket.max_rate * 0.1)
+
+    def report_rate_limited(self, retry_after: float | None = None) -> float:
+        """Multiplicative decrease after a 429; returns the imposed pause in seconds."""
+        with self._lock:
+            now = time.monotonic()
+            self.consecutive_limits += 1
+            self.rate_limited_total += 1
+            for bucket in (self.requests, self.chars):
+                bucket.scale(0.5, now)
+            if retry_after is None:
+                retry_after = min(MAX_COOLDOWN, DEFAULT_COOLDOWN * (2 ** (self.consecutive_limits - 1)))
+            pause = min(MAX_COOLDOWN, max(0.0, retry_after))
+            self.blocked_until = max(self.blocked_until, now + pause)
+            return pause
+
+    def describe(self) -> str:
+        return (f"{self.requests.rate * 60:.1f} req/min, {self.chars.rate * 60:.0f} chars/min, "
+                f"{self.rate_limited_total} rate limit(s) seen")
+
+
+def _float_env(name: str, default: float) -> float:
+    raw = os.environ.get(name, "")
+    try:
+        return float(raw) if raw.strip() else default
+    except ValueError:
+        print(f"⚠ Ignoring invalid {name}={raw!r}, using {default}")
+        return default
+
+
+_limiters = {}
+_limiter_lock = threading.Lock()
+
+
+def get_rate_limiter(model: str) -> RateLimiter:
+    """Return the limiter of `model`, creating it from the environment once.
+
+    Gemini models have separate quotas, so a 429 from one model does not
+    pause requests to another.
+    """
+    with _limiter_lock:
+        if model not in _limiters:
+            _limiters[model] = RateLimiter(
+                requests_per_min=_float_env("TTS_REQUESTS_PER_MIN", DEFAULT_REQUESTS_PER_MIN),
+                chars_per_min=_float_env("TTS_CHARS_PER_MIN", DEFAULT_CHARS_PER_MIN),
+            )
+        return _limiters[model]
+
+
+def _parse_duration(value) -> float | None:
+    """Parse '30', '30s' or '1.5s' (RetryInfo.retryDelay) into seconds."""
+    if value is None:
+        return None
+    m = re.fullmatch(r"\s*(\d+(?:\.\d+)?)\s*s?\s*", str(value))
+    return float(m.group(1)) if m else None
+
+
+def error_status(err):
+    """HTTP status of a google-genai APIError (None for other exceptions)."""
+    return getattr(err, "code", None) or getattr(err, "status_code", None)
+
+
+def retry_after_from_error(err) -> float | None:
+    """Extract the server's requested pause from a 429 error, if it sent one."""
+    response = getattr(err, "response", None)
+    headers = getattr(response, "headers", None)
+    if headers:
+        delay = _parse_duration(headers.get("retry-after"))
+        if delay is not None:
+            return delay
+    details = getattr(err, "details", None)
+    if isinstance(details, dict):
+        details = details.get("error", details).get("details", [])
+    for item in details or []:
+        if isinstance(item, dict) and "RetryInfo" in str(item.get("@type", "")):
+            delay = _parse_duration(item.get("retryDelay"))
+            if delay is not None:
+                return delay
+    return None
+
+
+def call_with_rate_limit(func, model: str, chars: int = 0, max_retries: int = 5):
+    """Call `func()` (a request to `model`) under that model's limiter, retrying it after 429 responses."""
+    limiter = get_rate_limiter(model)
+    for attempt in range(max_retries):
+        limiter.acquire(chars)
+        try:
+            result = func()
+        except Exception as e:
+            if error_status(e) != 429:
+                raise
+            pause = limiter.report_rate_limited(retry_after_from_error(e))
+            if attempt == max_retries - 1:
+                print("Max retries exceeded. Please check your Gemini API quota and billing.")
+                raise
+            print(f"  ⚠ Rate limited (429). Pausing {pause:.1f}s, now at {limiter.describe()} (attempt {attempt + 1}/{max_retries})")
+            continue
+        limiter.report_success()
+        return result
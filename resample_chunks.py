@@ -1,98 +1,248 @@
 #!/usr/bin/env python3
-"""Resample chunks 8 and 9 from 22050 Hz to 24000 Hz to match other chunks"""
-import struct
-import array
-
-def resample_audio(input_file, output_file, target_rate=24000):
-    """Resample a WAV file to target sample rate using linear interpolation"""
-    
-    # Read input WAV
-    with open(input_file, 'rb') as f:
-        # Read header (44 bytes)
-        header = f.read(44)
-        
-        # Parse key params
-        num_channels = struct.unpack('<H', header[22:24])[0]
-        source_rate = struct.unpack('<I', header[24:28])[0]
-        bits_per_sample = struct.unpack('<H', header[34:36])[0]
-        
-        print(f"Input: {input_file}")
-        print(f"  Source rate: {source_rate} Hz")
-        print(f"  Target rate: {target_rate} Hz")
-        print(f"  Channels: {num_channels}")
-        print(f"  Bits per sample: {bits_per_sample}")
-        
-        # Read audio data
-        audio_data = f.read()
-    
-    # Convert bytes to samples
-    if bits_per_sample == 16:
-        samples = array.array('h')  # signed short
-        samples.frombytes(audio_data)
+"""
+Resample WAV chunks to a common sample rate (default 24000 Hz, Gemini's output).
+
+Band-limited polyphase resampling with NumPy: the rate ratio is reduced to
+up/down, a Kaiser-windowed sinc low-pass is designed once per (source, target)
+pair and split into `up` phases, and each output sample is the dot product of
+one phase with the input samples around it. Files are processed in blocks, so
+long files (e.g. a full episode) resample in constant memory.
+
+Usage:
+  python resample_chunks.py                      # all chunks of the job not at 24000 Hz
+  python resample_chunks.py a.wav b.wav --rate 24000
+  python resample_chunks.py --profile            # also write CPU/allocation profiles
+
+Files are replaced in place; records in podcast_manifest.json are updated.
+"""
+import argparse
+import glob
+import os
+from functools import lru_cache
+from math import gcd
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+from job_manifest import JobManifest, describe_audio_file
+from profiling import NullProfiler, StageProfiler
+from wav_io import WAVE_FORMAT_PCM, read_wav_layout, wav_header
+
+TARGET_RATE = 24000
+# Input frames read per block in streaming mode
+BLOCK_FRAMES = 1 << 16
+# Filter half-length in input samples (per side) and Kaiser window shape
+HALF_TAPS = 16
+KAISER_BETA = 8.6
+# Low-pass cutoff relative to the lower of the two Nyquist frequencies
+ROLLOFF = 0.94
+
+
+@lru_cache(maxsize=None)
+def polyphase_kernels(up: int, down: int) -> np.ndarray:
+    """Phase matrix (up x taps) of the anti-aliasing filter for an up/down ratio.
+
+    Row p holds the filter taps used by outputs at phase p, reversed so that
+    row @ input_window (oldest sample first) gives the output sample.
+    """
+    length = 2 * HALF_TAPS * up + 1
+    center = HALF_TAPS * up
+    # Cutoff in cycles per sample of the virtual upsampled signal
+    cutoff = 0.5 * ROLLOFF / max(up, down)
+    k = np.arange(length) - center
+    h = 2 * cutoff * np.sinc(2 * cutoff * k) * np.kaiser(length, KAISER_BETA)
+    # Unity DC gain: every phase sums to ~1 after interpolation by `up`
+    h *= up / h.sum()
+    taps = -(-length // up)
+    padded = np.zeros(taps * up)
+    padded[:length] = h
+    # padded[p + j*up] weights x[i - j]; reverse j so windows run oldest -> newest
+    return padded.reshape(taps, up).T[:, ::-1].copy()
+
+
+class PolyphaseResampler:
+    """Streaming resampler: feed frames with process(), finish with flush()."""
+
+    def __init__(self, source_rate: int, target_rate: int, channels: int = 1):
+        g = gcd(source_rate, target_rate)
+        self.up, self.down = target_rate // g, source_rate // g
+        self.phases = polyphase_kernels(self.up, self.down)
+        self.taps = self.phases.shape[1]
+        self.center = HALF_TAPS * self.up
+        # Input history; _offset is the input index of _buf[0] (starts in the zero padding)
+        self._buf = np.zeros((self.taps, channels))
+        self._offset = -self.taps
+        self._next = 0
+        self._consumed = 0
+
+    def _emit(self, stop: int | None = None) -> np.ndarray:
+        last_input = self._offset + len(self._buf) - 1
+        # Outputs whose newest needed input sample is already buffered
+        end = ((last_input + 1) * self.up - 1 - self.center) // self.down + 1
+        if stop is not None:
+            end = min(end, stop)
+        end = max(end, self._next)
+        n = np.arange(self._next, end)
+        m = n * self.down + self.center
+        newest, phase = m // self.up, m % self.up
+        windows = sliding_window_view(self._buf, self.taps, axis=0)
+        out = np.einsum("nct,nt->nc", windows[newest - (self.taps - 1) - self._offset], self.phases[phase])
+        self._next = end
+        # Drop input no later output will need
+        keep = (end * self.down + self.center) // self.up - (self.taps - 1) - self._offset
+        keep = max(0, min(keep, len(self._buf)))
+        self._buf = self._buf[keep:]
+        self._offset += keep
+        return out
+
+    def process(self, frames: np.ndarray) -> np.ndarray:
+        """Resample a block of frames (n x channels); returns the outputs now complete."""
+        self._buf = np.concatenate([self._buf, frames])
+        self._consumed += len(frames)
+        return self._emit()
+
+    def flush(self) -> np.ndarray:
+        """Return the remaining outputs, padding the end of the input with silence."""
+        total = -(-self._consumed * self.up // self.down)
+        self._buf = np.concatenate([self._buf, np.zeros((self.taps, self._buf.shape[1]))])
+        return self._emit(stop=total)
+
+
+def resample(samples: np.ndarray, source_rate: int, target_rate: int) -> np.ndarray:
+    """Resample a whole (frames x channels) array in memory."""
+    if source_rate == target_rate:
+        return samples
+    resampler = PolyphaseResampler(source_rate, target_rate, samples.shape[1])
+    return np.concatenate([resampler.process(samples), resampler.flush()])
+
+
+def pcm_to_float(raw: bytes, sampwidth: int, channels: int) -> np.ndarray:
+    """Decode interleaved little-endian PCM into (frames x channels) float64."""
+    if sampwidth == 1:
+        data = np.frombuffer(raw, dtype=np.uint8).astype(np.float64) - 128
+    elif sampwidth == 2:
+        data = np.frombuffer(raw, dtype="<i2").astype(np.float64)
+    elif sampwidth == 3:
+        b = np.frombuffer(raw, dtype=np.uint8).reshape(-1, 3).astype(np.int32)
+        data = (b[:, 0] | (b[:, 1] << 8) | (b[:, 2] << 16)).astype(np.float64)
+        data[data >= 1 << 23] -= 1 << 24
+    elif sampwidth == 4:
+        data = np.frombuffer(raw, dtype="<i4").astype(np.float64)
     else:
-        raise ValueError(f"Unsupported bits per sample: {bits_per_sample}")
-    
-    # Resample using linear interpolation
-    ratio = source_rate / target_rate
-    num_output_samples = int(len(samples) / ratio)
-    resampled = array.array('h')
-    
-    for i in range(num_output_samples):
-        # Calculate source position
-        src_pos = i * ratio
-        src_idx = int(src_pos)
-        
-        # Linear interpolation
-        if src_idx + 1 < len(samples):
-            frac = src_pos - src_idx
-            sample = samples[src_idx] * (1 - frac) + samples[src_idx + 1] * frac
-            resampled.append(int(sample))
-        elif src_idx < len(samples):
-            resampled.append(samples[src_idx])
-    
-    # Create new WAV with resampled data
-    resampled_bytes = resampled.tobytes()
-    bytes_per_sample = bits_per_sample // 8
-    block_align = num_channels * bytes_per_sample
-    byte_rate = target_rate * block_align
-    chunk_size = 36 + len(resampled_bytes)
-    
-    new_header = struct.pack(
-        "<4sI4s4sIHHIIHH4sI",
-        b"RIFF",
-        chunk_size,
-        b"WAVE",
-        b"fmt ",
-        16,
-        1,  # PCM
-        num_channels,
-        target_rate,
-        byte_rate,
-        block_align,
-        bits_per_sample,
-        b"data",
-        len(resampled_bytes),
-    )
-    
-    # Write output
-    with open(output_file, 'wb') as f:
-        f.write(new_header + resampled_bytes)
-    
-    print(f"  ✓ Resampled to {target_rate} Hz: {output_file}")
-    print(f"  Output samples: {len(resampled)}")
-    print()
-
-# Resample chunks 8 and 9
-for i in [8, 9]:
-    input_file = f'Podcast_Audio_{i}.wav'
-    output_file = f'Podcast_Audio_{i}_resampled.wav'
-    resample_audio(input_file, output_file, target_rate=24000)
-    
-    # Replace original with resampled
-    import os
-    os.replace(output_file, input_file)
-    print(f"  ✓ Replaced {input_file} with resampled version\n")
-
-print("="*60)
-print("✓ Resampling complete!")
-print("All chunks now use 24000 Hz sample rate")
+        raise ValueError(f"Unsupported sample width: {sampwidth * 8} bit")
+    return data.reshape(-1, channels)
+
+
+def float_to_pcm(samples: np.ndarray, sampwidth: int) -> bytes:
+    """Round, clip and encode (frames x channels) samples as little-endian PCM."""
+    bits = sampwidth * 8
+    lo, hi = -(1 << (bits - 1)), (1 << (bits - 1)) - 1
+    ints = np.clip(np.rint(samples), lo, hi).astype(np.int64).ravel()
+    if sampwidth == 1:
+        return (ints + 128).astype(np.uint8).tobytes()
+    if sampwidth == 2:
+        return ints.astype("<i2").tobytes()
+    if sampwidth == 3:
+        b = (ints & 0xFFFFFF).astype("<u4").view(np.uint8).reshape(-1, 4)[:, :3]
+        return b.tobytes()
+    return ints.astype("<i4").tobytes()
+
+
+def mix_channels(samples: np.ndarray, channels: int) -> np.ndarray:
+    """Down-mix to mono by averaging, or spread mono/down-mixed audio over `channels`."""
+    if samples.shape[1] == channels:
+        return samples
+    mono = samples.mean(axis=1, keepdims=True)
+    return mono if channels == 1 else np.repeat(mono, channels, axis=1)
+
+
+def resample_file(input_file, output_file, target_rate: int = TARGET_RATE, block_frames: int = BLOCK_FRAMES,
+                  sampwidth: int | None = None, channels: int | None = None):
+    """Convert a PCM WAV file block by block; returns (source rate, output frames).
+
+    Besides the sample rate, the sample width and channel count can be
+    changed (defaults: keep the input's).
+    """
+    params, offset, length = read_wav_layout(input_file)
+    if params.audio_format != WAVE_FORMAT_PCM:
+        raise ValueError(f"{input_file}: only integer PCM WAV is supported (format {params.audio_format})")
+    sampwidth = sampwidth or params.sampwidth
+    channels = channels or params.nchannels
+    # Integer samples keep their full-scale level across widths
+    scale = 2.0 ** (8 * (sampwidth - params.sampwidth))
+    frame_bytes = params.nchannels * params.sampwidth
+    resampler = None
+    if params.framerate != target_rate:
+        resampler = PolyphaseResampler(params.framerate, target_rate, channels)
+    written = 0
+    with open(input_file, "rb") as src, open(output_file, "wb") as out:
+        out.write(wav_header(0, target_rate, channels, sampwidth * 8))
+        src.seek(offset)
+        remaining = length
+        while remaining > 0:
+            raw = src.read(min(remaining, block_frames * frame_bytes))
+            if not raw:
+                break
+            remaining -= len(raw)
+            block = mix_channels(pcm_to_float(raw, params.sampwidth, params.nchannels), channels) * scale
+            pcm = float_to_pcm(resampler.process(block) if resampler else block, sampwidth)
+            out.write(pcm)
+            written += len(pcm)
+        if resampler:
+            pcm = float_to_pcm(resampler.flush(), sampwidth)
+            out.write(pcm)
+            written += len(pcm)
+        out.seek(0)
+        out.write(wav_header(written, target_rate, channels, sampwidth * 8))
+    return params.framerate, written // (channels * sampwidth)
+
+
+def resample_in_place(path, target_rate: int = TARGET_RATE, manifest: JobManifest | None = None) -> bool:
+    """Resample `path` to `target_rate` unless it already is; updates its manifest record."""
+    params, _, _ = read_wav_layout(path)
+    if params.framerate == target_rate:
+        return False
+    tmp = f"{path}.resampled.tmp"
+    source_rate, frames = resample_file(path, tmp, target_rate)
+    os.replace(tmp, path)
+    print(f"  ✓ {path}: {source_rate} Hz -> {target_rate} Hz ({frames} frames)")
+    if manifest is not None:
+        for entry in manifest.chunks:
+            for i, record in enumerate(entry["files"]):
+                if os.path.normpath(record["path"]) == os.path.normpath(str(path)):
+                    entry["files"][i] = describe_audio_file(record["path"])
+                    manifest.save()
+    return True
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Resample WAV chunks to a common sample rate")
+    parser.add_argument("files", nargs="*", help="WAV files (default: chunk files of the job)")
+    parser.add_argument("--rate", type=int, default=TARGET_RATE, help=f"target rate in Hz (default {TARGET_RATE})")
+    parser.add_argument("--profile", nargs="?", const="resample.profile", metavar="DIR",
+                        help="write CPU and allocation profiles to DIR (default resample.profile)")
+    args = parser.parse_args(argv)
+    profiler = StageProfiler(args.profile) if args.profile else NullProfiler()
+
+    manifest = JobManifest.load()
+    files = args.files
+    if not files:
+        files = manifest.chunk_files() if manifest else sorted(glob.glob("Podcast_Audio_*.wav"))
+        files = [f for f in files if os.path.basename(f) != "Podcast_Audio_full.wav"]
+
+    changed = 0
+    try:
+        with profiler.stage("resample"):
+            for path in files:
+                try:
+                    changed += resample_in_place(path, args.rate, manifest)
+                except (OSError, ValueError) as e:
+                    print(f"  ✗ {path}: {e}")
+    finally:
+        profiler.close()
+    print("=" * 60)
+    print(f"✓ Resampling complete: {changed} of {len(files)} files resampled to {args.rate} Hz")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,228 @@
+"""
+Structured metrics of a generator run, per chunk and per run.
+
+Per chunk: latency from start to audio (including retries, backoff and
+fallback), time to first audio byte of the request that delivered it,
+requests and failures by model and error class (rate_limited = 429,
+disconnect = RemoteProtocolError, other), characters in, audio seconds
+out and the real-time factor (latency / audio seconds; below 1 is faster
+than real time). Per run: wall time, stage timings (chunking, synthesis,
+finish), segments spliced in from the segment library and the characters
+they kept from the model, and the duration of the finished episode.
+
+At the end of the run the metrics are written as a JSON report and as a
+Prometheus textfile (node_exporter textfile collector format), both
+replaced atomically.
+
+Settings (environment):
+  TTS_METRICS   path stem of the reports, <stem>.json and <stem>.prom
+                (default podcast_metrics, "off" = no reports)
+"""
+import contextlib
+import json
+import os
+import threading
+import time
+
+import numpy as np
+
+from wav_io import get_extension_and_needs_wav, parse_audio_mime_type
+
+DEFAULT_STEM = "podcast_metrics"
+ERROR_CLASSES = ("rate_limited", "disconnect", "empty", "other")
+QUANTILES = (0.5, 0.95)
+
+
+def new_request_stats() -> dict:
+    """Counters one synthesize_chunk() call fills in; see RunMetrics.record_requests()."""
+    return {"seconds": 0.0, "requests": 0, "disconnects": 0, "ttfb": None, "errors": dict.fromkeys(ERROR_CLASSES, 0)}
+
+
+def audio_seconds(parts) -> float:
+    """Duration of raw PCM (data, mime_type) parts; container formats count as 0."""
+    total = 0.0
+    for data, mime_type in parts:
+        _, needs_wav = get_extension_and_needs_wav(mime_type)
+        if needs_wav:
+            fmt = parse_audio_mime_type(mime_type)
+            total += len(data) / (fmt["rate"] * fmt["channels"] * fmt["bits_per_sample"] // 8)
+    return total
+
+
+def _atomic_write(path: str, text: str):
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(tmp, path)
+
+
+def _label(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class RunMetrics:
+    """Collects chunk and stage measurements of one run; thread-safe."""
+
+    def __init__(self, model: str, stem: str | None = DEFAULT_STEM, script: str | None = None):
+        self.model = model
+        self.stem = stem
+        self.script = script
+        self.started = time.time()
+        self._started = time.monotonic()
+        self._lock = threading.Lock()
+        self.stages = {}
+        self.chunks = {}
+        self.episode = {}
+        self.segments = {"count": 0, "chars": 0}
+
+    @classmethod
+    def from_env(cls, model: str, script: str | None = None):
+        stem = os.environ.get("TTS_METRICS", "").strip() or DEFAULT_STEM
+        if stem.lower() in ("off", "none", "false", "no", "0"):
+            stem = None
+        return cls(model, stem, script)
+
+    @contextlib.contextmanager
+    def stage(self, name: str):
+        """Time a pipeline stage; repeated stages add up."""
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            seconds = time.monotonic() - started
+            with self._lock:
+                self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def _chunk(self, idx: int) -> dict:
+        return self.chunks.setdefault(idx, {"idx": idx, "source": None, "chars": 0, "latency": None, "ttfb": None,
+                                            "audio_seconds": 0.0, "rtf": None, "models": {}})
+
+    def record_requests(self, idx: int, model: str, stats: dict, delivered: bool):
+        """Add one synthesize_chunk() call (its new_request_stats() counters) to chunk `idx`."""
+        with self._lock:
+            chunk = self._chunk(idx)
+            entry = chunk["models"].setdefault(model, {"requests": 0, "request_seconds": 0.0,
+                                                       **dict.fromkeys(ERROR_CLASSES, 0)})
+            entry["requests"] += stats["requests"]
+            entry["request_seconds"] += stats["seconds"]
+            for error_class in ERROR_CLASSES:
+                entry[error_class] += stats["errors"][error_class]
+            if delivered:
+                chunk["ttfb"] = stats["ttfb"]
+
+    def record_chunk(self, idx: int, chars: int, parts, latency: float, source: str):
+        """Chunk `idx` was delivered by `source` (a model, "local" or "cache") after `latency` seconds."""
+        seconds = audio_seconds(parts)
+        with self._lock:
+            chunk = self._chunk(idx)
+            chunk.update(source=source, chars=chars, latency=latency, audio_seconds=seconds,
+                         rtf=latency / seconds if seconds else None)
+
+    def record_segments(self, count: int, chars: int):
+        """`count` library segments replace `chars` characters of the script."""
+        with self._lock:
+            self.segments = {"count": count, "chars": chars}
+
+    def record_episode(self, audio_bytes: int, params, chunks: int):
+        """The finished episode: `audio_bytes` of PCM in `params` (a WavParams)."""
+        bytes_per_second = params.framerate * params.nchannels * params.sampwidth
+        self.episode = {"chunks": chunks, "audio_bytes": audio_bytes,
+                        "audio_seconds": audio_bytes / bytes_per_second if bytes_per_second else 0.0}
+
+    def report(self) -> dict:
+        """The JSON run report."""
+        with self._lock:
+            chunks = [dict(self.chunks[idx]) for idx in sorted(self.chunks)]
+            stages = dict(self.stages)
+        wall = time.monotonic() - self._started
+        models = {}
+        for chunk in chunks:
+            for model, entry in chunk["models"].items():
+                total = models.setdefault(model, dict.fromkeys(entry, 0))
+                for key, value in entry.items():
+                    total[key] += value
+        delivered = [c for c in chunks if c["source"] is not None]
+        latencies = [c["latency"] for c in delivered if c["source"] != "cache"]
+        ttfbs = [c["ttfb"] for c in delivered if c["ttfb"] is not None]
+        chunk_audio = sum(c["audio_seconds"] for c in delivered)
+        return {
+            "model": self.model,
+            "script": self.script,
+            "started": time.strftime("%Y-%m-%dT%H:%M:%S%z", time.localtime(self.started)),
+            "completed": bool(self.episode),
+            "wall_seconds": wall,
+            "stages": stages,
+            "chunks_total": len(chunks),
+            "chunks_delivered": len(delivered),
+            "chunks_by_source": {s: sum(c["source"] == s for c in delivered) for s in {c["source"] for c in delivered}},
+            "chars_in": sum(c["chars"] for c in delivered),
+            "segments": dict(self.segments),
+            "chunk_audio_seconds": chunk_audio,
+            "episode": self.episode,
+            "realtime_factor": stages.get("synthesis", wall) / chunk_audio if chunk_audio else None,
+            "latency": {f"p{q * 100:g}": float(np.quantile(latencies, q)) for q in QUANTILES} if latencies else {},
+            "ttfb": {f"p{q * 100:g}": float(np.quantile(ttfbs, q)) for q in QUANTILES} if ttfbs else {},
+            "models": models,
+            "chunks": chunks,
+        }
+
+    def prometheus(self, report: dict) -> str:
+        """The run report in Prometheus text exposition format."""
+        lines = []
+
+        def metric(name, kind, help_text, samples):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in samples:
+                labels = {"model": self.model, **labels}
+                rendered = ",".join(f'{k}="{_label(v)}"' for k, v in labels.items())
+                lines.append(f"{name}{{{rendered}}} {float(value)!r}")
+
+        metric("tts_run_timestamp_seconds", "gauge", "Start of the run (Unix time).", [({}, self.started)])
+        metric("tts_run_wall_seconds", "gauge", "Wall time of the run.", [({}, report["wall_seconds"])])
+        metric("tts_stage_seconds", "gauge", "Time spent per pipeline stage.",
+               [({"stage": stage}, seconds) for stage, seconds in report["stages"].items()])
+        metric("tts_chunks", "gauge", "Chunks delivered, by source (model, local or cache).",
+               [({"source": source}, n) for source, n in report["chunks_by_source"].items()])
+        metric("tts_chars_in", "gauge", "Characters of delivered chunks.", [({}, report["chars_in"])])
+        metric("tts_segments", "gauge", "Segments spliced in from the segment library.",
+               [({}, report["segments"]["count"])])
+        metric("tts_segment_chars", "gauge", "Script characters served from the segment library instead of the model.",
+               [({}, report["segments"]["chars"])])
+        metric("tts_requests", "gauge", "Requests sent, by backend model.",
+               [({"backend": model}, entry["requests"]) for model, entry in report["models"].items()])
+        metric("tts_request_seconds", "gauge", "Time spent in requests, by backend model.",
+               [({"backend": model}, entry["request_seconds"]) for model, entry in report["models"].items()])
+        metric("tts_request_errors", "gauge", "Failed requests, by backend model and error class.",
+               [({"backend": model, "class": error_class}, entry[error_class])
+                for model, entry in report["models"].items() for error_class in ERROR_CLASSES])
+        metric("tts_chunk_audio_seconds", "gauge", "Audio returned for the chunks.", [({}, report["chunk_audio_seconds"])])
+        metric("tts_episode_audio_seconds", "gauge", "Duration of the finished episode.",
+               [({}, report["episode"].get("audio_seconds", 0.0))])
+        if report["realtime_factor"] is not None:
+            metric("tts_realtime_factor", "gauge", "Synthesis time per second of chunk audio.",
+                   [({}, report["realtime_factor"])])
+        for name, key, help_text in (("tts_chunk_latency_seconds", "latency", "Chunk latency including retries."),
+                                     ("tts_chunk_ttfb_seconds", "ttfb", "Time to the first audio byte of a chunk.")):
+            if report[key]:
+                metric(name, "gauge", f"{help_text} Quantiles over the run.",
+                       [({"quantile": f"{q:g}"}, report[key][f"p{q * 100:g}"]) for q in QUANTILES])
+        return "\n".join(lines) + "\n"
+
+    def write(self) -> list[str]:
+        """Write <stem>.json and <stem>.prom; returns the paths written."""
+        if self.stem is None:
+            return []
+        report = self.report()
+        paths = [f"{self.stem}.json", f"{self.stem}.prom"]
+        _atomic_write(paths[0], json.dumps(report, indent=1))
+        _atomic_write(paths[1], self.prometheus(report))
+        return paths
+
+    def summary(self) -> str:
+        report = self.report()
+        latency = report["latency"]
+        return (f"{report['chunks_delivered']}/{report['chunks_total']} chunks, {report['chars_in']} chars, "
+                f"{report['chunk_audio_seconds']:.0f}s audio"
+                + (f", latency p50 {latency['p50']:.1f}s / p95 {latency['p95']:.1f}s" if latency else "")
+                + (f", RTF {report['realtime_factor']:.2f}" if report["realtime_factor"] is not None else ""))
@@ -0,0 +1,138 @@
+"""
+Speaker-turn-aware chunking of podcast scripts.
+
+A script is a preamble (Style:/Speakers:/Tonality: or Stil:/Sprecher:/
+Tonalität: lines) followed by dialogue turns ("Speaker 1: ...",
+"Speaker 2: ..."). chunk_script() packs whole turns into chunks up to a
+character budget and never cuts a turn in two unless the turn alone is over
+budget; then it splits at sentence boundaries and repeats the speaker label
+on every piece, so the multi-speaker model always knows who is talking.
+The preamble opens the first chunk (optionally every chunk) and counts
+against its budget.
+"""
+import re
+from collections import namedtuple
+
+Turn = namedtuple("Turn", "speaker text")
+
+TURN_RE = re.compile(r"^\s*(Speaker\s*\d+)\s*:\s*(.*)$", re.IGNORECASE)
+SENTENCE_RE = re.compile(r"(?<=[.!?…])\s+")
+
+
+def parse_script(text: str) -> tuple[str, list[Turn]]:
+    """Split a script into (preamble, turns).
+
+    Everything before the first speaker line is preamble. Lines that do not
+    start a new turn (wrapped text, section markers) belong to the current
+    turn. A script without any speaker labels yields one label-less turn per
+    paragraph.
+    """
+    preamble_lines = []
+    turns = []
+    speaker, lines = None, []
+
+    def close_turn():
+        body = "\n".join(lines).strip()
+        if body:
+            turns.append(Turn(speaker, body))
+
+    for line in text.splitlines():
+        m = TURN_RE.match(line)
+        if m:
+            if speaker is not None:
+                close_turn()
+            speaker, lines = m.group(1), [m.group(2)]
+        elif speaker is None:
+            preamble_lines.append(line)
+        else:
+            lines.append(line)
+    if speaker is not None:
+        close_turn()
+
+    preamble = "\n".join(preamble_lines).strip()
+    if not turns:
+        # Plain prose: paragraphs play the role of turns
+        turns = [Turn(None, p.strip()) for p in preamble.split("\n\n") if p.strip()]
+        preamble = ""
+    return preamble, turns
+
+
+def format_turn(turn: Turn) -> str:
+    return f"{turn.speaker}: {turn.text}" if turn.speaker else turn.text
+
+
+def split_turn(turn: Turn, max_chars: int) -> list[Turn]:
+    """Split an oversized turn at sentence boundaries, keeping its speaker."""
+    label = len(turn.speaker) + 2 if turn.speaker else 0
+    budget = max(1, max_chars - label)
+    pieces, current = [], ""
+    for sentence in SENTENCE_RE.split(turn.text):
+        # A single sentence longer than the budget is cut at word boundaries
+        while len(sentence) > budget:
+            cut = sentence.rfind(" ", 0, budget)
+            cut = cut if cut > 0 else budget
+            if current:
+                pieces.append(current)
+                current = ""
+            pieces.append(sentence[:cut].strip())
+            sentence = sentence[cut:].strip()
+        if current and len(current) + 1 + len(sentence) > budget:
+            pieces.append(current)
+            current = sentence
+        else:
+            current = f"{current} {sentence}".strip()
+    if current:
+        pieces.append(current)
+    return [Turn(turn.speaker, p) for p in pieces if p]
+
+
+def chunk_script(text: str, max_chars: int = 1500, repeat_preamble: bool = False) -> list[str]:
+    """Pack whole speaker turns into chunks of at most `max_chars` characters.
+
+    The preamble is sent with the first chunk only, or with every chunk if
+    `repeat_preamble` is set (unless it would eat more than half of the
+    budget). Chunks carrying the preamble keep at least half the budget for
+    dialogue, so a very long preamble may push them over `max_chars`.
+    """
+    preamble, turns = parse_script(text)
+    return chunk_turns(preamble, turns, max_chars, repeat_preamble)
+
+
+def chunk_turns(preamble: str, turns: list[Turn], max_chars: int = 1500, repeat_preamble: bool = False) -> list[str]:
+    """chunk_script() for an already parsed script (or a run of its turns)."""
+    repeat = repeat_preamble and preamble and len(preamble) + 2 <= max_chars // 2
+    chunks = []
+    body, body_len = [], 0
+
+    def budget() -> int:
+        if preamble and (repeat or not chunks):
+            return max(max_chars - len(preamble) - 2, max_chars // 2)
+        return max_chars
+
+    def flush():
+        nonlocal body, body_len
+        if not body:
+            return
+        head = [preamble] if preamble and (repeat or not chunks) else []
+        chunks.append("\n\n".join(head + body))
+        body, body_len = [], 0
+
+    for turn in turns:
+        formatted = format_turn(turn)
+        if len(formatted) > budget():
+            flush()
+            pieces = split_turn(turn, budget())
+        else:
+            pieces = [turn]
+        for piece in pieces:
+            formatted = format_turn(piece)
+            extra = len(formatted) + (2 if body else 0)
+            if body and body_len + extra > budget():
+                flush()
+                extra = len(formatted)
+            body.append(formatted)
+            body_len += extra
+    flush()
+    if not chunks and preamble:
+        chunks.append(preamble)
+    return chunks
@@ -0,0 +1,246 @@
+"""
+Seam processing between concatenated chunks.
+
+Every chunk boundary gets the same treatment: the trailing silence of one
+chunk and the leading silence of the next are trimmed so the pause between
+the last and the first spoken sample is `pause` seconds, the cut points are
+moved to the nearest zero crossing, and the two edges are joined with a
+short equal-power crossfade (cos/sin). If both chunks together have less
+silence than the pause, the rest is digital silence that the edges fade
+into and out of.
+
+Only the boundary regions are ever read into NumPy arrays — a few seconds
+of silence scan plus `fade` at each end of a chunk — so the cost grows with
+the number of chunks, not with the audio length. The chunk bodies between
+the seams are still copied byte for byte (zero-copy where possible).
+
+Settings (environment):
+  TTS_SEAM_PAUSE     pause between chunks in seconds, "on" for 0.35 (default off)
+  TTS_SEAM_FADE_MS   crossfade length in milliseconds (default 10)
+  TTS_SILENCE_DB     level below which audio counts as silence, dBFS (default -45)
+"""
+import os
+
+import numpy as np
+
+from resample_chunks import float_to_pcm, pcm_to_float
+from wav_io import Piece, copy_byte_range
+
+DEFAULT_PAUSE = 0.35
+DEFAULT_FADE_MS = 10.0
+DEFAULT_SILENCE_DB = -45.0
+# Analysis frame of the silence detector
+FRAME_SECONDS = 0.01
+# Silence scanned from each chunk end, read SCAN_SECONDS at a time
+SCAN_SECONDS = 2.0
+MAX_SCAN_SECONDS = 10.0
+# Cut points move at most this far to reach a zero crossing
+ZERO_CROSSING_SECONDS = 0.002
+
+
+def seam_settings_from_env() -> dict | None:
+    """Seam settings from the environment; None (chunks joined as they are) unless TTS_SEAM_PAUSE is set."""
+    settings = {}
+    for key, name, default in (("pause", "TTS_SEAM_PAUSE", DEFAULT_PAUSE),
+                               ("fade_ms", "TTS_SEAM_FADE_MS", DEFAULT_FADE_MS),
+                               ("silence_db", "TTS_SILENCE_DB", DEFAULT_SILENCE_DB)):
+        raw = os.environ.get(name, "").strip()
+        if key == "pause":
+            if raw.lower() in ("", "off", "none", "false", "no"):
+                return None
+            if raw.lower() in ("on", "yes", "true"):
+                raw = ""
+        try:
+            settings[key] = float(raw) if raw else default
+        except ValueError:
+            print(f"⚠ Ignoring invalid {name}={raw!r}, using {default}")
+            settings[key] = default
+    return settings
+
+
+def read_frames(path, offset: int, params, start: int, count: int) -> np.ndarray:
+    """Normalized float frames [start, start+count) of the PCM data at `offset`."""
+    frame_bytes = params.nchannels * params.sampwidth
+    with open(path, "rb") as f:
+        f.seek(offset + start * frame_bytes)
+        raw = f.read(max(0, count) * frame_bytes)
+    raw = raw[:len(raw) - len(raw) % frame_bytes]
+    return pcm_to_float(raw, params.sampwidth, params.nchannels) / float(1 << (params.sampwidth * 8 - 1))
+
+
+def _loud_frames(x: np.ndarray, frame: int, threshold: float) -> np.ndarray:
+    """Boolean per analysis frame: RMS of the loudest channel above `threshold`."""
+    n = len(x) // frame
+    if n == 0:
+        return np.zeros(0, dtype=bool)
+    rms = np.sqrt((x[:n * frame].reshape(n, frame, -1) ** 2).mean(axis=1)).max(axis=1)
+    return rms > threshold
+
+
+def speech_bounds(path, offset: int, length: int, params, threshold: float) -> tuple[int, int]:
+    """(first, end) frame index of the audible part, scanning only near the chunk ends.
+
+    Silence longer than MAX_SCAN_SECONDS is only trimmed up to that limit.
+    """
+    frames = length // (params.nchannels * params.sampwidth)
+    frame = max(1, int(params.framerate * FRAME_SECONDS))
+    step = int(params.framerate * SCAN_SECONDS) // frame * frame
+    limit = min(frames, int(params.framerate * MAX_SCAN_SECONDS))
+
+    first = limit
+    for start in range(0, limit, step):
+        loud = np.flatnonzero(_loud_frames(read_frames(path, offset, params, start, min(step, limit - start)), frame, threshold))
+        if len(loud):
+            first = start + loud[0] * frame
+            break
+
+    end = frames - limit
+    for stop in range(frames, frames - limit, -step):
+        start = max(frames - limit, stop - step)
+        # Align analysis frames to the chunk end
+        start = stop - (stop - start) // frame * frame
+        loud = np.flatnonzero(_loud_frames(read_frames(path, offset, params, start, stop - start), frame, threshold))
+        if len(loud):
+            end = start + (loud[-1] + 1) * frame
+            break
+    if first >= end:
+        # Silent (or nearly silent) chunk: leave it untouched
+        return 0, frames
+    return first, end
+
+
+def snap_to_zero_crossing(path, offset: int, params, position: int, frames: int) -> int:
+    """Nearest frame index to `position` where the (channel-summed) signal crosses zero."""
+    radius = max(1, int(params.framerate * ZERO_CROSSING_SECONDS))
+    start = max(0, position - radius)
+    x = read_frames(path, offset, params, start, min(frames, position + radius + 1) - start).sum(axis=1)
+    if len(x) < 2:
+        return position
+    crossings = np.flatnonzero(np.signbit(x[:-1]) != np.signbit(x[1:])) + 1
+    if len(crossings):
+        candidates = crossings
+    else:
+        candidates = np.flatnonzero(np.abs(x) == np.abs(x).min())
+    return int(start + candidates[np.argmin(np.abs(start + candidates - position))])
+
+
+class SeamPlanner:
+    """Plan seams chunk by chunk: add() returns the previous chunk's Piece once it is final.
+
+    A chunk's trailing edge depends on how much silence the next chunk
+    leads with, so each Piece is returned one add() later; finish() returns
+    the last one. Only the edge regions of each chunk are read.
+    """
+
+    def __init__(self, params, pause: float = DEFAULT_PAUSE, fade_ms: float = DEFAULT_FADE_MS,
+                 silence_db: float = DEFAULT_SILENCE_DB):
+        self.params = params
+        self.frame_bytes = params.nchannels * params.sampwidth
+        self.threshold = 10 ** (silence_db / 20)
+        self.want = int(params.framerate * pause)
+        self.fade = max(1, int(params.framerate * fade_ms / 1000))
+        # Chunk waiting for its successor: [source, frames, bounds, start]
+        self._pending = None
+        # (end, speech end, tail frames) of the last finished Piece
+        self._previous = None
+
+    def add(self, path, offset: int, length: int) -> Piece | None:
+        """Add the next chunk's data range; returns the Piece of the chunk before it, if any."""
+        frames = length // self.frame_bytes
+        bounds = speech_bounds(path, offset, length, self.params, self.threshold)
+        finished = None
+        if self._pending is None:
+            keep_head = min(bounds[0], self.want // 2)
+        else:
+            tail = self._pending[1] - self._pending[2][1]
+            # One fade length more than the pause: the edges overlap in the crossfade
+            budget = self.want + self.fade
+            keep_tail = min(tail, max(budget // 2, budget - bounds[0]))
+            keep_head = min(bounds[0], budget - keep_tail)
+            finished = self._finish_pending(keep_tail)
+        start = snap_to_zero_crossing(path, offset, self.params, bounds[0] - keep_head, frames)
+        self._pending = [(path, offset, length), frames, bounds, start]
+        return finished
+
+    def finish(self) -> Piece | None:
+        """Piece of the last chunk added (None if there is none)."""
+        if self._pending is None:
+            return None
+        frames, bounds = self._pending[1], self._pending[2]
+        piece = self._finish_pending(min(frames - bounds[1], self.want // 2))
+        self._pending = None
+        return piece
+
+    def _finish_pending(self, keep_tail: int) -> Piece:
+        (path, offset, length), frames, bounds, start = self._pending
+        end = max(start, snap_to_zero_crossing(path, offset, self.params, bounds[1] + keep_tail, frames))
+        edge = min(self.fade, (end - start) // 2)
+        # Equal-power curves: sin^2 + cos^2 = 1 across the overlap
+        ramp = ((np.arange(edge) + 0.5) / max(1, edge) * (np.pi / 2))[:, None]
+        head = read_frames(path, offset, self.params, start, edge) * np.sin(ramp)
+        tail = read_frames(path, offset, self.params, end - edge, edge) * np.cos(ramp)
+        gap = 0
+        if self._previous is not None:
+            # Pause actually left between the speech of both chunks after snapping
+            previous_end, previous_speech_end, previous_tail = self._previous
+            kept = (previous_end - previous_speech_end) + (bounds[0] - start)
+            gap = max(self.want - kept, -min(previous_tail, len(head)))
+        self._previous = (end, bounds[1], len(tail))
+        return Piece(path, offset, length, offset + (start + edge) * self.frame_bytes,
+                     (end - start - 2 * edge) * self.frame_bytes, head, tail, gap)
+
+
+def plan_seams(sources, params, pause: float = DEFAULT_PAUSE, fade_ms: float = DEFAULT_FADE_MS,
+               silence_db: float = DEFAULT_SILENCE_DB) -> list[Piece]:
+    """Turn (path, offset, length) data ranges into Pieces with trimmed, faded edges."""
+    planner = SeamPlanner(params, pause, fade_ms, silence_db)
+    pieces = [planner.add(*source) for source in sources]
+    pieces.append(planner.finish())
+    return [piece for piece in pieces if piece is not None]
+
+
+def join(tail, gap: int, head) -> np.ndarray:
+    """Fade-out `tail`, then `gap` frames of silence (or -gap frames of overlap), then fade-in `head`."""
+    if gap >= 0:
+        return np.concatenate([tail, np.zeros((gap, tail.shape[1])), head])
+    overlap = -gap
+    mixed = tail[len(tail) - overlap:] + head[:overlap]
+    return np.concatenate([tail[:len(tail) - overlap], mixed, head[overlap:]])
+
+
+def iter_seamed(pieces):
+    """Yield the output in order: float arrays for seams, (path, offset, length, gain) for bodies.
+
+    `pieces` may be any iterable (e.g. a generator fed while chunks arrive).
+    """
+    tail = None
+    for piece in pieces:
+        gain = piece.gain
+        if piece.head is not None:
+            head = piece.head * gain
+            yield head if tail is None else join(tail, piece.gap, head)
+            tail = None
+        elif tail is not None:
+            yield tail
+            tail = None
+        yield piece.path, piece.body_offset, piece.body_length, gain
+        if piece.tail is not None:
+            tail = piece.tail * gain
+    if tail is not None:
+        yield tail
+
+
+def write_pieces(pieces, out, params) -> int:
+    """Write seamed pieces to `out`: bodies by byte-range copy, seams from NumPy."""
+    full_scale = float(1 << (params.sampwidth * 8 - 1))
+    written = 0
+    for item in iter_seamed(pieces):
+        if isinstance(item, np.ndarray):
+            pcm = float_to_pcm(item * full_scale, params.sampwidth)
+            out.write(pcm)
+            written += len(pcm)
+        else:
+            path, offset, length, _ = item
+            with open(path, "rb", buffering=0) as src:
+                written += copy_byte_range(src, out, offset, length)
+    return written
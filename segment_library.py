@@ -0,0 +1,362 @@
+#!/usr/bin/env python3
+"""
+Pre-rendered audio for text that recurs in every episode.
+
+The library is a directory (TTS_SEGMENTS, default segments/) of named
+segments. A segment is either
+  <name>.txt + <name>.wav   turns in script format ("Speaker 1: Vielen Dank
+                            fürs Zuhören."), rendered once by `build`
+  <name>.wav                recorded audio (jingle, studio intro); `build`
+                            converts it to the models' format (16-bit mono
+                            at resample_chunks.TARGET_RATE) and keeps the
+                            original in originals/
+
+A script uses the library in two ways:
+  exact match    turns whose speaker and text (ignoring whitespace) equal
+                 a rendered segment's turns are replaced by its audio
+  marker         a line "[segment: <name>]" on its own inserts that segment
+
+plan_script() turns a script into items in script order: text chunks for
+the model (chunk_turns(), the preamble opens the first one) and segments.
+The job manifest lists both; segments are recorded as done with their
+library file, so resume and concat keep them in place, and the episode
+writer splices them in between the chunks (SegmentSplicer). A segment
+whose text changed since it was rendered, or recorded audio in another
+format, is ignored until the next build; marked text segments are then
+synthesized from their text.
+
+Usage:
+  python segment_library.py list
+  python segment_library.py build [--pro] [--force]
+"""
+import argparse
+import hashlib
+import json
+import os
+import re
+import sys
+import time
+from collections import namedtuple
+from pathlib import Path
+
+from job_manifest import STATUS_DONE, describe_audio_file
+from script_chunker import Turn, chunk_turns, format_turn, parse_script
+from wav_io import parse_wav_header
+
+DEFAULT_DIRECTORY = "segments"
+INDEX_NAME = "index.json"
+ORIGINALS = "originals"
+MARKER_RE = re.compile(r"^\s*\[segment:\s*([\w.-]+)\s*\]\s*$", re.IGNORECASE)
+
+# text: the segment's turns in script format, or its marker for recorded audio
+Segment = namedtuple("Segment", "name path text")
+
+
+def _turn_key(turn: Turn) -> tuple:
+    speaker = " ".join(turn.speaker.split()).lower() if turn.speaker else None
+    return speaker, " ".join(turn.text.split())
+
+
+def _text_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def _model_format(path) -> bool:
+    """True if the WAV at `path` has the format the TTS models deliver."""
+    from resample_chunks import TARGET_RATE
+
+    try:
+        params = parse_wav_header(path).params
+    except (OSError, ValueError):
+        return False
+    return (params.nchannels, params.sampwidth, params.framerate) == (1, 2, TARGET_RATE)
+
+
+class SegmentLibrary:
+    """Segments of one library directory; only rendered, up-to-date ones are served."""
+
+    def __init__(self, directory=DEFAULT_DIRECTORY):
+        self.directory = Path(directory).resolve()
+        self.index_path = self.directory / INDEX_NAME
+        try:
+            self.index = json.loads(self.index_path.read_text(encoding="utf-8"))
+        except FileNotFoundError:
+            self.index = {}
+        self.texts = {p.stem: p.read_text(encoding="utf-8") for p in sorted(self.directory.glob("*.txt"))}
+        recorded = {p.stem for p in self.directory.glob("*.wav")}
+        self.segments = {}
+        self.stale = []
+        for name in sorted(set(self.texts) | recorded):
+            if name not in recorded:
+                continue
+            text = self.texts.get(name)
+            # A recorded file in another format would set the episode's format
+            if (text is not None and self.index.get(name, {}).get("text_sha256") != _text_hash(text)) \
+                    or not _model_format(self.directory / f"{name}.wav"):
+                self.stale.append(name)
+                continue
+            turns = parse_script(text)[1] if text is not None else []
+            label = "\n\n".join(format_turn(t) for t in turns) or f"[segment: {name}]"
+            self.segments[name] = (Segment(name, str(self.directory / f"{name}.wav"), label),
+                                   [_turn_key(t) for t in turns])
+        # Longest first, so a two-turn sign-off wins over its first turn alone
+        self._matchable = sorted(((keys, segment) for segment, keys in self.segments.values() if keys),
+                                 key=lambda entry: -len(entry[0]))
+
+    @classmethod
+    def from_env(cls):
+        """Library from TTS_SEGMENTS; None when it is off or the directory does not exist."""
+        directory = os.environ.get("TTS_SEGMENTS", "").strip() or DEFAULT_DIRECTORY
+        if directory.lower() in ("off", "none", "false", "no", "0") or not os.path.isdir(directory):
+            return None
+        return cls(directory)
+
+    def __len__(self) -> int:
+        return len(self.segments)
+
+    def get(self, name: str) -> Segment | None:
+        entry = self.segments.get(name)
+        return entry[0] if entry else None
+
+    def turns(self, name: str) -> list[Turn]:
+        """The text turns of a segment (for a marker whose audio is missing or stale)."""
+        text = self.texts.get(name)
+        return parse_script(text)[1] if text is not None else []
+
+    def match(self, turns: list, start: int) -> tuple[Segment | None, int]:
+        """The segment whose turns equal turns[start:...], and how many turns it covers."""
+        for keys, segment in self._matchable:
+            window = turns[start:start + len(keys)]
+            if len(window) == len(keys) and all(isinstance(t, Turn) for t in window) \
+                    and [_turn_key(t) for t in window] == keys:
+                return segment, len(keys)
+        return None, 0
+
+    def describe(self) -> str:
+        return f"{self.directory} ({len(self)} segments" + (
+            f", {len(self.stale)} stale: {', '.join(self.stale)}" if self.stale else "") + ")"
+
+
+class SegmentPlan:
+    """A script as items in script order: chunk texts (str) for the model and library Segments."""
+
+    def __init__(self, items: list):
+        self.items = items
+        self.positions = [i for i, item in enumerate(items) if isinstance(item, str)]
+        self.chunks = [items[i] for i in self.positions]
+        self.segments = [(i, item) for i, item in enumerate(items) if isinstance(item, Segment)]
+
+    @property
+    def texts(self) -> list[str]:
+        """One text per item, for the job manifest."""
+        return [item if isinstance(item, str) else item.text for item in self.items]
+
+    @property
+    def segment_chars(self) -> int:
+        """Characters the segments take off the model's share of the script."""
+        return sum(len(segment.text) for _, segment in self.segments if not segment.text.startswith("[segment:"))
+
+
+def _blocks(text: str):
+    """(text before a marker, marker name) pairs; the last one's name is None."""
+    lines = []
+    for line in text.splitlines():
+        m = MARKER_RE.match(line)
+        if m:
+            yield "\n".join(lines), m.group(1)
+            lines = []
+        else:
+            lines.append(line)
+    yield "\n".join(lines), None
+
+
+def plan_script(text: str, max_chars: int = 1500, library: SegmentLibrary | None = None,
+                repeat_preamble: bool = False) -> SegmentPlan:
+    """Split a script into model chunks and library segments, see the module docstring.
+
+    Without a library (or without matches and markers) the chunks are
+    exactly those of chunk_script().
+    """
+    blocks = list(_blocks(text))
+    preamble, turns = parse_script("\n".join(block for block, _ in blocks))
+    labelled = any(turn.speaker for turn in turns)
+    seen_speaker = False
+    units = []  # Turn or Segment, in script order
+    for block, marker in blocks:
+        block_preamble, turns = parse_script(block)
+        if labelled:
+            if not any(turn.speaker for turn in turns):
+                block_preamble, turns = "\n".join(t.text for t in turns), []
+            # Lines before the first speaker line are the preamble; after it,
+            # text between a marker and the next speaker line is a turn of its own
+            if seen_speaker and block_preamble:
+                turns.insert(0, Turn(None, block_preamble))
+            seen_speaker |= bool(turns)
+        units.extend(turns)
+        if marker is None:
+            continue
+        segment = library.get(marker) if library is not None else None
+        if segment is not None:
+            units.append(segment)
+        elif library is not None and library.turns(marker):
+            print(f"⚠ Segment {marker!r} is not rendered or stale, synthesizing its text")
+            units.extend(library.turns(marker))
+        elif library is not None and marker in library.stale:
+            print(f"⚠ Segment {marker!r} is not in the models' audio format (run segment_library.py build), "
+                  "marker skipped")
+        else:
+            print(f"⚠ Segment {marker!r} not in the segment library, marker skipped")
+
+    items = []
+    run = []  # consecutive turns, chunked together
+
+    def flush():
+        first = not any(isinstance(item, str) for item in items)
+        head = preamble if preamble and (first or repeat_preamble) else ""
+        if run or (first and head and not units):
+            items.extend(chunk_turns(head, run, max_chars, repeat_preamble))
+        run.clear()
+
+    i = 0
+    while i < len(units):
+        segment, covered = (library.match(units, i) if library is not None and isinstance(units[i], Turn)
+                            else (None, 0))
+        if segment is None and isinstance(units[i], Segment):
+            segment, covered = units[i], 1
+        if segment is None:
+            run.append(units[i])
+            i += 1
+            continue
+        flush()
+        items.append(segment)
+        i += covered
+    flush()
+    return SegmentPlan(items)
+
+
+def record_segments(manifest, plan: SegmentPlan):
+    """Mark the plan's segments done in the job manifest, with their library files."""
+    for idx, segment in plan.segments:
+        manifest.chunks[idx].update(status=STATUS_DONE, files=[describe_audio_file(segment.path)], segment=segment.name)
+    if plan.segments:
+        manifest.save()
+
+
+class SegmentSplicer:
+    """on_chunk_ready for plan.chunks that hands segments to the episode at their position.
+
+    `write_chunk(idx, parts, attempts)` gets the item index of the chunk
+    (its manifest index), `add_segment(path)` each segment's file in order;
+    finish() adds the segments after the last chunk.
+    """
+
+    def __init__(self, plan: SegmentPlan, write_chunk, add_segment):
+        self.plan = plan
+        self.write_chunk = write_chunk
+        self.add_segment = add_segment
+        self._next = 0
+
+    def _segments_until(self, position: int):
+        for idx in range(self._next, position):
+            self.add_segment(self.plan.items[idx].path)
+        self._next = max(self._next, position)
+
+    def chunk_ready(self, i, parts, attempts):
+        position = self.plan.positions[i]
+        self._segments_until(position)
+        self.write_chunk(position, parts, attempts)
+        self._next = position + 1
+
+    def finish(self):
+        self._segments_until(len(self.plan.items))
+
+
+def convert_recorded(library: SegmentLibrary) -> list[str]:
+    """Bring recorded segments into the models' format; the originals move to originals/."""
+    from resample_chunks import TARGET_RATE, resample_file
+
+    converted = []
+    for name in library.stale:
+        path = library.directory / f"{name}.wav"
+        if name in library.texts or _model_format(path):
+            continue
+        original = library.directory / ORIGINALS / f"{name}.wav"
+        original.parent.mkdir(exist_ok=True)
+        os.replace(path, original)
+        resample_file(original, path, TARGET_RATE, sampwidth=2, channels=1)
+        print(f"✓ {name}: converted to {TARGET_RATE} Hz 16-bit mono (original in {original})")
+        converted.append(name)
+    return converted
+
+
+def build(directory, model: str, force: bool = False) -> int:
+    """Convert recorded segments and render every .txt segment whose audio is missing or stale."""
+    from dotenv import load_dotenv
+    from google import genai
+
+    from tts_synthesis import concurrency_from_env, http_options_from_env, speech_config, synthesize_all
+    from wav_io import write_audio_segment
+
+    library = SegmentLibrary(directory)
+    if convert_recorded(library):
+        library = SegmentLibrary(directory)
+    names = [name for name in library.texts if force or library.get(name) is None]
+    if not names:
+        print(f"✓ Segment library up to date: {library.describe()}")
+        return 0
+    load_dotenv()
+    if not os.environ.get("GEMINI_API_KEY"):
+        print("✗ GEMINI_API_KEY not found in environment. Please add it to a .env file or export it as an environment variable.")
+        return 1
+    client = genai.Client(api_key=os.environ.get("GEMINI_API_KEY"), http_options=http_options_from_env())
+    print(f"Rendering {len(names)} segments with {model}: {', '.join(names)}")
+
+    def write_segment(idx, parts, attempts):
+        name = names[idx]
+        if not parts or len({mime_type for _, mime_type in parts}) != 1:
+            print(f"✗ {name}: no usable audio in the response")
+            return
+        path = write_audio_segment(str(library.directory / name), b"".join(d for d, _ in parts), parts[0][1])
+        if not path.endswith(".wav"):
+            os.remove(path)
+            print(f"✗ {name}: {parts[0][1]} is not PCM, the library needs WAV")
+            return
+        library.index[name] = {"text_sha256": _text_hash(library.texts[name]), "model": model,
+                               "rendered": time.strftime("%Y-%m-%dT%H:%M:%S")}
+        library.index_path.write_text(json.dumps(library.index, indent=1, ensure_ascii=False), encoding="utf-8")
+        print(f"✓ {name}: {path}")
+
+    # Each segment is one request: the text is sent as written, preamble included
+    synthesize_all(client, model, [library.texts[name].strip() for name in names], speech_config(), write_segment,
+                   concurrency=concurrency_from_env())
+    library = SegmentLibrary(directory)
+    print(f"✓ Segment library: {library.describe()}")
+    return 1 if library.stale or any(library.get(name) is None for name in names) else 0
+
+
+def main(argv=None) -> int:
+    from backends import FLASH_MODEL, PRO_MODEL
+
+    parser = argparse.ArgumentParser(description="Pre-rendered segments for recurring script text")
+    parser.add_argument("command", choices=["list", "build"])
+    parser.add_argument("--dir", default=os.environ.get("TTS_SEGMENTS", "").strip() or DEFAULT_DIRECTORY)
+    parser.add_argument("--pro", action="store_true", help=f"render with {PRO_MODEL} instead of {FLASH_MODEL}")
+    parser.add_argument("--force", action="store_true", help="re-render segments that are up to date")
+    args = parser.parse_args(argv)
+    if not os.path.isdir(args.dir):
+        print(f"✗ No segment library at {args.dir}/ — create it with one <name>.txt per segment")
+        return 1
+    if args.command == "build":
+        return build(args.dir, PRO_MODEL if args.pro else FLASH_MODEL, args.force)
+    library = SegmentLibrary(args.dir)
+    print(f"Segment library {library.describe()}")
+    for name in sorted(set(library.texts) | set(library.segments) | set(library.stale)):
+        segment = library.get(name)
+        state = "stale" if name in library.stale else "ok" if segment else "not rendered"
+        kind = "recorded" if name not in library.texts else f"{len(library.turns(name))} turns"
+        print(f"  {name:<20} {kind:<10} {state}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,460 @@
+"""
+Concurrent chunk synthesis on top of the async genai client (client.aio).
+
+Up to `concurrency` chunk requests are in flight at once. Finished chunks are
+handed to a callback strictly in chunk order, no matter which request
+completes first, so the output files keep the order of the script.
+"""
+import asyncio
+import os
+import random
+import time
+
+import httpx
+import httpcore
+from google.genai import types
+from google.genai.errors import ClientError
+
+from backends import LOCAL, BackendUnavailable
+from chunk_cache import cache_key
+from rate_limiter import error_status, get_rate_limiter, retry_after_from_error
+from run_metrics import new_request_stats
+from wav_io import PCM_BYTES_PER_CHAR_ESTIMATE, PcmStreamAssembler
+
+DEFAULT_CONCURRENCY = 3
+# Chunks that may start ahead of the next one to hand over, per request in flight
+WINDOW_PER_REQUEST = 4
+# How often a running chunk is checked against the hedging threshold (seconds)
+HEDGE_POLL_SECONDS = 1.0
+# Passes through the backend chain before a chunk gives up
+MAX_CHAIN_ROUNDS = 3
+
+
+def concurrency_from_env(default: int = DEFAULT_CONCURRENCY) -> int:
+    """Read the number of chunk requests in flight from TTS_CONCURRENCY."""
+    raw = os.environ.get("TTS_CONCURRENCY", "")
+    try:
+        value = int(raw) if raw.strip() else default
+    except ValueError:
+        print(f"⚠ Ignoring invalid TTS_CONCURRENCY={raw!r}, using {default}")
+        value = default
+    return max(1, value)
+
+
+def speech_config() -> types.GenerateContentConfig:
+    """The podcast voices: Speaker 1 is Sulafat, Speaker 2 is Sadachbia.
+
+    Every tool that sends chunks (generators, batch, missing chunks, segment
+    library) uses this, so re-rendered chunks sound like the rest of the episode.
+    """
+    # WICHTIG: multi_speaker_voice_config erfordert IMMER genau 2 Speaker!
+    return types.GenerateContentConfig(
+        temperature=1,
+        response_modalities=["audio"],
+        speech_config=types.SpeechConfig(
+            multi_speaker_voice_config=types.MultiSpeakerVoiceConfig(
+                speaker_voice_configs=[
+                    types.SpeakerVoiceConfig(
+                        speaker="Speaker 1",
+                        voice_config=types.VoiceConfig(
+                            prebuilt_voice_config=types.PrebuiltVoiceConfig(voice_name="Sulafat")
+                        ),
+                    ),
+                    types.SpeakerVoiceConfig(
+                        speaker="Speaker 2",
+                        voice_config=types.VoiceConfig(
+                            prebuilt_voice_config=types.PrebuiltVoiceConfig(voice_name="Sadachbia")
+                        ),
+                    ),
+                ]
+            ),
+        ),
+    )
+
+
+def http_options_from_env() -> types.HttpOptions | None:
+    """Client HTTP options; GEMINI_BASE_URL points the client at another endpoint (e.g. mock_gemini_server.py)."""
+    base_url = os.environ.get("GEMINI_BASE_URL", "").strip()
+    if not base_url:
+        return None
+    print(f"✓ Using Gemini endpoint {base_url}")
+    return types.HttpOptions(base_url=base_url)
+
+
+def extract_audio_parts(response) -> list[tuple[bytes, str]]:
+    """Return (data, mime_type) for every inline audio part of a response."""
+    parts = []
+    candidates = getattr(response, "candidates", None)
+    if not candidates:
+        return parts
+    content = getattr(candidates[0], "content", None)
+    if not content or not getattr(content, "parts", None):
+        return parts
+    for part in content.parts:
+        inline = getattr(part, "inline_data", None)
+        if inline and getattr(inline, "data", None):
+            parts.append((inline.data, inline.mime_type))
+    return parts
+
+
+async def synthesize_chunk(client, model, idx, total, text, config, history=None,
+                           breaker=None, metrics=None, spent=None) -> tuple[list[tuple[bytes, str]], int]:
+    """Synthesize one text chunk; returns (audio segments, requests made).
+
+    Streamed PCM fragments are assembled into one buffer, so a chunk normally
+    comes back as exactly one (data, mime_type) segment.
+
+    Streams first; after two broken streams (disconnects, or streams that
+    end without audio) the chunk is requested once more without streaming. Every request waits for the model's rate limiter,
+    which also absorbs 429 responses; other errors are retried with backoff.
+    The outcome (request time, bytes, disconnects) is added to `history`
+    (a ChunkSizeHistory) unless the chunk was cancelled. Failures count
+    against `breaker` (a backends.CircuitBreaker); once it is open the
+    chunk stops retrying and raises BackendUnavailable. Requests, errors by
+    class and time to first byte go to `metrics` (a RunMetrics), cancelled
+    or not, since they were sent either way; for the same reason they are
+    added to `spent[0]` (a one-element list shared by the callers) however
+    the call ends.
+    """
+    stats = new_request_stats()
+    parts = []
+    ok = False
+    try:
+        parts = await _request_chunk(client, model, idx, total, text, config, stats, breaker)
+        ok = bool(parts)
+        return parts, stats["requests"]
+    except asyncio.CancelledError:
+        history = None  # cancelled because another chunk failed: not a sample
+        raise
+    finally:
+        if spent is not None:
+            spent[0] += stats["requests"]
+        if metrics is not None:
+            metrics.record_requests(idx, model, stats, ok)
+        if history is not None:
+            history.record(model, len(text), stats["seconds"], sum(len(d) for d, _ in parts),
+                           stats["requests"], stats["disconnects"], ok)
+
+
+class _EmptyStream(Exception):
+    """A stream, or the non-streaming response, that brought no audio."""
+
+
+def _failed(breaker, model, reason: str):
+    """Count a failure against the backend; raise BackendUnavailable if its circuit is open."""
+    if breaker is not None and (breaker.record_failure(reason) or breaker.is_open()):
+        raise BackendUnavailable(f"{model}: {reason}")
+
+
+async def _request_chunk(client, model, idx, total, text, config, stats, breaker=None) -> list[tuple[bytes, str]]:
+    limiter = get_rate_limiter(model)
+    contents = [types.Content(role="user", parts=[types.Part.from_text(text=text)])]
+    stream_attempts = 0
+    max_stream_attempts = 10
+    use_stream = True
+    while stream_attempts < max_stream_attempts:
+        if breaker is not None and breaker.is_open():
+            raise BackendUnavailable(f"{model}: circuit open")
+        await limiter.acquire_async(len(text))
+        stats["requests"] += 1
+        stats["ttfb"] = None
+        delay = 0.0
+        started = time.monotonic()
+        try:
+            if use_stream:
+                # Fragments of a broken stream are dropped, the retry yields the whole chunk again
+                assembler = PcmStreamAssembler(len(text) * PCM_BYTES_PER_CHAR_ESTIMATE)
+                stream = await client.aio.models.generate_content_stream(model=model, contents=contents, config=config)
+                async for chunk in stream:
+                    if (
+                        chunk.candidates is None
+                        or chunk.candidates[0].content is None
+                        or chunk.candidates[0].content.parts is None
+                    ):
+                        continue
+                    audio = extract_audio_parts(chunk)
+                    if audio:
+                        if stats["ttfb"] is None:
+                            stats["ttfb"] = time.monotonic() - started
+                        for data, mime_type in audio:
+                            assembler.append(data, mime_type)
+                    else:
+                        print(chunk.text)
+                limiter.report_success()
+                parts = assembler.parts()
+                if parts:
+                    if breaker is not None:
+                        breaker.record_success()
+                    print(f"  ✓ Chunk {idx+1}/{total} completed successfully (stream)")
+                    return parts
+                raise _EmptyStream
+            resp = await client.aio.models.generate_content(model=model, contents=contents, config=config)
+            stats["ttfb"] = time.monotonic() - started
+            limiter.report_success()
+            assembler = PcmStreamAssembler()
+            for data, mime_type in extract_audio_parts(resp):
+                assembler.append(data, mime_type)
+            parts = assembler.parts()
+            if parts:
+                if breaker is not None:
+                    breaker.record_success()
+                print(f"  ✓ Chunk {idx+1}/{total} completed successfully (non-streaming fallback)")
+            else:
+                print("Non-streaming response did not contain audio inline_data; see response repr: ", repr(resp))
+                raise _EmptyStream
+            return parts
+        except _EmptyStream:
+            # The request went through but brought no audio: a failure like any other
+            stream_attempts += 1
+            stats["errors"]["empty"] += 1
+            _failed(breaker, model, "empty stream" if use_stream else "empty response")
+            if not use_stream:
+                return []
+            if stream_attempts >= 2:
+                print(f"  ⚠ Chunk {idx+1}: stream ended without audio {stream_attempts} times — switching to non-streaming fallback")
+                use_stream = False
+                continue
+            delay = 2 + random.uniform(0, 1)
+            print(f"  ⚠ Chunk {idx+1}: stream ended without audio (attempt {stream_attempts}/2): retrying in {delay:.1f}s...")
+        except (httpx.RemoteProtocolError, httpcore.RemoteProtocolError):
+            stream_attempts += 1
+            stats["disconnects"] += 1
+            stats["errors"]["disconnect"] += 1
+            _failed(breaker, model, "stream disconnect")
+            if stream_attempts >= 2:
+                # Use non-streaming fallback after just 2 streaming attempts
+                print(f"  ⚠ Chunk {idx+1}: stream disconnect {stream_attempts} times — switching to non-streaming fallback")
+                use_stream = False
+                continue
+            delay = 2 + random.uniform(0, 1)
+            print(f"  ⚠ Chunk {idx+1}: stream disconnect (attempt {stream_attempts}/2): retrying in {delay:.1f}s...")
+        except ClientError as ce:
+            status = error_status(ce)
+            error_msg = getattr(ce, "message", getattr(ce, "args", None))
+            print(f"  ✗ Chunk {idx+1}: API error {status}: {error_msg}")
+            stats["errors"]["rate_limited" if status == 429 else "other"] += 1
+            if status == 429:
+                stream_attempts += 1
+                pause = limiter.report_rate_limited(retry_after_from_error(ce))
+                _failed(breaker, model, "rate limited")
+                print(f"  ⚠ Rate limited (quota exceeded). Pausing requests {pause:.1f}s, now at {limiter.describe()} (attempt {stream_attempts}/{max_stream_attempts})")
+                if stream_attempts < max_stream_attempts:
+                    continue
+            else:
+                _failed(breaker, model, f"API error {status}")
+            raise
+        except Exception as e:
+            stream_attempts += 1
+            stats["errors"]["other"] += 1
+            _failed(breaker, model, type(e).__name__)
+            if stream_attempts >= max_stream_attempts:
+                raise
+            delay = (3 ** stream_attempts) + random.uniform(0, 1)
+            print(f"  ⚠ Chunk {idx+1}: unexpected error: {str(e)[:80]}... Retry in {delay:.1f}s (attempt {stream_attempts}/{max_stream_attempts})")
+        finally:
+            # Time spent in the request itself; limiter waits and backoff don't count
+            stats["seconds"] += time.monotonic() - started
+        await asyncio.sleep(delay)
+    return []
+
+
+async def synthesize_hedged(client, model, idx, total, text, config, history=None, hedge=None,
+                            breaker=None, metrics=None, spent=None) -> tuple[list[tuple[bytes, str]], int, str]:
+    """synthesize_chunk() with an optional duplicate request for stragglers.
+
+    Once the chunk has run longer than `hedge.threshold()` (a HedgePolicy)
+    and the hedging budget allows, the same text is requested again, from
+    `hedge.model` if set. The first request that returns audio wins and the
+    other is cancelled; if both fail, the first request's error propagates.
+    Returns (audio segments, requests made, model that produced them); the
+    requests of both calls are also added to `spent[0]` if given, which
+    counts them when an error propagates.
+    """
+    started = time.monotonic()
+    spent = spent if spent is not None else [0]
+    before = spent[0]
+    primary = asyncio.create_task(synthesize_chunk(client, model, idx, total, text, config, history, breaker,
+                                                       metrics, spent))
+    tasks = {primary: model}
+    result = None
+    try:
+        while True:
+            if hedge is not None and len(tasks) == 1 and not primary.done():
+                threshold = hedge.threshold()
+                elapsed = time.monotonic() - started
+                if threshold is not None and elapsed >= threshold and hedge.try_spend(total):
+                    backup_model = hedge.model or model
+                    print(f"  ⧉ Chunk {idx+1}: no audio after {elapsed:.0f}s "
+                          f"(p{hedge.percentile:g} {threshold:.0f}s), duplicate request to {backup_model}")
+                    tasks[asyncio.create_task(synthesize_chunk(
+                        client, backup_model, idx, total, text, config, history,
+                        breaker if backup_model == model else None, metrics, spent))] = backup_model
+            pending = [task for task in tasks if not task.done()]
+            if not pending:
+                break
+            timeout = HEDGE_POLL_SECONDS if hedge is not None and len(tasks) == 1 else None
+            done, _ = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    parts, _ = task.result()
+                    if parts:
+                        if task is not primary:
+                            hedge.won += 1
+                            print(f"  ⧉ Chunk {idx+1}: duplicate request to {tasks[task]} won")
+                        if hedge is not None:
+                            hedge.record(time.monotonic() - started)
+                        result = parts, tasks[task]
+                        break
+            if result is not None or all(task.done() for task in tasks):
+                break
+        # No request returned audio
+        if result is None and primary.exception() is not None:
+            raise primary.exception()
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+    # After the loser was cancelled, so its requests are counted too
+    parts, source = result if result is not None else ([], model)
+    return parts, spent[0] - before, source
+
+
+async def synthesize_with_chain(client, chain, idx, total, text, config, history=None,
+                                hedge=None, metrics=None) -> tuple[list[tuple[bytes, str]], int, str]:
+    """Synthesize one chunk on the first backend of `chain` (a BackendChain) that delivers.
+
+    A backend whose circuit opens while the chunk is on it, or that fails
+    the chunk, hands it to the next one. When every backend is open the
+    chunk waits for the first cooldown to end; after MAX_CHAIN_ROUNDS passes
+    through the chain the last error propagates.
+    Returns (audio segments, requests made, backend model); the requests
+    count those of backends that failed the chunk.
+    """
+    spent = [0]
+    error = None
+    for _ in range(MAX_CHAIN_ROUNDS):
+        for backend in chain.available():
+            try:
+                if backend.local:
+                    parts = await chain.synthesize_local(text)
+                    backend.breaker.record_success()
+                    print(f"  ✓ Chunk {idx+1}/{total} completed with local speech")
+                    source = backend.model
+                else:
+                    parts, _, source = await synthesize_hedged(client, backend.model, idx, total, text, config,
+                                                               history, hedge, backend.breaker, metrics, spent)
+            except BackendUnavailable as e:
+                print(f"  ↪ Chunk {idx+1}: {e} — trying the next backend")
+                error = e
+                continue
+            except ImportError as e:
+                backend.breaker.disable(f"not installed: {e}")
+                error = e
+                continue
+            except Exception as e:
+                if backend.local:
+                    # _request_chunk() already counted every failed request of a remote backend
+                    backend.breaker.record_failure(type(e).__name__)
+                print(f"  ↪ Chunk {idx+1}: {backend.model} failed ({str(e)[:80]}) — trying the next backend")
+                error = e
+                continue
+            if parts:
+                backend.chunks += 1
+                return parts, spent[0], source
+        wait = min(backend.breaker.retry_in() for backend in chain.backends)
+        if wait == float("inf"):
+            break
+        if wait > 0:
+            print(f"  ⏸ Chunk {idx+1}: every backend is unavailable, waiting {wait:.0f}s")
+            await asyncio.sleep(wait)
+    if error is not None:
+        raise error
+    return [], spent[0], chain.backends[0].model
+
+
+async def synthesize_chunks(client, model, chunks, config, on_chunk_ready, concurrency=DEFAULT_CONCURRENCY, cache=None,
+                            history=None, window=None, hedge=None, chain=None, metrics=None, slots=None):
+    """Synthesize all chunks with at most `concurrency` requests in flight.
+
+    `on_chunk_ready(idx, parts, attempts)` is called once per chunk, in chunk order: a
+    chunk that finishes early waits until every chunk before it is done.
+    It runs in a worker thread, one call at a time, and may block (file
+    writes, a full episode writer queue): the requests in flight keep
+    streaming meanwhile, only the handover stops.
+    A chunk only starts while it is fewer than `window` chunks (default
+    WINDOW_PER_REQUEST * concurrency) ahead of the next one to hand over,
+    so a slow chunk or a blocked handover bounds how much finished audio
+    waits in memory.
+    Chunks found in `cache` (a ChunkAudioCache) skip the model entirely;
+    synthesized ones are recorded in `history` (a ChunkSizeHistory).
+    With `hedge` (a HedgePolicy) stragglers get a duplicate request, see
+    synthesize_hedged(). With `chain` (a BackendChain) chunks go to its
+    backends instead of `model`, see synthesize_with_chain(); the cache is
+    then checked for every Gemini model of the chain, in chain order.
+    Per-chunk latency, requests and errors are recorded in `metrics` (a
+    RunMetrics) if given. `slots` replaces the per-call semaphore with an
+    async context manager shared by several episodes (batch.FairSlots);
+    `concurrency` then only sizes the window.
+    The first failing chunk cancels the rest and its exception propagates.
+    """
+    models = [model] if chain is None else [b.model for b in chain.backends if not b.local]
+    semaphore = slots or asyncio.Semaphore(max(1, concurrency))
+    window = window or WINDOW_PER_REQUEST * max(1, concurrency)
+    handed_over = asyncio.Condition()
+    handing_over = asyncio.Lock()
+    finished = {}
+    next_idx = 0
+
+    async def run(idx, text):
+        nonlocal next_idx
+        async with handed_over:
+            await handed_over.wait_for(lambda: idx < next_idx + window)
+        parts = None
+        started = time.monotonic()
+        if cache is not None:
+            # One lookup per chunk: a miss on every model counts once
+            parts = cache.get_any(cache_key(text, cached_model, config) for cached_model in models)
+        attempts = 0
+        if parts is not None:
+            print(f"\n[{idx+1}/{len(chunks)}] ✓ Chunk served from cache (len={len(text)} chars)")
+            source_model = "cache"
+        else:
+            async with semaphore:
+                print(f"\n[{idx+1}/{len(chunks)}] Processing chunk (len={len(text)} chars)...")
+                started = time.monotonic()
+                if chain is None:
+                    parts, attempts, source_model = await synthesize_hedged(
+                        client, model, idx, len(chunks), text, config, history, hedge, metrics=metrics)
+                else:
+                    parts, attempts, source_model = await synthesize_with_chain(
+                        client, chain, idx, len(chunks), text, config, history, hedge, metrics)
+            # Cached under the model that produced the audio; local speech is not cached
+            if cache is not None and source_model != LOCAL:
+                cache.put(cache_key(text, source_model, config), parts)
+        if metrics is not None and parts:
+            metrics.record_chunk(idx, len(text), parts, time.monotonic() - started, source_model)
+        finished[idx] = (parts, attempts)
+        if next_idx in finished:
+            # Whoever holds the lock hands over every chunk that is ready, in order
+            async with handing_over:
+                while next_idx in finished:
+                    await asyncio.to_thread(on_chunk_ready, next_idx, *finished.pop(next_idx))
+                    next_idx += 1
+                    async with handed_over:
+                        handed_over.notify_all()
+
+    tasks = [asyncio.create_task(run(idx, text)) for idx, text in enumerate(chunks)]
+    try:
+        await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+
+
+def synthesize_all(client, model, chunks, config, on_chunk_ready, concurrency=DEFAULT_CONCURRENCY, cache=None,
+                   history=None, window=None, hedge=None, chain=None, metrics=None):
+    """Blocking wrapper around synthesize_chunks() for the synchronous scripts."""
+    asyncio.run(synthesize_chunks(client, model, chunks, config, on_chunk_ready, concurrency, cache, history, window,
+                                  hedge, chain, metrics))
@@ -0,0 +1,484 @@
+"""
+WAV helpers shared by the generator and the maintenance scripts.
+
+Covers the MIME handling for Gemini's raw PCM output ("audio/L16;rate=24000"),
+RIFF/WAVE header construction, the assembler that turns the streamed PCM
+fragments of one text chunk into exactly one WAV segment, and concatenation
+that copies data chunks with kernel zero-copy calls where available and
+converts chunks in a different format on the fly.
+"""
+import contextlib
+import errno
+import mimetypes
+import os
+import re
+import struct
+import tempfile
+import threading
+import weakref
+from collections import Counter, namedtuple
+
+# Speech output is ~15 characters per second at 24 kHz / 16 bit mono
+PCM_BYTES_PER_CHAR_ESTIMATE = 3200
+
+
+def convert_to_wav(data: bytes, mime_type: str) -> bytes:
+    """
+    Convert raw PCM-like audio data into a WAV container by prepending a
+    proper RIFF/WAVE header. This handles cases like mime_type "audio/L16;rate=24000"
+    where the API returns raw PCM bytes.
+    """
+    return wav_header_for_mime(len(data), mime_type) + data
+
+
+def wav_header(data_size: int, sample_rate: int = 24000, num_channels: int = 1, bits_per_sample: int = 16) -> bytes:
+    """Canonical 44-byte PCM RIFF/WAVE header for `data_size` bytes of audio."""
+    bytes_per_sample = bits_per_sample // 8
+    block_align = num_channels * bytes_per_sample
+    byte_rate = sample_rate * block_align
+    chunk_size = 36 + data_size
+
+    return struct.pack(
+        "<4sI4s4sIHHIIHH4sI",
+        b"RIFF",
+        chunk_size,
+        b"WAVE",
+        b"fmt ",
+        16,
+        1,  # PCM
+        num_channels,
+        sample_rate,
+        byte_rate,
+        block_align,
+        bits_per_sample,
+        b"data",
+        data_size,
+    )
+
+
+def wav_header_for_mime(data_size: int, mime_type: str) -> bytes:
+    """WAV header for raw PCM described by a MIME type like "audio/L16;rate=24000"."""
+    params = parse_audio_mime_type(mime_type)
+    return wav_header(
+        data_size,
+        sample_rate=params.get("rate") or 24000,
+        num_channels=params.get("channels") or 1,
+        bits_per_sample=params.get("bits_per_sample") or 16,
+    )
+
+
+def parse_audio_mime_type(mime_type: str) -> dict[str, int | None]:
+    """Parse bits per sample and sample rate from an audio MIME type string.
+
+    Examples:
+      - "audio/L16;rate=24000"
+      - "audio/L16;codec=pcm;rate=24000"
+
+    Returns a dict with keys: bits_per_sample (int), rate (int), channels (int)
+    """
+    bits_per_sample = 16
+    rate = 24000
+    channels = 1
+
+    if not mime_type:
+        return {"bits_per_sample": bits_per_sample, "rate": rate, "channels": channels}
+
+    parts = [p.strip() for p in mime_type.split(";") if p.strip()]
+    for p in parts:
+        low = p.lower()
+        if low.startswith("rate="):
+            try:
+                rate = int(p.split("=", 1)[1])
+            except Exception:
+                pass
+        elif low.startswith("audio/l") and "l" in low:
+            # e.g. L16
+            try:
+                bits_per_sample = int(re.split(r"l", low, maxsplit=1)[1])
+            except Exception:
+                pass
+        elif low.startswith("channels=") or low.startswith("ch="):
+            try:
+                channels = int(p.split("=", 1)[1])
+            except Exception:
+                pass
+
+    return {"bits_per_sample": bits_per_sample, "rate": rate, "channels": channels}
+
+
+def get_extension_and_needs_wav(mime_type: str) -> tuple[str, bool]:
+    """Return a file extension for the mime_type and whether the raw data
+    needs a WAV header (i.e., it's raw PCM like L16) or already a container
+    (mp3, ogg, m4a, etc.).
+    """
+    if not mime_type:
+        return ".wav", True
+    mt = mime_type.split(";", 1)[0].strip().lower()
+    # Common container types
+    mapping = {
+        "audio/mpeg": (".mp3", False),
+        "audio/mp3": (".mp3", False),
+        "audio/ogg": (".ogg", False),
+        "audio/webm": (".webm", False),
+        "audio/mp4": (".m4a", False),
+        "audio/x-m4a": (".m4a", False),
+        "audio/x-wav": (".wav", False),
+        "audio/wav": (".wav", False),
+        "audio/wave": (".wav", False),
+    }
+    if mt in mapping:
+        return mapping[mt]
+
+    # Raw PCM / L16 types (these need a WAV header)
+    if "l16" in mt or "audio/l" in mt or "pcm" in mt or mt.startswith("audio/l"):
+        return ".wav", True
+
+    # Fallback: try python's mimetypes
+    ext = mimetypes.guess_extension(mt)
+    if ext:
+        return ext, False
+
+    # Default to wav + add header
+    return ".wav", True
+
+
+class PcmStreamAssembler:
+    """Collect the streamed audio fragments of one text chunk into one segment.
+
+    Consecutive raw PCM fragments with the same MIME type are appended into a
+    single preallocated, growable buffer, so a chunk yields one segment with
+    one WAV header no matter how many pieces the stream delivered. A fragment
+    with a different MIME type (or an already containerised format like mp3)
+    starts a new segment.
+    """
+
+    def __init__(self, expected_bytes: int = 0):
+        self._expected = max(0, expected_bytes)
+        # [buffer, used_bytes, mime_type, needs_wav]
+        self._segments = []
+
+    def append(self, data: bytes, mime_type: str):
+        _, needs_wav = get_extension_and_needs_wav(mime_type)
+        current = self._segments[-1] if self._segments else None
+        if current is None or not needs_wav or not current[3] or current[2] != mime_type:
+            current = [bytearray(max(self._expected, len(data)) if needs_wav else 0), 0, mime_type, needs_wav]
+            self._segments.append(current)
+        buf, used = current[0], current[1]
+        end = used + len(data)
+        if end > len(buf):
+            # Grow geometrically so a long stream costs O(n) copies in total
+            buf.extend(bytes(max(end - len(buf), len(buf))))
+        buf[used:end] = data
+        current[1] = end
+
+    def __len__(self) -> int:
+        return sum(seg[1] for seg in self._segments)
+
+    def parts(self) -> list[tuple[memoryview, str]]:
+        """Assembled segments as (data, mime_type) views, without copying; normally exactly one."""
+        return [(memoryview(buf)[:used], mime) for buf, used, mime, _ in self._segments]
+
+
+def write_audio_segment(path_stem: str, data: bytes, mime_type: str) -> str:
+    """Write one assembled segment to `path_stem` + extension, header written once.
+
+    Raw PCM gets its WAV header prepended in the same open(); containerised
+    formats are written unchanged. Returns the file name written.
+    """
+    extension, needs_wav = get_extension_and_needs_wav(mime_type)
+    file_name = f"{path_stem}{extension}"
+    with open(file_name, "wb") as f:
+        if needs_wav:
+            f.write(wav_header_for_mime(len(data), mime_type))
+        f.write(data)
+    return file_name
+
+
+# Bytes copied per call when streaming audio between files
+COPY_BLOCK_BYTES = 1 << 20
+
+WavParams = namedtuple("WavParams", "nchannels sampwidth framerate audio_format")
+# data_offset/data_length locate the samples; `chunks` lists every RIFF chunk as (id, offset, size)
+WavHeader = namedtuple("WavHeader", "params data_offset data_length byte_rate block_align riff_size file_size chunks")
+
+# One chunk of a concat: its data range, the part copied verbatim and, with seam
+# processing, the faded edge frames (NumPy arrays) and the gap to the previous chunk,
+# and the linear gain of loudness normalization
+Piece = namedtuple("Piece", "path offset length body_offset body_length head tail gap gain", defaults=(1.0,))
+
+
+def whole_piece(path, offset: int, length: int) -> Piece:
+    """Piece copying a data range unchanged (no seam processing)."""
+    return Piece(path, offset, length, offset, length, None, None, 0)
+
+WAVE_FORMAT_PCM = 1
+WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+_CHUNK_HEADER = struct.Struct("<4sI")
+
+
+def parse_wav_header(source) -> WavHeader:
+    """Parse the RIFF structure of a WAV file without reading its audio.
+
+    `source` is a path or a binary file object opened for reading (its
+    position is changed). Only the 12-byte RIFF header, the 8-byte chunk
+    headers and the fmt chunk body are read; other chunks (LIST, fact, ...)
+    are skipped by seeking, so the cost does not depend on the file size.
+    WAVE_FORMAT_EXTENSIBLE files report their sub-format (1 = PCM) as
+    audio_format. The data length is clamped to the file size and to whole
+    frames, so truncated files and streaming headers with a 0xFFFFFFFF
+    size still yield a valid byte range. Raises ValueError for anything
+    that is not a RIFF/WAVE file with fmt and data chunks.
+    """
+    if isinstance(source, (str, bytes, os.PathLike)):
+        with open(source, "rb") as f:
+            return parse_wav_header(f)
+    name = getattr(source, "name", "<file>")
+    file_size = os.fstat(source.fileno()).st_size
+    source.seek(0)
+    riff = source.read(12)
+    if len(riff) < 12 or riff[:4] != b"RIFF" or riff[8:12] != b"WAVE":
+        raise ValueError(f"{name}: not a RIFF/WAVE file")
+    riff_size = struct.unpack_from("<I", riff, 4)[0]
+    params = byte_rate = block_align = None
+    chunks = []
+    pos = 12
+    while True:
+        header = source.read(8)
+        if len(header) < 8:
+            raise ValueError(f"{name}: no {'data' if params else 'fmt'} chunk found")
+        chunk_id, chunk_size = _CHUNK_HEADER.unpack(header)
+        chunks.append((chunk_id.decode("latin-1"), pos, chunk_size))
+        pos += 8
+        if chunk_id == b"fmt ":
+            if chunk_size < 16:
+                raise ValueError(f"{name}: fmt chunk too short ({chunk_size} bytes)")
+            fmt = source.read(min(chunk_size, 40))
+            if len(fmt) < 16:
+                raise ValueError(f"{name}: truncated fmt chunk")
+            audio_format, channels, rate, byte_rate, block_align, bits = struct.unpack_from("<HHIIHH", fmt)
+            if audio_format == WAVE_FORMAT_EXTENSIBLE and len(fmt) >= 26:
+                audio_format = struct.unpack_from("<H", fmt, 24)[0]
+            if channels == 0 or bits == 0:
+                raise ValueError(f"{name}: invalid fmt chunk ({channels} channels, {bits} bits)")
+            params = WavParams(channels, (bits + 7) // 8, rate, audio_format)
+        elif chunk_id == b"data":
+            if params is None:
+                raise ValueError(f"{name}: data chunk before fmt chunk")
+            length = max(0, min(chunk_size, file_size - pos))
+            frame = params.nchannels * params.sampwidth
+            return WavHeader(params, pos, length - length % frame, byte_rate, block_align,
+                             riff_size, file_size, tuple(chunks))
+        # Chunks are word-aligned: odd sizes carry one pad byte
+        pos += chunk_size + (chunk_size & 1)
+        source.seek(pos)
+
+
+def read_wav_layout(path):
+    """(WavParams, data_offset, data_length) of a WAV file; see parse_wav_header()."""
+    header = parse_wav_header(path)
+    return header.params, header.data_offset, header.data_length
+
+
+# Kernel copy methods still to try, per destination file: a filesystem that
+# refuses one for one file says nothing about the others
+_copy_methods = weakref.WeakKeyDictionary()
+_copy_methods_lock = threading.Lock()
+
+
+def copy_byte_range(src, dst, offset: int, count: int, block_bytes: int = COPY_BLOCK_BYTES) -> int:
+    """Copy `count` bytes at `offset` of file `src` to the current position of `dst`.
+
+    Both files must be unbuffered (buffering=0). Prefers the kernel's
+    zero-copy paths (os.copy_file_range, then os.sendfile) so no audio passes
+    through Python memory, and falls back to buffered copying through one
+    reusable buffer where they are unavailable or refused (Windows, macOS,
+    some filesystems). A method that is refused once is not tried again for
+    this destination file; the next method resumes after the bytes already
+    copied. `dst` may also be any object with write() (no kernel copy then).
+    Returns the number of bytes copied; raises ValueError if `src` ends
+    before `count` bytes.
+    """
+    copied = [0]
+    if hasattr(dst, "fileno"):
+        with _copy_methods_lock:
+            methods = _copy_methods.setdefault(dst, [m for m in _KERNEL_COPY if hasattr(os, m)])
+        while methods:
+            method = methods[0]
+            try:
+                _kernel_copy(_KERNEL_COPY[method], src.fileno(), dst.fileno(), offset, count, copied)
+                return _check_copied(src, offset, count, copied[0])
+            except OSError as e:
+                if e.errno not in _UNSUPPORTED_ERRNOS:
+                    raise
+            # Refused by the filesystem or the file type
+            with _copy_methods_lock:
+                if methods and methods[0] == method:
+                    methods.pop(0)
+    copied[0] += _buffered_copy(src, dst, offset + copied[0], count - copied[0], block_bytes)
+    return _check_copied(src, offset, count, copied[0])
+
+
+def _check_copied(src, offset: int, count: int, copied: int) -> int:
+    if copied < count:
+        raise ValueError(f"{getattr(src, 'name', src)}: only {copied} of {count} bytes at offset {offset} could be copied")
+    return copied
+
+
+def _buffered_copy(src, dst, offset: int, count: int, block_bytes: int) -> int:
+    """Copy through one reusable buffer; returns the bytes copied."""
+    view = memoryview(bytearray(max(1, min(block_bytes, count))))
+    src.seek(offset)
+    copied = 0
+    while copied < count:
+        n = src.readinto(view[:min(count - copied, len(view))])
+        if not n:
+            break  # source shorter than announced
+        dst.write(view[:n])
+        copied += n
+    return copied
+
+
+_UNSUPPORTED_ERRNOS = {errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP, errno.ENOTSUP}
+
+
+# (source fd, destination fd, count, source offset) -> bytes moved, in order of preference
+_KERNEL_COPY = {
+    "copy_file_range": lambda src_fd, dst_fd, n, offset: os.copy_file_range(src_fd, dst_fd, n, offset),
+    "sendfile": lambda src_fd, dst_fd, n, offset: os.sendfile(dst_fd, src_fd, offset, n),
+}
+
+
+def _kernel_copy(call, src_fd: int, dst_fd: int, offset: int, count: int, copied: list):
+    """Drive a _KERNEL_COPY call until `count` bytes are moved.
+
+    copied[0] counts the bytes moved so far, also when the call fails midway.
+    """
+    while copied[0] < count:
+        n = call(src_fd, dst_fd, min(count - copied[0], 1 << 30), offset + copied[0])
+        if n == 0:
+            return  # source shorter than announced
+        copied[0] += n
+
+
+def convert_for_concat(path, output_path, target: WavParams) -> str:
+    # Runs in a worker process; NumPy is only needed once a chunk must be converted
+    from resample_chunks import resample_file
+    resample_file(path, output_path, target.framerate, sampwidth=target.sampwidth, channels=target.nchannels)
+    return output_path
+
+
+def process_pool(jobs: int, workers: int | None = None):
+    """Executor for CPU-bound audio work: forked processes, or threads where fork is unavailable."""
+    # Imported here: only concat needs them, WAV inspection should start fast
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+    workers = max(1, min(jobs, workers or os.cpu_count() or 1))
+    if "fork" in multiprocessing.get_all_start_methods():
+        return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("fork"))
+    # Spawned workers would re-run the calling script's module-level code
+    return ThreadPoolExecutor(max_workers=workers)
+
+
+class TeeWriter:
+    """Write-only file object that copies every write to a second writer."""
+
+    def __init__(self, out, copy):
+        self.out, self.copy = out, copy
+
+    def write(self, data):
+        self.copy.write(data)
+        return self.out.write(data)
+
+
+def concat_wav_files(files, output_path, on_mismatch: str = "convert", target: WavParams | None = None,
+                     workers: int | None = None, loudness_target: float | None = None,
+                     true_peak_db: float = -1.0, seams: dict | None = None, encode: dict | None = None):
+    """Concatenate WAV files into `output_path` in constant memory.
+
+    Each input's data chunk is located with read_wav_layout() and its byte
+    range copied straight into the output with copy_byte_range() (kernel
+    zero-copy where possible). The output starts with a placeholder header
+    whose RIFF/data sizes are patched in at the end.
+
+    The output format is `target`, or else the most common format among the
+    inputs. Inputs in another format (sample rate, width, channels) are
+    converted in a process pool while the matching ones are copied, and
+    spliced in at their position (`on_mismatch="convert"`). With "skip" they
+    are left out with a warning; with "error" they raise ValueError.
+
+    With `seams` (settings for seams.plan_seams()) the silence at every
+    chunk boundary is trimmed to a fixed pause and the edges crossfaded;
+    only the boundary regions are decoded. With `loudness_target` (LUFS)
+    the audio is streamed through loudness.write_normalized(): per-chunk and
+    episode gain plus a true-peak limiter at `true_peak_db`. With `encode`
+    (settings for audio_encoder.StreamingEncoder) every block written to the
+    WAV is also piped to ffmpeg, so the compressed file is done with the WAV.
+
+    Returns (WavParams of the output, audio bytes written, list of files used).
+    """
+    layouts = [(path, *read_wav_layout(path)) for path in files]
+    if not layouts:
+        return None, 0, []
+    if target is None:
+        # Ties go to the format seen first
+        counts = Counter(p for _, p, _, _ in layouts)
+        target = max(counts, key=counts.get)
+    odd = [path for path, p, _, _ in layouts if p != target]
+    if odd and on_mismatch == "error":
+        p = next(p for _, p, _, _ in layouts if p != target)
+        raise ValueError(f"{odd[0]} has incompatible WAV params {p.nchannels}ch/{p.sampwidth * 8}bit/{p.framerate}Hz")
+
+    written = 0
+    used = []
+    sources = []
+    with contextlib.ExitStack() as stack:
+        converted = {}
+        if odd and on_mismatch == "convert":
+            tmpdir = stack.enter_context(tempfile.TemporaryDirectory(
+                prefix=".concat-", dir=os.path.dirname(os.path.abspath(output_path))))
+            pool = stack.enter_context(process_pool(len(odd), workers))
+            for n, path in enumerate(odd):
+                converted[path] = pool.submit(convert_for_concat, path, os.path.join(tmpdir, f"{n}.wav"), target)
+        out = stack.enter_context(open(output_path, "wb", buffering=0))
+        out.write(wav_header(0, target.framerate, target.nchannels, target.sampwidth * 8))
+        # Audio goes through `sink`; headers only to the WAV
+        sink = out
+        if encode is not None:
+            from audio_encoder import StreamingEncoder
+            sink = TeeWriter(out, stack.enter_context(StreamingEncoder(target, **encode)))
+        for path, p, offset, length in layouts:
+            source = path
+            if p != target:
+                if path not in converted:
+                    print(f"⚠ Warning: {path} has incompatible params, skipping.")
+                    continue
+                try:
+                    source = converted[path].result()
+                    _, offset, length = read_wav_layout(source)
+                except (OSError, ValueError) as e:
+                    print(f"⚠ Warning: could not convert {path} ({e}), skipping.")
+                    continue
+                print(f"↻ Converted {path}: {p.nchannels}ch/{p.sampwidth * 8}bit/{p.framerate}Hz -> "
+                      f"{target.nchannels}ch/{target.sampwidth * 8}bit/{target.framerate}Hz")
+            if loudness_target is None and seams is None:
+                with open(source, "rb", buffering=0) as src:
+                    written += copy_byte_range(src, sink, offset, length)
+            else:
+                sources.append((source, offset, length))
+            used.append(path)
+        if sources:
+            if seams is not None:
+                from seams import plan_seams
+                pieces = plan_seams(sources, target, **seams)
+            else:
+                pieces = [whole_piece(*source) for source in sources]
+            if loudness_target is not None:
+                from loudness import write_normalized
+                written = write_normalized(pieces, sink, target, loudness_target, true_peak_db)
+            else:
+                from seams import write_pieces
+                written = write_pieces(pieces, sink, target)
+        # Final sizes are only known now
+        out.seek(0)
+        out.write(wav_header(written, target.framerate, target.nchannels, target.sampwidth * 8))
+    return target, written, used